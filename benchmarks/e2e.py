@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+# End-to-end benchmark of the spider against the local stand-in site
+# (benchmarks/mock_eex.py) and a temporary PostgreSQL cluster.
+#
+# Every mode is run as a real 'scrapy crawl' process with metrics enabled.
+# Pages, items and inserted rows are read from its metrics snapshot and the
+# memory of the process and its browsers is sampled while it runs.
+# The PostgreSQL server binaries (initdb, pg_ctl) must be on PATH or given
+# with --pg-bin.
+#
+# Usage (from the project directory):
+#     python -m benchmarks.e2e --modes recent,history --period 2017-09 --country germany \
+#         --page-size 100 --records-per-day 50 --latency-ms 20
+
+import argparse
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import psycopg2
+
+from benchmarks.mock_eex import MockEexServer
+from scrapers.browser import process_tree_rss_kb
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class TemporaryPostgres(object):
+    """A PostgreSQL cluster in a temporary directory, removed when it is stopped."""
+
+    def __init__(self, pg_bin=None):
+        self.pg_bin = pg_bin
+        self.directory = tempfile.mkdtemp(prefix='eex-bench-pg-')
+        self.data_directory = os.path.join(self.directory, 'data')
+        self.port = free_port()
+
+    def _command(self, name):
+        return os.path.join(self.pg_bin, name) if self.pg_bin else name
+
+    def start(self):
+        subprocess.check_call([self._command('initdb'), '-D', self.data_directory, '-A', 'trust',
+                               '-U', 'postgres'], stdout=subprocess.DEVNULL)
+        subprocess.check_call([self._command('pg_ctl'), '-D', self.data_directory, '-w', '-l',
+                               os.path.join(self.directory, 'postgres.log'),
+                               '-o', '-p {0} -k {1} -c listen_addresses=127.0.0.1'.format(self.port, self.directory),
+                               'start'], stdout=subprocess.DEVNULL)
+        connection = psycopg2.connect(**self.credentials)
+        with connection.cursor() as cur:
+            cur.execute('CREATE SCHEMA IF NOT EXISTS covalis1;')
+        connection.commit()
+        connection.close()
+        return self
+
+    def stop(self):
+        try:
+            subprocess.call([self._command('pg_ctl'), '-D', self.data_directory, '-m', 'fast', '-w', 'stop'],
+                            stdout=subprocess.DEVNULL)
+        finally:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    @property
+    def credentials(self):
+        return {'database': 'postgres', 'user': 'postgres', 'host': '127.0.0.1', 'password': '',
+                'port': self.port}
+
+    def count_rows(self):
+        connection = psycopg2.connect(**self.credentials)
+        with connection.cursor() as cur:
+            cur.execute("SELECT to_regclass('covalis1.eex_transparency') IS NOT NULL;")
+            if not cur.fetchone()[0]:
+                return 0
+            cur.execute('SELECT count(*) FROM covalis1.eex_transparency;')
+            count = cur.fetchone()[0]
+        connection.close()
+        return count
+
+
+# returns the counters of a metrics snapshot summed over countries
+def read_counters(snapshot_file_name):
+    counters = {}
+    if not os.path.exists(snapshot_file_name):
+        return counters
+    pattern = re.compile(r'^eex_events_total\{name="([^"]*)",country="[^"]*"\} (\S+)$')
+    with open(snapshot_file_name) as snapshot_file:
+        for line in snapshot_file:
+            match = pattern.match(line.strip())
+            if match:
+                counters[match.group(1)] = counters.get(match.group(1), 0) + float(match.group(2))
+    return counters
+
+
+# runs the spider in one mode and returns its measurements
+def run_mode(mode, args, server, postgres, work_directory):
+    name = '{0}-{1}'.format(mode, args.fetch_mode)
+    snapshot_file_name = os.path.join(work_directory, name + '.prom')
+    settings = {
+        'EEX_BASE_URL': server.base_url,
+        'EEX_API_URL': server.base_url + '/api/{path}',
+        'EEX_API_PAGE_SIZE': args.page_size,
+        'POSTGRE_CREDENTIALS': json.dumps(postgres.credentials),
+        'METRICS_ENABLED': 1,
+        'METRICS_SNAPSHOT_FILE': snapshot_file_name,
+        'METRICS_SNAPSHOT_INTERVAL': 3600,
+        'SPIDER_STATE_FILE': os.path.join(work_directory, name + '-state.json'),
+        'PAYLOAD_CAPTURE': 0,
+        'PHANTOMJS_PATH': os.path.join(PROJECT_DIR, 'phantomjs', 'linux', 'phantomjs'),
+        # no proxies and user agent lists for the local site
+        'DOWNLOADER_MIDDLEWARES': '{}',
+        'LOG_LEVEL': 'WARNING',
+    }
+    if args.page_sizes is not None:
+        settings['PAGE_SIZES'] = args.page_sizes
+    if args.normalized:
+        settings['POSTGRE_NORMALIZED'] = 1
+    command = [sys.executable, '-m', 'scrapy', 'crawl', 'eex_transparency',
+               '-a', 'mode=' + mode, '-a', 'fetch_mode=' + args.fetch_mode,
+               '-a', 'log_file=' + os.path.join(work_directory, name + '.log')]
+    if mode == 'history':
+        command += ['-a', 'period=' + args.period]
+    if args.country:
+        command += ['-a', 'country=' + args.country]
+    if args.workers:
+        command += ['-a', 'workers=' + str(args.workers)]
+    for key, value in settings.items():
+        command += ['-s', '{0}={1}'.format(key, value)]
+
+    rows_before = postgres.count_rows()
+    environment = dict(os.environ, PYTHONPATH=PROJECT_DIR, SCRAPY_SETTINGS_MODULE='scrapers.settings')
+    start_time = time.time()
+    # checkpoints and logs of the spider are written to the work directory
+    process = subprocess.Popen(command, cwd=work_directory, env=environment)
+    peak_rss_kb = 0
+    while process.poll() is None:
+        peak_rss_kb = max(peak_rss_kb, process_tree_rss_kb(process.pid))
+        time.sleep(0.2)
+    seconds = time.time() - start_time
+
+    counters = read_counters(snapshot_file_name)
+    return {
+        'name': name,
+        'exit_code': process.returncode,
+        'seconds': seconds,
+        'pages': counters.get('pages', 0),
+        'items': counters.get('items', 0),
+        'db_rows': counters.get('db_rows_inserted', 0),
+        'table_rows': postgres.count_rows() - rows_before,
+        'peak_rss_mb': peak_rss_kb / 1024.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark against the local stand-in site.')
+    parser.add_argument('--modes', default='recent,history', help='comma separated modes to run')
+    parser.add_argument('--fetch-mode', default='browser', choices=('browser', 'api'))
+    parser.add_argument('--period', default='2017-09', help='period of history mode')
+    parser.add_argument('--country', default=None, help='a single country, all countries if not given')
+    parser.add_argument('--workers', type=int, default=None, help='number of browsers')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--max-page-size', type=int, default=0, help='largest page size the site accepts')
+    parser.add_argument('--page-sizes', default=None, help='PAGE_SIZES setting of the spider, e.g. 1000,500,200')
+    parser.add_argument('--normalized', action='store_true', help='save to the normalized schema')
+    parser.add_argument('--records-per-day', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--pg-bin', default=None, help='directory of initdb and pg_ctl')
+    args = parser.parse_args()
+
+    server = MockEexServer(0, args.page_size, args.records_per_day, args.latency_ms, args.failure_rate,
+                           max_page_size=args.max_page_size).start()
+    postgres = TemporaryPostgres(args.pg_bin).start()
+    work_directory = tempfile.mkdtemp(prefix='eex-bench-')
+    results = []
+    try:
+        for mode in args.modes.split(','):
+            results.append(run_mode(mode, args, server, postgres, work_directory))
+    finally:
+        server.shutdown()
+        postgres.stop()
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    print('{0:<18} {1:>6} {2:>9} {3:>9} {4:>10} {5:>10} {6:>9} {7:>9}'.format(
+        'run', 'exit', 'seconds', 'pages/s', 'items/s', 'db rows/s', 'rows', 'peak MB'))
+    for result in results:
+        seconds = max(result['seconds'], 1e-9)
+        print('{0:<18} {1:>6} {2:>9.1f} {3:>9.2f} {4:>10.1f} {5:>10.1f} {6:>9} {7:>9.1f}'.format(
+            result['name'], result['exit_code'], result['seconds'], result['pages'] / seconds,
+            result['items'] / seconds, result['db_rows'] / seconds, result['table_rows'], result['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# Memory footprint of the items of a month of one country: the dictionaries
+# of strings of the old per-record parser against the slotted EexItems of
+# the batch parser.
+#
+# Records are generated like the local stand-in site does and go through
+# JSON first, so every record has its own strings like the records which
+# come from the webdriver. The memory which is still allocated when the
+# records are dropped and only the items are kept is measured with
+# tracemalloc.
+#
+# Usage:
+#     python -m benchmarks.item_memory --country germany --period 2017-09 --records-per-day 2000
+
+import argparse
+import calendar
+import datetime
+import gc
+import json
+import sys
+import tracemalloc
+
+from benchmarks.mock_eex import make_day_records
+from benchmarks.parser import parse_records_per_record
+from scrapers.parser import TIMESTAMP_FORMAT, parse_records
+
+
+# JSON of the records of every day of a month
+def make_month_payload(country, period, records_per_day):
+    year, month = (int(part) for part in period.split('-'))
+    records = []
+    for day in range(1, calendar.monthrange(year, month)[1] + 1):
+        records.extend(make_day_records(country, datetime.date(year, month, day), records_per_day))
+    return json.dumps(records)
+
+
+# parses the records of the payload and returns the items with the memory they keep and the peak memory
+def measure(parse, payload):
+    gc.collect()
+    tracemalloc.start()
+    records = json.loads(payload)
+    items = parse(records)
+    del records
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return items, current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory footprint of items.')
+    parser.add_argument('--country', default='germany')
+    parser.add_argument('--period', default='2017-09', help='month of the records, YYYY-MM')
+    parser.add_argument('--records-per-day', type=int, default=2000)
+    args = parser.parse_args()
+
+    payload = make_month_payload(args.country, args.period, args.records_per_day)
+
+    # the old items get the country too, like the items of the batch parser
+    dict_items, dict_bytes, dict_peak = measure(
+        lambda records: [dict(item, country=args.country) for item in parse_records_per_record(records)], payload)
+    del dict_items
+    slotted_items, slotted_bytes, slotted_peak = measure(lambda records: parse_records(records, args.country),
+                                                         payload)
+
+    # both parsers give the same values, timestamps are compared in the format of the old parser
+    old_items = parse_records_per_record(json.loads(payload))
+    for old_item, item in zip(old_items, slotted_items):
+        values = dict((key, value.strftime(TIMESTAMP_FORMAT) if key in ('begin_ts', 'end_ts', 'last_update')
+                       else value) for key, value in item.items())
+        if values != dict(old_item, country=args.country):
+            raise SystemExit('ERROR: parsers produce different items')
+    del old_items
+
+    count = len(slotted_items)
+    print('{0} items of {1} {2}'.format(count, args.country, args.period))
+    print('{0:<22} {1:>12} {2:>12} {3:>10}'.format('items', 'kept MB', 'peak MB', 'bytes/item'))
+    for name, kept, peak in (('dict of strings', dict_bytes, dict_peak),
+                             ('EexItem', slotted_bytes, slotted_peak)):
+        print('{0:<22} {1:>12.1f} {2:>12.1f} {3:>10.0f}'.format(name, kept / 1048576.0, peak / 1048576.0,
+                                                                kept / max(count, 1)))
+    print('size of an item object: dict {0} bytes, EexItem {1} bytes'.format(
+        sys.getsizeof(dict(slotted_items[0])), sys.getsizeof(slotted_items[0])))
+
+
+if __name__ == '__main__':
+    main()
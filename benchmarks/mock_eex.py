@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+
+# Local stand-in of eex-transparency.com for benchmarks.
+#
+# Every '/homepage/...' path is a country page with a minimal Angular-like
+# scope: 'eventData' and 'data' (rows of the page), 'loading', 'noData',
+# 'from', 'to', 'canceled', 'pageSize', 'selectCanceled()' and 'next()',
+# and the elements the spider looks at ('#from', '.timestamp', '.next' and
+# the no data message). A '$route' router changes the country in the page:
+# the view of the new country gets a new scope a moment after the route
+# change, like a routed view which loads its template.
+# The rows are loaded from '/api/<page path>', the endpoint of 'fetch_mode=api',
+# in pages of 'limit' rows with the number of records in 'X-Total-Count'.
+#
+# Records are generated from the country and the day, so every run sees the
+# same data. The page size, the largest page size the endpoint accepts, the
+# number of records per day, the latency and the failure rate of the data
+# endpoint are configurable.
+#
+# Usage:
+#     python -m benchmarks.mock_eex --port 8765 --page-size 100 --latency-ms 50 --failure-rate 0.01
+
+import argparse
+import datetime
+import hashlib
+import json
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# scope of the page. 'angular', 'moment' and '$' are the parts of the libraries the spider uses
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head><title>EEX Transparency (mock)</title></head>
+<body>
+<input id="from" type="text">
+<div class="timestamp"></div>
+<table id="rows"></table>
+<div class="ng-hide" data-ng-show="noData && !loading && filterActive != false">No data</div>
+<a class="next ng-hide">next</a>
+<script>
+(function() {
+    var PAGE_SIZE = %(page_size)d;
+    // milliseconds between a route change and the new view
+    var ROUTE_DELAY = 50;
+
+    function apiUrl() {
+        return '/api' + location.pathname.replace(/\\/$/, '');
+    }
+
+    function formatDate(d) {
+        var month = d.getMonth() + 1, day = d.getDate();
+        return d.getFullYear() + '-' + (month < 10 ? '0' : '') + month + '-' + (day < 10 ? '0' : '') + day;
+    }
+
+    function parseDate(value) {
+        var parts = value.split('-');
+        return new Date(+parts[0], +parts[1] - 1, +parts[2]);
+    }
+
+    var scope;
+
+    // scope of the view of the current path
+    function createScope() {
+        // the filter is kept over a refresh like the filter of the site
+        var saved = JSON.parse(sessionStorage.getItem(location.pathname) || 'null');
+        var today = formatDate(new Date());
+
+        var viewScope = {
+            eventData: undefined,
+            data: undefined,
+            loading: false,
+            noData: false,
+            from: parseDate(saved ? saved.from : today),
+            to: parseDate(saved ? saved.to : today),
+            canceled: saved ? saved.canceled : 'active',
+            offset: 0,
+            pageSize: PAGE_SIZE,
+            hasNext: false,
+            $apply: function(fn) {
+                if (fn) { fn(); }
+                render();
+            },
+            selectCanceled: function() {
+                viewScope.offset = 0;
+                load();
+            },
+            next: function() {
+                if (viewScope.hasNext && !viewScope.loading) {
+                    viewScope.offset += viewScope.pageSize;
+                    load();
+                }
+            }
+        };
+        return viewScope;
+    }
+
+    function setHidden(element, hidden) {
+        if (hidden) {
+            element.classList.add('ng-hide');
+        } else {
+            element.classList.remove('ng-hide');
+        }
+    }
+
+    function render() {
+        setHidden(document.getElementsByClassName('next')[0], !scope.hasNext || scope.loading);
+        setHidden(document.querySelectorAll('[data-ng-show]')[0], !(scope.noData && !scope.loading));
+        document.getElementById('rows').innerHTML = (scope.eventData || []).map(function(row) {
+            return '<tr><td>' + row.event_id + '</td><td>' + row.prodcon + '</td></tr>';
+        }).join('');
+    }
+
+    function load() {
+        var filter = {from: formatDate(scope.from), to: formatDate(scope.to), canceled: scope.canceled};
+        sessionStorage.setItem(location.pathname, JSON.stringify(filter));
+
+        // rows of a view which is replaced by a route change are dropped
+        var viewScope = scope;
+        viewScope.loading = true;
+        render();
+        var xhr = new XMLHttpRequest();
+        xhr.open('GET', apiUrl() + '?from=' + filter.from + '&to=' + filter.to + '&canceled=' + filter.canceled
+                 + '&offset=' + viewScope.offset + '&limit=' + viewScope.pageSize);
+        xhr.onreadystatechange = function() {
+            if (xhr.readyState !== 4 || viewScope !== scope) { return; }
+            viewScope.loading = false;
+            if (xhr.status === 200) {
+                var rows = JSON.parse(xhr.responseText);
+                // the endpoint tells the number of records of the dates
+                var total = parseInt(xhr.getResponseHeader('X-Total-Count'), 10);
+                viewScope.hasNext = viewScope.offset + rows.length < total;
+                viewScope.eventData = rows;
+                viewScope.data = rows;
+                viewScope.noData = rows.length === 0;
+            }
+            render();
+        };
+        xhr.send();
+    }
+
+    // the parts of the injector the spider uses to change the route in the page
+    var injector = {
+        has: function(name) { return name === '$route'; },
+        get: function(name) {
+            if (name === '$location') {
+                return {url: function(path) { history.pushState(null, '', path); }};
+            }
+            if (name === '$rootScope') {
+                return {$apply: function(fn) {
+                    var path = location.pathname;
+                    fn();
+                    if (location.pathname !== path) {
+                        // the old view with its rows is shown until the new view is ready
+                        setTimeout(function() {
+                            scope = createScope();
+                            render();
+                            load();
+                        }, ROUTE_DELAY);
+                    }
+                }};
+            }
+            return null;
+        }
+    };
+
+    window.angular = {
+        element: function() {
+            return {
+                scope: function() { return scope; },
+                injector: function() { return injector; }
+            };
+        }
+    };
+    window.moment = function(value) {
+        var date = parseDate(value);
+        return {toDate: function() { return date; }};
+    };
+    window.$ = function() {
+        return {blur: function() {}};
+    };
+
+    scope = createScope();
+    load();
+})();
+</script>
+</body>
+</html>
+'''
+
+# epoch milliseconds of midnight UTC of a day
+def _day_milliseconds(day):
+    return int((datetime.datetime(day.year, day.month, day.day) - datetime.datetime(1970, 1, 1)).total_seconds()) * 1000
+
+
+def make_day_records(country, day, count):
+    """Returns the records of a country and day. The same arguments always give the same records."""
+    seed = int(hashlib.md5('{0}|{1}'.format(country, day.isoformat()).encode('utf-8')).hexdigest()[:8], 16)
+    rnd = random.Random(seed)
+    day_start = _day_milliseconds(day)
+    records = []
+    for i in range(count):
+        begin = day_start + rnd.randrange(0, 24 * 3600) * 1000
+        record = {
+            'type': rnd.choice(['planned', 'unplanned']),
+            'short_name': rnd.choice(['RWE', 'EnBW', 'Uniper', 'Vattenfall', 'EPH']),
+            'prodcon': 'Plant {0}'.format(rnd.randrange(200)),
+            'unit': 'Block {0}'.format(rnd.randrange(8)),
+            'connecting_area': rnd.choice(['Amprion', 'TenneT', '50Hertz', 'TransnetBW']),
+            'begin': begin,
+            'end': begin + rnd.randrange(1, 72) * 3600 * 1000,
+            'energy_limitation': round(rnd.uniform(0, 900), 1),
+            'reason': rnd.choice(['Maintenance', 'Outage', 'Revision', '']),
+            'canceled': rnd.choice(['active', 'inactive']),
+            'event_id': '{0}-{1}-{2:05d}'.format(country, day.strftime('%Y%m%d'), i),
+            'modify_timestamp': begin - rnd.randrange(1, 30 * 24 * 3600) * 1000,
+        }
+        if rnd.random() < 0.8:
+            record['fuel'] = rnd.choice(['lignite', 'hard coal', 'gas', 'uranium', 'hydro'])
+        records.append(record)
+    return records
+
+
+class MockEexHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        parsed_url = urlparse(self.path)
+        path = parsed_url.path
+
+        if path == '/robots.txt':
+            self._send(200, 'text/plain', 'User-agent: *\nAllow: /\n')
+        elif path == '/':
+            self._send(200, 'text/html', '<html><body>EEX Transparency (mock)</body></html>')
+        elif path.startswith('/homepage/'):
+            self._send(200, 'text/html', PAGE_TEMPLATE % {'page_size': self.server.page_size})
+        elif path.startswith('/api/homepage/'):
+            self._send_records(path, parse_qs(parsed_url.query))
+        else:
+            self._send(404, 'text/plain', 'Not found')
+
+    def _send_records(self, path, query):
+        config = self.server
+        if config.latency_ms:
+            time.sleep(config.latency_ms / 1000.0 * config.random.uniform(0.5, 1.5))
+        if config.random.random() < config.failure_rate:
+            self._send(500, 'text/plain', 'Internal server error')
+            return
+
+        try:
+            country = path.split('/')[4]
+            start = datetime.datetime.strptime(query['from'][0], '%Y-%m-%d').date()
+            end = datetime.datetime.strptime(query['to'][0], '%Y-%m-%d').date()
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', [str(config.page_size)])[0])
+        except (IndexError, KeyError, ValueError):
+            self._send(400, 'text/plain', 'Bad request')
+            return
+        canceled = query.get('canceled', ['all'])[0]
+        if config.max_page_size and limit > config.max_page_size:
+            self._send(400, 'text/plain', 'Page size is too large')
+            return
+
+        # 'limit' rows from 'offset', and the number of records of the dates in 'X-Total-Count'
+        # only the days up to the page are generated, unless the records are filtered
+        records = []
+        day = start
+        while day <= end and (canceled != 'all' or len(records) < offset + limit):
+            records.extend(make_day_records(country, day, config.records_per_day))
+            day += datetime.timedelta(days=1)
+        if canceled != 'all':
+            records = [record for record in records if record['canceled'] == canceled]
+            total = len(records)
+        else:
+            total = ((end - start).days + 1) * config.records_per_day if start <= end else 0
+        self._send(200, 'application/json', json.dumps(records[offset:offset + limit]),
+                   headers={'X-Total-Count': str(total)})
+
+    def _send(self, status, content_type, body, headers=None):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockEexServer(socketserver.ThreadingMixIn, HTTPServer):
+    """The stand-in site.
+
+    :param port: Port on 127.0.0.1, 0 for a free port.
+    :param page_size: Number of rows of a page of the country pages.
+    :param max_page_size: Largest page size the data endpoint accepts, 0 for any.
+    :param records_per_day: Number of records of every country and day.
+    :param latency_ms: Average latency of the data endpoint in milliseconds.
+    :param failure_rate: Probability of an error response of the data endpoint.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, page_size=100, records_per_day=50, latency_ms=0, failure_rate=0.0, seed=0,
+                 max_page_size=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), MockEexHandler)
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.records_per_day = records_per_day
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def start(self):
+        """Serves in a background thread."""
+        thread = threading.Thread(target=self.serve_forever, name='mock-eex')
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in of eex-transparency.com.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--page-size', type=int, default=100, help='rows of a page of the country pages')
+    parser.add_argument('--max-page-size', type=int, default=0, help='largest page size accepted, 0 for any')
+    parser.add_argument('--records-per-day', type=int, default=50, help='records of every country and day')
+    parser.add_argument('--latency-ms', type=float, default=0, help='average latency of the data endpoint')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='probability of an error of the data endpoint')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockEexServer(args.port, args.page_size, args.records_per_day, args.latency_ms, args.failure_rate,
+                           args.seed, args.max_page_size)
+    print('Serving on {0} (EEX_BASE_URL={0}, EEX_API_URL={0}/api/{{path}})'.format(server.base_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
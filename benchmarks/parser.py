@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# Compares the old per-record parser of the spider with the batch parser
+# on a synthetic page of records and checks that their items are identical
+# (timestamps of the batch parser are compared in the format of the old one).
+#
+# Usage:
+#     python -m benchmarks.parser --records 10000
+
+import argparse
+import datetime
+import random
+import timeit
+
+import pytz
+
+from scrapers.parser import TIMESTAMP_FORMAT, parse_records
+
+
+# the per-record parser of EexTransparencySpider.parse_data_object before batch parsing
+def parse_records_per_record(data_object):
+    items = []
+    for record in data_object:
+        items.append({
+            'type': record['type'],
+            'company': record['short_name'],
+            'facility': record['prodcon'],
+            'unit': record['unit'],
+            'fuel': record['fuel'] if 'fuel' in record.keys() else "",
+            'control_area': record['connecting_area'],
+            'begin_ts': datetime.datetime.fromtimestamp(record['begin'] / 1000, tz=pytz.timezone('CET')).strftime("%Y-%m-%dT%H:%M:%S"),
+            'end_ts': datetime.datetime.fromtimestamp(record['end'] / 1000, tz=pytz.timezone('CET')).strftime("%Y-%m-%dT%H:%M:%S"),
+            'limitation': record['energy_limitation'],
+            'reason': record['reason'],
+            'status': record['canceled'],
+            'event_id': record['event_id'],
+            'last_update': datetime.datetime.fromtimestamp(record['modify_timestamp'] / 1000, tz=pytz.timezone('CET')).strftime("%Y-%m-%dT%H:%M:%S")
+        })
+    return items
+
+
+# creates a page of records like 'sc.eventData' of the site
+def make_records(count, seed=0):
+    rnd = random.Random(seed)
+    records = []
+    for i in range(count):
+        # timestamps over 2017, so both CET and CEST are used
+        begin = 1483228800000 + rnd.randrange(0, 365 * 24 * 3600) * 1000
+        record = {
+            'type': rnd.choice(['planned', 'unplanned']),
+            'short_name': rnd.choice(['RWE', 'EnBW', 'Uniper', 'Vattenfall', 'EPH']),
+            'prodcon': 'Facility {0}'.format(rnd.randrange(200)),
+            'unit': 'Unit {0}'.format(rnd.randrange(1000)),
+            'connecting_area': rnd.choice(['Amprion', 'TenneT', '50Hertz', 'TransnetBW']),
+            'begin': begin,
+            'end': begin + rnd.randrange(1, 30 * 24) * 3600 * 1000,
+            'energy_limitation': float(rnd.randrange(1, 1500)),
+            'reason': rnd.choice(['Maintenance', 'Failure', 'Other']),
+            'canceled': rnd.choice(['Active', 'Inactive']),
+            'event_id': 'E{0}'.format(i),
+            'modify_timestamp': begin - rnd.randrange(0, 7 * 24 * 3600) * 1000,
+        }
+        if i % 3:
+            record['fuel'] = rnd.choice(['Lignite', 'Hard coal', 'Gas', 'Uranium'])
+        records.append(record)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of record parsers.')
+    parser.add_argument('--records', type=int, default=10000, help='number of records of the page')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs of each parser')
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+
+    # items without a country have the keys of the old items, timestamps of the batch parser are datetimes
+    batch_items = [dict((key, value.strftime(TIMESTAMP_FORMAT) if key in ('begin_ts', 'end_ts', 'last_update')
+                         else value) for key, value in item.items())
+                   for item in parse_records(records)]
+    if batch_items != parse_records_per_record(records):
+        raise SystemExit('ERROR: parsers produce different items')
+    print('Items of both parsers are identical.')
+
+    per_record_seconds = min(timeit.repeat(lambda: parse_records_per_record(records), number=1, repeat=args.repeat))
+    batch_seconds = min(timeit.repeat(lambda: parse_records(records), number=1, repeat=args.repeat))
+
+    print('per-record parser: {0:.3f} s'.format(per_record_seconds))
+    print('batch parser:      {0:.3f} s'.format(batch_seconds))
+    print('speedup:           {0:.1f}x'.format(per_record_seconds / max(batch_seconds, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
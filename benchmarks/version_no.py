@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Compares the old per-event version number update with the set-based one
+# of PostgrePipeline on a synthetic table.
+#
+# Usage (the database is given with --dsn or the POSTGRE_DSN environment variable):
+#     python -m benchmarks.version_no --dsn "dbname=bench user=postgres host=localhost" --rows 2000000
+
+import argparse
+import os
+import time
+
+from psycopg2.extensions import parse_dsn
+
+from scrapers.pipelines import PostgrePipeline
+
+BENCH_SCHEMA = 'version_no_bench'
+BENCH_TABLE = 'eex_transparency'
+
+
+# the version number update of PostgrePipeline before it was set-based.
+# one SELECT for every event and one UPDATE for every row of it
+def update_version_no_per_row(pipeline, table_name, event_ids):
+    for event_id in event_ids:
+        pipeline.cur.execute("select id from {0}.{1} where event_id=%(event_id)s order by last_update;"
+                             .format(pipeline.schema, table_name), {'event_id': event_id})
+        version_no = 1
+        for row in pipeline.cur.fetchall():
+            pipeline.cur.execute("UPDATE {0}.{1} SET version_no = %(version_no)s WHERE id = %(id)s"
+                                 .format(pipeline.schema, table_name), {'version_no': version_no, 'id': row[0]})
+            version_no += 1
+        pipeline.connection.commit()
+
+
+# creates the synthetic table with 'rows' rows spread over 'events' event ids
+def create_bench_table(pipeline, rows, events):
+    print('Creating {0} rows for {1} events...'.format(rows, events))
+    pipeline.cur.execute('CREATE SCHEMA IF NOT EXISTS {0};'.format(BENCH_SCHEMA))
+    pipeline.cur.execute('DROP TABLE IF EXISTS {0}.{1};'.format(BENCH_SCHEMA, BENCH_TABLE))
+    pipeline.cur.execute("CREATE TABLE {0}.{1} AS "
+                         "SELECT g::bigint AS id, "
+                         "'E' || (g %% %(events)s) AS event_id, "
+                         "timestamp '2017-01-01' + (g || ' seconds')::interval AS last_update, "
+                         "1 AS version_no "
+                         "FROM generate_series(1, %(rows)s) g;"
+                         .format(BENCH_SCHEMA, BENCH_TABLE), {'rows': rows, 'events': events})
+    pipeline.cur.execute('ALTER TABLE {0}.{1} ADD PRIMARY KEY (id);'.format(BENCH_SCHEMA, BENCH_TABLE))
+    pipeline.cur.execute('ANALYZE {0}.{1};'.format(BENCH_SCHEMA, BENCH_TABLE))
+    pipeline.connection.commit()
+
+
+# POSTGRE_CREDENTIALS of a libpq connection string or url
+def dsn_credentials(dsn):
+    parameters = parse_dsn(dsn)
+    return {
+        'database': parameters.get('dbname'),
+        'user': parameters.get('user'),
+        'host': parameters.get('host'),
+        'password': parameters.get('password'),
+        'port': parameters.get('port', 5432),
+    }
+
+
+def reset_version_no(pipeline):
+    pipeline.cur.execute('UPDATE {0}.{1} SET version_no = 1;'.format(BENCH_SCHEMA, BENCH_TABLE))
+    pipeline.connection.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of version number update.')
+    parser.add_argument('--rows', type=int, default=2000000, help='number of rows of synthetic table')
+    parser.add_argument('--events', type=int, default=200000, help='number of distinct event ids')
+    parser.add_argument('--touched', type=int, default=2000, help='number of event ids touched by the run')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic table')
+    parser.add_argument('--dsn', default=os.environ.get('POSTGRE_DSN'),
+                        help='connection string or url of the database, POSTGRE_DSN by default')
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('the database is not given, use --dsn or the POSTGRE_DSN environment variable')
+
+    pipeline = PostgrePipeline(credentials=dsn_credentials(args.dsn))
+    pipeline.schema = BENCH_SCHEMA
+
+    create_bench_table(pipeline, args.rows, args.events)
+    step = max(1, args.events // args.touched)
+    event_ids = ['E{0}'.format(i) for i in range(0, args.events, step)][:args.touched]
+
+    start = time.time()
+    update_version_no_per_row(pipeline, BENCH_TABLE, event_ids)
+    per_row_seconds = time.time() - start
+    print('per event, per row update: {0:.2f} s'.format(per_row_seconds))
+
+    reset_version_no(pipeline)
+
+    start = time.time()
+    pipeline.update_version_no(BENCH_TABLE, event_ids)
+    set_based_seconds = time.time() - start
+    print('set-based update:          {0:.2f} s'.format(set_based_seconds))
+    print('speedup:                   {0:.1f}x'.format(per_row_seconds / max(set_based_seconds, 1e-9)))
+
+    if not args.keep:
+        pipeline.cur.execute('DROP SCHEMA {0} CASCADE;'.format(BENCH_SCHEMA))
+        pipeline.connection.commit()
+    pipeline.connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+
+# Browser worker pool used by the selenium based spiders.
+#
+# Every worker thread owns exactly one browser session. Jobs are handed to the
+# first free worker and the items produced by a job are put on a bounded queue,
+# which the caller polls without blocking. A session keeps its browser between
+# jobs and restarts it when it has served too many pages or uses too much memory.
+
+import os
+import queue
+import threading
+import time
+import traceback
+from urllib.parse import unquote, urlparse
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+
+
+# markers put on the result queue by the workers
+_ITEM = 'item'
+_DONE = 'done'
+
+# marker put on the job queue to stop a worker
+_STOP = object()
+
+# proxy types of phantomjs by proxy url scheme, phantomjs takes only http and socks5 proxies
+# (a https proxy url is a http proxy which tunnels https pages)
+_PHANTOMJS_PROXY_TYPES = {'http': 'http', 'https': 'http', 'socks5': 'socks5', 'socks5h': 'socks5'}
+
+
+class BrowserPool(object):
+    """A bounded pool of webdriver workers.
+
+    Jobs are submitted without waiting, and the produced items are taken with
+    'poll', which never blocks. So the pool can be driven from the Twisted
+    reactor thread while the browsers work in their own threads.
+
+    :param size: Number of browsers (and worker threads) to run.
+    :param driver_factory: Callable without arguments returning a new webdriver or BrowserSession.
+    :param queue_size: Maximum number of items waiting to be consumed.
+        Workers block when the queue is full, so a slow pipeline slows
+        the browsers down instead of filling memory.
+    """
+
+    def __init__(self, size, driver_factory, queue_size=1000):
+        self.size = max(1, int(size))
+        self.driver_factory = driver_factory
+        self.queue_size = queue_size
+        self.drivers = []
+        self._lock = threading.Lock()
+        self._job_queue = queue.Queue()
+        self._result_queue = queue.Queue(maxsize=queue_size)
+        self._workers = []
+        # number of submitted jobs which are not finished yet
+        self.pending = 0
+
+    def submit(self, jobs, job_func):
+        """Queues jobs for the workers and returns at once.
+
+        :param jobs: Iterable of job objects.
+        :param job_func: Callable ``job_func(driver, job)`` returning an iterable of items.
+        :return: Number of submitted jobs.
+        """
+        jobs = list(jobs)
+        for job in jobs:
+            self._job_queue.put((job, job_func))
+        self.pending += len(jobs)
+
+        # a worker is started for every job up to the size of the pool, the workers wait for jobs until closed
+        while len(self._workers) < min(self.size, self.pending):
+            worker = threading.Thread(target=self._work, name='browser-%d' % len(self._workers))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        return len(jobs)
+
+    def poll(self, max_items):
+        """Returns up to 'max_items' produced items without waiting for the workers.
+
+        Items are returned in the order they are produced by the workers.
+        """
+        items = []
+        while len(items) < max_items:
+            try:
+                kind, value = self._result_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == _DONE:
+                self.pending -= 1
+            elif value is not None:
+                items.append(value)
+        return items
+
+    def close(self):
+        """Stops the workers and quits every browser started by the pool."""
+        for _ in self._workers:
+            self._job_queue.put(_STOP)
+        self._workers = []
+
+        with self._lock:
+            drivers = list(self.drivers)
+            self.drivers.clear()
+
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception as e:
+                print("ERROR: Unable to quit browser:", e)
+
+    def _work(self):
+        driver = None
+        while True:
+            entry = self._job_queue.get()
+            if entry is _STOP:
+                break
+            job, job_func = entry
+
+            try:
+                if driver is None:
+                    driver = self.driver_factory()
+                    with self._lock:
+                        self.drivers.append(driver)
+
+                for item in job_func(driver, job):
+                    self._result_queue.put((_ITEM, item))
+            except Exception:
+                print("ERROR: Unexpected error in browser worker for job:", job)
+                traceback.print_exc()
+            finally:
+                self._result_queue.put((_DONE, job))
+
+
+class BrowserSession(object):
+    """A long-lived webdriver which is reused between pages and recycled when it gets old.
+
+    Navigation between country pages is done inside the Angular application
+    when the page has a router, so the application and its assets are not
+    loaded again. Images, fonts and analytics are not loaded. The browser is
+    restarted after 'recycle_pages' pages or when its memory is over
+    'recycle_memory_mb' megabytes.
+
+    With a proxy pool, every browser gets the healthiest proxy (and user agent)
+    when it is started. Page loads are reported to the pool, and a browser
+    whose proxy is put on cooldown is restarted with another one.
+
+    The session has the 'get', 'refresh' and 'execute_script' methods of a
+    webdriver, so it can be used in place of one.
+
+    :param browser: 'phantomjs', 'chrome' or 'firefox'.
+    :param executable_path: Path of phantomjs, chromedriver or geckodriver.
+    :param proxy_pool: HealthPool of proxy urls or None.
+    :param user_agent_pool: HealthPool of user agents or None.
+    """
+
+    # urls which are not loaded by the browser
+    blocked_url_pattern = (r'\.(png|jpe?g|gif|svg|ico|woff2?|ttf|otf|eot)(\?|$)'
+                           r'|google-analytics\.com|googletagmanager\.com|doubleclick\.net|hotjar\.com')
+
+    # hosts of analytics which are mapped to nowhere in chrome
+    blocked_hosts = ('www.google-analytics.com', 'www.googletagmanager.com', 'stats.g.doubleclick.net',
+                     'static.hotjar.com')
+
+    def __init__(self, browser='phantomjs', executable_path=None, recycle_pages=500, recycle_memory_mb=1024,
+                 in_app_navigation=True, block_resources=True, proxy_pool=None, user_agent_pool=None):
+        self.browser = browser
+        self.executable_path = executable_path
+        self.recycle_pages = recycle_pages
+        self.recycle_memory_mb = recycle_memory_mb
+        self.in_app_navigation = in_app_navigation
+        self.block_resources = block_resources
+        self.proxy_pool = proxy_pool
+        self.user_agent_pool = user_agent_pool
+        self.proxy = None
+        self.user_agent = None
+        self.driver = None
+        self.page_count = 0
+
+    @classmethod
+    def from_settings(cls, settings, proxy_pool=None, user_agent_pool=None):
+        browser = settings.get('BROWSER', 'phantomjs')
+        executable_paths = {
+            'phantomjs': settings.get('PHANTOMJS_PATH', './phantomjs/linux/phantomjs'),
+            'chrome': settings.get('CHROMEDRIVER_PATH', './chromedriver'),
+            'firefox': settings.get('GECKODRIVER_PATH', './geckodriver'),
+        }
+        return cls(browser=browser,
+                   executable_path=executable_paths.get(browser),
+                   recycle_pages=settings.getint('BROWSER_RECYCLE_PAGES', 500),
+                   recycle_memory_mb=settings.getint('BROWSER_RECYCLE_MEMORY_MB', 1024),
+                   in_app_navigation=settings.getbool('BROWSER_IN_APP_NAVIGATION', True),
+                   block_resources=settings.getbool('BROWSER_BLOCK_RESOURCES', True),
+                   proxy_pool=proxy_pool,
+                   user_agent_pool=user_agent_pool)
+
+    def start(self):
+        """Starts the browser."""
+        self.proxy = self.proxy_pool.choose() if self.proxy_pool is not None else None
+        self.user_agent = self.user_agent_pool.choose() if self.user_agent_pool is not None else None
+        if self.browser == 'phantomjs':
+            self.driver = self._start_phantomjs()
+        elif self.browser == 'chrome':
+            self.driver = self._start_chrome()
+        elif self.browser == 'firefox':
+            self.driver = self._start_firefox()
+        else:
+            raise ValueError('Unknown browser: {0}'.format(self.browser))
+        self.page_count = 0
+
+    def quit(self):
+        """Quits the browser."""
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            finally:
+                self.driver = None
+
+    def recycle(self):
+        """Restarts the browser."""
+        print("Recycling browser after {0} pages.".format(self.page_count))
+        self.quit()
+        self.start()
+
+    def should_recycle(self):
+        if self.proxy is not None and not self.proxy_pool.is_healthy(self.proxy):
+            return True
+        if self.recycle_pages and self.page_count >= self.recycle_pages:
+            return True
+        if self.recycle_memory_mb and self.memory_mb() >= self.recycle_memory_mb:
+            return True
+        return False
+
+    def count_page(self):
+        """Counts a scraped page for recycling."""
+        self.page_count += 1
+
+    def get(self, url):
+        """Opens a url. The browser is recycled first if it is too old."""
+        if self.driver is None:
+            self.start()
+        elif self.should_recycle():
+            self.recycle()
+
+        if self.in_app_navigation and self._navigate_in_app(url):
+            return
+
+        start_time = time.time()
+        try:
+            self.driver.get(url)
+        except WebDriverException:
+            self.report_failure()
+            raise
+        if self.proxy is not None:
+            self.proxy_pool.record_success(self.proxy, time.time() - start_time)
+
+    def report_failure(self):
+        """Reports a page which is failed to load to the proxy pool."""
+        if self.proxy is not None:
+            self.proxy_pool.record_failure(self.proxy)
+
+    def refresh(self):
+        self.driver.refresh()
+
+    def execute_script(self, script, *args):
+        return self.driver.execute_script(script, *args)
+
+    def memory_mb(self):
+        """Returns the memory of the browser processes in megabytes (Linux only, 0 elsewhere)."""
+        try:
+            pid = self.driver.service.process.pid
+        except AttributeError:
+            return 0
+        return process_tree_rss_kb(pid) / 1024.0
+
+    # changes the route of the Angular application without loading the page again
+    # returns False when the page has no router or no helpers of the spider (which mark the rows
+    # of the current page as stale), is already on the url or the url is on another site
+    def _navigate_in_app(self, url):
+        parsed_url = urlparse(url)
+        try:
+            current_url = urlparse(self.driver.current_url)
+        except WebDriverException:
+            return False
+        if (current_url.scheme, current_url.netloc) != (parsed_url.scheme, parsed_url.netloc):
+            return False
+        if current_url.path == parsed_url.path:
+            return False
+
+        path = parsed_url.path + ('?' + parsed_url.query if parsed_url.query else '')
+        try:
+            return bool(self.driver.execute_script(self._navigate_script, path))
+        except WebDriverException:
+            return False
+
+    _navigate_script = ('if (typeof angular === "undefined" || !window.__eex) { return false; }\n'
+                        'var injector = angular.element(document.body).injector();\n'
+                        'if (!injector || !(injector.has("$route") || injector.has("$state"))) { return false; }\n'
+                        'var path = arguments[0];\n'
+                        'var location = injector.get("$location");\n'
+                        '// rows of the previous country are marked, so the page is not ready until\n'
+                        '// the routed view has its own scope and rows\n'
+                        'window.__eex.markPageState();\n'
+                        'injector.get("$rootScope").$apply(function() { location.url(path); });\n'
+                        'return true;\n')
+
+    def _start_phantomjs(self):
+        capabilities = dict(DesiredCapabilities.PHANTOMJS)
+        if self.block_resources:
+            capabilities['phantomjs.page.settings.loadImages'] = False
+        if self.user_agent:
+            capabilities['phantomjs.page.settings.userAgent'] = self.user_agent
+        service_args = []
+        if self.proxy:
+            proxy = urlparse(self.proxy)
+            proxy_type = _PHANTOMJS_PROXY_TYPES.get(proxy.scheme)
+            if proxy_type is None:
+                raise ValueError('Unsupported proxy scheme for phantomjs: {0}'.format(self.proxy))
+            service_args += ['--proxy={0}:{1}'.format(proxy.hostname, proxy.port), '--proxy-type=' + proxy_type]
+            if proxy.username:
+                service_args.append('--proxy-auth={0}:{1}'.format(unquote(proxy.username),
+                                                                  unquote(proxy.password or '')))
+        driver = webdriver.PhantomJS(self.executable_path, desired_capabilities=capabilities,
+                                     service_args=service_args)
+
+        if self.block_resources:
+            # abort requests of fonts, images and analytics in the phantomjs page
+            driver.command_executor._commands['executePhantomScript'] = (
+                'POST', '/session/$sessionId/phantom/execute')
+            driver.execute('executePhantomScript', {
+                'script': ('var page = this;\n'
+                           'page.onResourceRequested = function(request, network) {\n'
+                           '    if (/' + self.blocked_url_pattern.replace('/', '\\/') + '/i.test(request.url)) {\n'
+                           '        network.abort();\n'
+                           '    }\n'
+                           '};\n'),
+                'args': []
+            })
+        return driver
+
+    def _start_chrome(self):
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--no-sandbox')
+        if self.user_agent:
+            options.add_argument('--user-agent=' + self.user_agent)
+        if self.proxy:
+            # chrome takes no proxy credentials on the command line, proxies must allow the host
+            proxy = urlparse(self.proxy)
+            options.add_argument('--proxy-server={0}://{1}:{2}'.format(proxy.scheme, proxy.hostname, proxy.port))
+        if self.block_resources:
+            options.add_argument('--blink-settings=imagesEnabled=false')
+            options.add_argument('--host-resolver-rules=' + ', '.join(
+                'MAP {0} 127.0.0.1'.format(host) for host in self.blocked_hosts))
+            options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+        return webdriver.Chrome(self.executable_path, chrome_options=options)
+
+    def _start_firefox(self):
+        options = webdriver.FirefoxOptions()
+        options.add_argument('-headless')
+        profile = webdriver.FirefoxProfile()
+        if self.user_agent:
+            profile.set_preference('general.useragent.override', self.user_agent)
+        if self.proxy:
+            proxy = urlparse(self.proxy)
+            profile.set_preference('network.proxy.type', 1)
+            for scheme in ('http', 'ssl'):
+                profile.set_preference('network.proxy.' + scheme, proxy.hostname)
+                profile.set_preference('network.proxy.{0}_port'.format(scheme), proxy.port)
+        if self.block_resources:
+            profile.set_preference('permissions.default.image', 2)
+            profile.set_preference('browser.display.use_document_fonts', 0)
+        return webdriver.Firefox(firefox_profile=profile, firefox_options=options,
+                                 executable_path=self.executable_path)
+
+
+# returns the resident memory of a process and all its children in kilobytes
+def process_tree_rss_kb(root_pid):
+    children = {}
+    rss = {}
+    for name in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{0}/status'.format(name)) as status_file:
+                status = dict(line.split(':', 1) for line in status_file if ':' in line)
+        except (OSError, ValueError):
+            continue
+        pid = int(name)
+        children.setdefault(int(status.get('PPid', '0').strip() or 0), []).append(pid)
+        rss[pid] = int(status.get('VmRSS', '0 kB').split()[0])
+
+    total = 0
+    pids = [root_pid]
+    while pids:
+        pid = pids.pop()
+        total += rss.get(pid, 0)
+        pids.extend(children.get(pid, []))
+    return total
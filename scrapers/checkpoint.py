@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Checkpoints of paginated scraping jobs.
+#
+# The state of every job (country page and date window) is saved to a JSON
+# file after every scraped page, so an interrupted run can be restarted from
+# the last scraped page instead of from the beginning. A page counts as
+# scraped when the pipelines have saved its items: the spider yields a
+# PageMark after the items of a page and saves it when they are saved.
+
+import collections
+import json
+import os
+import threading
+
+# progress of a job after a page, the arguments of Checkpoint.save
+PageMark = collections.namedtuple('PageMark', 'key page last_event_id done page_size')
+
+
+class Checkpoint(object):
+    """Stores the progress of scraping jobs in a JSON file.
+
+    The state of a job is a dictionary:
+        page: number of pages scraped so far
+        last_event_id: event_id of the last record of the last scraped page
+        done: True when all pages of the job are scraped
+        page_size: rows per page of the scraped pages, None if the default size of the site
+    """
+
+    def __init__(self, file_name, resume=False):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self.jobs = {}
+
+        if resume and os.path.exists(file_name):
+            with open(file_name) as checkpoint_file:
+                self.jobs = json.load(checkpoint_file)
+            print("Resuming from checkpoint: ", file_name)
+
+    @staticmethod
+    def job_key(url, start, end):
+        """Returns the key of a job for the given url and date window."""
+        return '{0}|{1}|{2}'.format(url, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+
+    def get(self, key):
+        """Returns the saved state of a job or None."""
+        with self._lock:
+            state = self.jobs.get(key)
+            return dict(state) if state is not None else None
+
+    def is_done(self, key):
+        state = self.get(key)
+        return state is not None and state['done']
+
+    def save(self, key, page, last_event_id=None, done=False, page_size=None):
+        """Saves the state of a job and writes the checkpoint file."""
+        with self._lock:
+            self.jobs[key] = {
+                'page': page,
+                'last_event_id': last_event_id,
+                'done': done,
+                'page_size': page_size
+            }
+            self._write()
+
+    def _write(self):
+        directory = os.path.dirname(self.file_name)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # write to a temporary file first, so a crash never leaves a broken checkpoint
+        tmp_file_name = self.file_name + '.tmp'
+        with open(tmp_file_name, mode='w') as checkpoint_file:
+            json.dump(self.jobs, checkpoint_file, indent=4)
+        os.replace(tmp_file_name, self.file_name)
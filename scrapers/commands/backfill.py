@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+# Backfill of history data over many months and countries.
+#
+# The date range and countries are expanded to (country, period) jobs in a
+# SQLite queue (BACKFILL_QUEUE_FILE). Jobs are run as separate
+# 'scrapy crawl eex_transparency -a mode=history' processes, a job fails when
+# the process fails or its log has 'failed_data'. Failed jobs are run again
+# (resumed from their checkpoints) until BACKFILL_MAX_ATTEMPTS. Running the
+# command again continues the same queue, and its failed jobs get
+# BACKFILL_MAX_ATTEMPTS new attempts.
+#
+# scrapy backfill -a start=2016-01 -a end=2017-12 -a country=germany,italy -a jobs=4
+
+import collections
+import datetime
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from scrapers.job_queue import JobQueue, DONE, FAILED, PENDING, RUNNING
+from scrapers.run_log import read_run
+from scrapers.spiders.eex_transparency_spider import EexTransparencySpider
+
+
+# returns the 'YYYY-MM' periods from start to end (both included)
+def month_periods(start, end):
+    start = datetime.datetime.strptime(start, '%Y-%m')
+    end = datetime.datetime.strptime(end, '%Y-%m')
+    periods = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        periods.append('{0:04d}-{1:02d}'.format(year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return periods
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return '-a start=YYYY-MM -a end=YYYY-MM [-a country=c1,c2] [-a jobs=N]'
+
+    def short_desc(self):
+        return 'Backfill history data of many months with a persistent job queue'
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option('-a', dest='spargs', action='append', default=[], metavar='NAME=VALUE',
+                          help='set a backfill argument (start, end, country, jobs, workers)')
+
+    def process_options(self, args, opts):
+        ScrapyCommand.process_options(self, args, opts)
+        try:
+            opts.spargs = dict(arg.split('=', 1) for arg in opts.spargs)
+        except ValueError:
+            raise UsageError('Invalid -a value, use -a NAME=VALUE', print_help=False)
+
+    def run(self, args, opts):
+        arguments = opts.spargs
+        countries = sorted(EexTransparencySpider.history_url_list_dict.keys())
+        if arguments.get('country'):
+            countries = arguments['country'].split(',')
+            unknown = set(countries) - set(EexTransparencySpider.history_url_list_dict.keys())
+            if unknown:
+                raise UsageError('Unknown country: ' + ', '.join(sorted(unknown)), print_help=False)
+
+        self.parallel_jobs = int(arguments.get('jobs', self.settings.getint('BACKFILL_JOBS', 2)))
+        # browsers of every job. A job is a single country, so one browser is enough by default
+        self.workers = arguments.get('workers', '1')
+        self.max_attempts = self.settings.getint('BACKFILL_MAX_ATTEMPTS', 3)
+        self.log_dir = self.settings.get('BACKFILL_LOG_DIR', 'logs/backfill')
+
+        queue_file_name = self.settings.get('BACKFILL_QUEUE_FILE', 'state/backfill.sqlite')
+        if os.path.dirname(queue_file_name):
+            os.makedirs(os.path.dirname(queue_file_name), exist_ok=True)
+        self.queue = JobQueue(queue_file_name)
+
+        if 'start' in arguments or 'end' in arguments:
+            if 'start' not in arguments or 'end' not in arguments:
+                raise UsageError('Both start and end are required', print_help=False)
+            periods = month_periods(arguments['start'], arguments['end'])
+            added = self.queue.add([(country, period) for period in periods for country in countries])
+            print('Added {0} new job(s) to the backfill queue.'.format(added))
+        self.queue.retry_failed()
+
+        self.items = 0
+        self.finished_jobs = 0
+        # attempts of every job in this run of the backfill
+        self.run_attempts = collections.Counter()
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+
+        threads = []
+        for i in range(max(1, self.parallel_jobs)):
+            thread = threading.Thread(target=self._work, name='backfill-%d' % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        progress_interval = self.settings.getfloat('BACKFILL_PROGRESS_INTERVAL', 60)
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(progress_interval / len(threads))
+            self.print_progress()
+
+        self.print_progress()
+        failed_jobs = self.queue.failed_jobs()
+        for country, period, attempts, error, log_file in failed_jobs:
+            print('FAILED: {0} {1} after {2} attempt(s): {3} ({4})'.format(country, period, attempts, error, log_file))
+        self.queue.close()
+        if failed_jobs:
+            self.exitcode = 1
+
+    def print_progress(self):
+        counts = self.queue.counts()
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        with self._lock:
+            items, finished_jobs = self.items, self.finished_jobs
+        remaining = counts[PENDING] + counts[RUNNING]
+        eta = ''
+        if finished_jobs:
+            eta = ', ETA {0}'.format(datetime.timedelta(seconds=int(elapsed / finished_jobs * remaining)))
+        print('Backfill: {0} done, {1} failed, {2} running, {3} pending | '
+              '{4} items, {5:.1f} items/s, {6:.1f} jobs/h{7}'.format(
+                  counts[DONE], counts[FAILED], counts[RUNNING], counts[PENDING],
+                  items, items / elapsed, finished_jobs / elapsed * 3600, eta))
+
+    def _work(self):
+        while True:
+            job = self.queue.claim()
+            if job is None:
+                return
+            self._run_job(*job)
+
+    # runs a job in a scrapy process and saves its result to the queue
+    def _run_job(self, country, period, attempts):
+        log_file = os.path.join(self.log_dir, '{0}_{1}_{2}.log'.format(period, country, attempts + 1))
+        command = [sys.executable, '-m', 'scrapy', 'crawl', EexTransparencySpider.name,
+                   '-a', 'mode=history', '-a', 'period=' + period, '-a', 'country=' + country,
+                   '-a', 'workers=' + str(self.workers), '-a', 'log_file=' + log_file]
+        if attempts:
+            # continue the pages of the failed attempt
+            command += ['-a', 'resume=1']
+
+        with self._lock:
+            self.run_attempts[(country, period)] += 1
+            run_attempts = self.run_attempts[(country, period)]
+
+        print('Starting backfill job {0} {1} (attempt {2})...'.format(country, period, attempts + 1))
+        start_time = time.time()
+        return_code = subprocess.call(command)
+        seconds = time.time() - start_time
+
+        items, failed_data, error = 0, {}, None
+        # a crashed job has no summary, its failures are read from the events of its log
+        run = read_run(log_file)
+        if run is None:
+            error = 'No job log: ' + log_file
+        else:
+            items = run.get('item_scraped_count', 0)
+            failed_data = run.get('failed_data', {})
+
+        if return_code != 0:
+            error = 'scrapy exited with code {0}'.format(return_code)
+        elif failed_data:
+            error = 'failed data: ' + ', '.join(sorted(failed_data.keys()))
+
+        if error is None:
+            status = DONE
+        elif run_attempts < self.max_attempts:
+            # the job is run again by a free worker
+            status = PENDING
+            print('ERROR: Backfill job {0} {1} failed, retrying: {2}'.format(country, period, error))
+        else:
+            status = FAILED
+            print('ERROR: Backfill job {0} {1} failed: {2}'.format(country, period, error))
+
+        self.queue.finish(country, period, status, items=items, seconds=seconds, log_file=log_file, error=error)
+        with self._lock:
+            self.items += items
+            if status != PENDING:
+                self.finished_jobs += 1
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# Summary of the runs in the log directory.
+#
+# scrapy runlogs [-a dir=logs] [-a since=YYYY-MM-DD] [-a json=1]
+
+import json
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from scrapers.run_log import aggregate_runs
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return '[-a dir=logs] [-a since=YYYY-MM-DD] [-a json=1]'
+
+    def short_desc(self):
+        return 'Aggregate scraped counts and failed data of the runs in the log directory'
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option('-a', dest='spargs', action='append', default=[], metavar='NAME=VALUE',
+                          help='set an argument (dir, since, json)')
+
+    def process_options(self, args, opts):
+        ScrapyCommand.process_options(self, args, opts)
+        try:
+            opts.spargs = dict(arg.split('=', 1) for arg in opts.spargs)
+        except ValueError:
+            raise UsageError('Invalid -a value, use -a NAME=VALUE', print_help=False)
+
+    def run(self, args, opts):
+        arguments = opts.spargs
+        totals = aggregate_runs(arguments.get('dir', 'logs'), since=arguments.get('since'))
+
+        if arguments.get('json') in ('1', 'true', 'yes'):
+            print(json.dumps(totals, indent=4, sort_keys=True))
+            return
+
+        print('Runs: {0} ({1} crashed)'.format(totals['runs'], totals['crashed_runs']))
+        print('Scraped items: {0}'.format(totals['item_scraped_count']))
+        print('Inserted items: {0}, passed items: {1}'.format(totals['db_inserted_item_count'],
+                                                             totals['db_passed_item_count']))
+        print('Failed data:')
+        for failed_date_str, failures in sorted(totals['failed_data'].items()):
+            for url, count in sorted(failures.items()):
+                print('    {0}  {1}  ({2} run(s))'.format(failed_date_str, url, count))
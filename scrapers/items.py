@@ -5,10 +5,93 @@
 # See documentation in:
 # http://doc.scrapy.org/en/latest/topics/items.html
 
+import sys
+from collections.abc import MutableMapping
+
 import scrapy
+from scrapy.item import BaseItem
 
 
 class ScrapersItem(scrapy.Item):
     # define the fields for your item here like:
     # name = scrapy.Field()
     pass
+
+
+class EexItem(MutableMapping, BaseItem):
+    """A record of eex-transparency.com.
+
+    Fields are stored in slots instead of a dictionary of every item, and
+    the dimension strings (type, company, ..., country) are interned, so the
+    items of a page share them. Timestamps are naive CET datetimes.
+    'country' is the country of the page and is not a column of the site.
+    Items have the mapping interface of scrapy items, unset fields are
+    missing keys.
+    """
+
+    fields = {name: scrapy.Field() for name in (
+        'type', 'company', 'facility', 'unit', 'fuel', 'control_area', 'begin_ts', 'end_ts',
+        'limitation', 'reason', 'status', 'event_id', 'last_update', 'country')}
+
+    # fields which repeat heavily over items
+    dimension_fields = frozenset(('type', 'company', 'facility', 'unit', 'fuel', 'control_area', 'status',
+                                  'country'))
+
+    # BaseItem has an instance dictionary, but it is never created because every field is a slot
+    __slots__ = tuple(fields)
+
+    def __init__(self, *args, **kwargs):
+        if args or kwargs:
+            for key, value in dict(*args, **kwargs).items():
+                self[key] = value
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError("{0} does not support field: {1}".format(self.__class__.__name__, key))
+        if key in self.dimension_fields and type(value) is str:
+            value = sys.intern(value)
+        object.__setattr__(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        try:
+            object.__delattr__(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    # fields are only set through the mapping interface, like fields of scrapy items
+    def __setattr__(self, name, value):
+        raise AttributeError("Use item[{0!r}] = {1!r} to set field value".format(name, value))
+
+    def __iter__(self):
+        for key in self.fields:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        return key in self.fields and hasattr(self, key)
+
+    def __eq__(self, other):
+        if isinstance(other, (EexItem, dict)):
+            return dict(self) == dict(other)
+        return NotImplemented
+
+    __hash__ = BaseItem.__hash__
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def copy(self):
+        return self.__class__(self)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# Persistent queue of backfill jobs.
+#
+# Every job is one history run of a country and period ('YYYY-MM'), saved in
+# a local SQLite database together with its status and attempts. Jobs left
+# 'running' by a stopped backfill are queued again when the queue is opened,
+# so a restarted backfill continues where it stopped. 'attempts' counts the
+# attempts of a job over all runs of the backfill.
+
+import sqlite3
+import threading
+import time
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue(object):
+    """A queue of (country, period) jobs in a SQLite database.
+
+    :param file_name: File of the database.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(file_name, check_same_thread=False, isolation_level=None)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' country TEXT NOT NULL,'
+            ' period TEXT NOT NULL,'
+            ' status TEXT NOT NULL,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' items INTEGER NOT NULL DEFAULT 0,'
+            ' seconds REAL NOT NULL DEFAULT 0,'
+            ' log_file TEXT,'
+            ' error TEXT,'
+            ' updated_at REAL,'
+            ' PRIMARY KEY (country, period))')
+
+        # jobs of a stopped backfill are run again (resumed from their checkpoints)
+        with self._lock:
+            self.connection.execute('UPDATE jobs SET status = ? WHERE status = ?', (PENDING, RUNNING))
+
+    def add(self, jobs):
+        """Adds (country, period) jobs. Jobs which are already in the queue are kept as they are.
+
+        :return: Number of new jobs.
+        """
+        with self._lock:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO jobs (country, period, status, updated_at) VALUES (?, ?, ?, ?)',
+                [(country, period, PENDING, time.time()) for country, period in jobs])
+            return self.connection.total_changes - before
+
+    def retry_failed(self):
+        """Queues failed jobs again. Their attempts of earlier runs are kept."""
+        with self._lock:
+            self.connection.execute('UPDATE jobs SET status = ? WHERE status = ?', (PENDING, FAILED))
+
+    def claim(self):
+        """Marks the next pending job as running and returns it as (country, period, attempts) or None."""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT country, period, attempts FROM jobs WHERE status = ? ORDER BY period, country LIMIT 1',
+                (PENDING,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE country = ? AND period = ?',
+                (RUNNING, time.time(), row[0], row[1]))
+            return row
+
+    def finish(self, country, period, status, items=0, seconds=0.0, log_file=None, error=None):
+        """Saves the result of a job."""
+        with self._lock:
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, items = ?, seconds = ?, log_file = ?, error = ?, updated_at = ?'
+                ' WHERE country = ? AND period = ?',
+                (status, items, seconds, log_file, error, time.time(), country, period))
+
+    def counts(self):
+        """Returns the number of jobs by status."""
+        with self._lock:
+            counts = dict.fromkeys((PENDING, RUNNING, DONE, FAILED), 0)
+            counts.update(self.connection.execute('SELECT status, count(*) FROM jobs GROUP BY status').fetchall())
+            return counts
+
+    def failed_jobs(self):
+        """Returns failed jobs as (country, period, attempts, error, log_file) tuples."""
+        with self._lock:
+            return self.connection.execute(
+                'SELECT country, period, attempts, error, log_file FROM jobs WHERE status = ?'
+                ' ORDER BY period, country', (FAILED,)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
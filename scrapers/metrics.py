@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# Timing and throughput instrumentation of the spider and pipelines.
+#
+# Latencies of the stages of scraping (page load, waits, scripts, parsing,
+# SQL) are recorded in histograms per stage and country. Metrics are put to
+# Scrapy stats when the spider is closed and written periodically to a
+# snapshot file in Prometheus text format. When metrics are disabled, timers
+# are a shared object which does nothing.
+
+import bisect
+import os
+import threading
+import time
+
+
+class _NullTimer(object):
+    """Timer used when metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+
+    def __init__(self, metrics, stage, country):
+        self.metrics = metrics
+        self.stage = stage
+        self.country = country
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.stage, self.country, time.time() - self.start_time)
+        return False
+
+
+class Metrics(object):
+    """Latency histograms and counters labelled by stage and country.
+
+    :param enabled: If False, nothing is recorded.
+    :param snapshot_file: File of periodic snapshots in Prometheus text format, or None.
+    :param snapshot_interval: Seconds between snapshots.
+    """
+
+    # upper bounds of histogram buckets in seconds
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+    def __init__(self, enabled=False, snapshot_file=None, snapshot_interval=30.0):
+        self.enabled = enabled
+        self.snapshot_file = snapshot_file
+        self.snapshot_interval = snapshot_interval
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._snapshot_thread = None
+
+        # (stage, country) -> [bucket counts..., count of bigger values]
+        self.histograms = {}
+        # (stage, country) -> [count, sum]
+        self.totals = {}
+        # (name, country) -> value
+        self.counters = {}
+
+    def timer(self, stage, country=''):
+        """Returns a context manager measuring the time of a stage."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage, country)
+
+    def observe(self, stage, country, seconds):
+        """Records the latency of a stage."""
+        if not self.enabled:
+            return
+        key = (stage, country or '')
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets) + 1)
+                self.totals[key] = [0, 0.0]
+            histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+            total = self.totals[key]
+            total[0] += 1
+            total[1] += seconds
+
+    def count(self, name, country='', value=1):
+        """Adds a value to a counter."""
+        if not self.enabled:
+            return
+        key = (name, country or '')
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def rate(self, name):
+        """Returns the value of a counter of all countries per second of the run."""
+        with self._lock:
+            value = sum(count for (counter_name, country), count in self.counters.items() if counter_name == name)
+        return value / max(time.time() - self.start_time, 1e-9)
+
+    def start(self):
+        """Starts writing periodic snapshots."""
+        if not self.enabled or not self.snapshot_file:
+            return
+        self._snapshot_thread = threading.Thread(target=self._write_snapshots, name='metrics-snapshot')
+        self._snapshot_thread.daemon = True
+        self._snapshot_thread.start()
+
+    def stop(self):
+        """Stops periodic snapshots and writes the last one."""
+        if self._snapshot_thread is not None:
+            self._stop.set()
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+        if self.enabled and self.snapshot_file:
+            self.write_snapshot()
+
+    def stats(self):
+        """Returns metrics as a dictionary of Scrapy stats."""
+        stats = {}
+        if not self.enabled:
+            return stats
+
+        with self._lock:
+            for (stage, country), (count, seconds) in self.totals.items():
+                prefix = 'metrics/{0}/{1}'.format(stage, country or 'all')
+                stats[prefix + '/count'] = count
+                stats[prefix + '/seconds'] = round(seconds, 3)
+            for (name, country), value in self.counters.items():
+                stats['metrics/{0}/{1}'.format(name, country or 'all')] = value
+        stats['metrics/items_per_second'] = round(self.rate('items'), 3)
+        stats['metrics/db_rows_per_second'] = round(self.rate('db_rows_inserted'), 3)
+        return stats
+
+    def prometheus_text(self):
+        """Returns metrics in Prometheus text format."""
+        lines = ['# TYPE eex_stage_seconds histogram']
+        with self._lock:
+            for (stage, country), histogram in sorted(self.histograms.items()):
+                labels = 'stage="{0}",country="{1}"'.format(stage, country)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, histogram):
+                    cumulative += bucket_count
+                    lines.append('eex_stage_seconds_bucket{{{0},le="{1}"}} {2}'.format(labels, bound, cumulative))
+                lines.append('eex_stage_seconds_bucket{{{0},le="+Inf"}} {1}'.format(labels, cumulative + histogram[-1]))
+                count, seconds = self.totals[(stage, country)]
+                lines.append('eex_stage_seconds_sum{{{0}}} {1}'.format(labels, seconds))
+                lines.append('eex_stage_seconds_count{{{0}}} {1}'.format(labels, count))
+
+            lines.append('# TYPE eex_events_total counter')
+            for (name, country), value in sorted(self.counters.items()):
+                lines.append('eex_events_total{{name="{0}",country="{1}"}} {2}'.format(name, country, value))
+
+        lines.append('# TYPE eex_items_per_second gauge')
+        lines.append('eex_items_per_second {0}'.format(self.rate('items')))
+        lines.append('# TYPE eex_db_rows_per_second gauge')
+        lines.append('eex_db_rows_per_second {0}'.format(self.rate('db_rows_inserted')))
+        return '\n'.join(lines) + '\n'
+
+    def write_snapshot(self):
+        directory = os.path.dirname(self.snapshot_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_file_name = self.snapshot_file + '.tmp'
+        with open(tmp_file_name, mode='w') as snapshot_file:
+            snapshot_file.write(self.prometheus_text())
+        os.replace(tmp_file_name, self.snapshot_file)
+
+    def _write_snapshots(self):
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                print("ERROR: Unable to write metrics snapshot:", e)
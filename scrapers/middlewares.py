@@ -5,8 +5,12 @@
 # See documentation in:
 # http://doc.scrapy.org/en/latest/topics/spider-middleware.html
 
+import random
+
 from scrapy import signals
 
+from scrapers.proxies import HealthPool, read_list
+
 
 class ScrapersSpiderMiddleware(object):
     # Not all methods need to be defined. If a method is not defined,
@@ -54,3 +58,86 @@ class ScrapersSpiderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class HealthProxyMiddleware(object):
+    """Downloader middleware routing requests to the healthiest proxies and user agents.
+
+    Replaces scrapy_proxies.RandomProxy and RandomUserAgentMiddleware. Latency,
+    errors and ban signals (PROXY_BAN_HTTP_CODES) of every proxy are tracked
+    in a HealthPool, bad proxies are put on cooldown. The pools are set to the
+    spider as 'proxy_pool' and 'user_agent_pool', so browser sessions use the
+    same proxies as requests.
+
+    A retried request gets a new proxy. Requests with a 'proxy' meta key set
+    by the spider are left as they are.
+    """
+
+    def __init__(self, proxy_pool, user_agent_pool, ban_http_codes):
+        self.proxy_pool = proxy_pool
+        self.user_agent_pool = user_agent_pool
+        self.ban_http_codes = set(ban_http_codes)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        proxies = read_list(settings.get('PROXY_LIST'))
+        proxy_mode = settings.getint('PROXY_MODE', 0)
+        if proxy_mode == 1 and proxies:
+            # one proxy of the list for every request
+            proxies = [random.choice(proxies)]
+        elif proxy_mode == 2:
+            proxies = [settings.get('CUSTOM_PROXY')] if settings.get('CUSTOM_PROXY') else []
+
+        pool_kwargs = {
+            'cooldown': settings.getfloat('PROXY_COOLDOWN', 60),
+            'max_cooldown': settings.getfloat('PROXY_MAX_COOLDOWN', 900),
+            'max_failures': settings.getint('PROXY_MAX_FAILURES', 3),
+        }
+        middleware = cls(HealthPool(proxies, **pool_kwargs),
+                         HealthPool(read_list(settings.get('USER_AGENT_LIST')), **pool_kwargs),
+                         {int(code) for code in settings.getlist('PROXY_BAN_HTTP_CODES', [403, 407, 429])})
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        spider.proxy_pool = self.proxy_pool
+        spider.user_agent_pool = self.user_agent_pool
+        print("Proxy pool: {0} proxies, {1} user agents.".format(len(self.proxy_pool), len(self.user_agent_pool)))
+
+    def spider_closed(self, spider):
+        for stats in self.proxy_pool.stats():
+            print("Proxy {key}: {requests} requests, latency {latency}, error rate {error_rate}".format(**stats))
+
+    def process_request(self, request, spider):
+        if 'proxy' in request.meta and 'health_proxy' not in request.meta:
+            return None
+
+        proxy = self.proxy_pool.choose()
+        if proxy is not None:
+            request.meta['proxy'] = proxy
+            request.meta['health_proxy'] = proxy
+        user_agent = self.user_agent_pool.choose()
+        if user_agent is not None:
+            request.headers['User-Agent'] = user_agent
+            request.meta['health_user_agent'] = user_agent
+        return None
+
+    def process_response(self, request, response, spider):
+        proxy = request.meta.get('health_proxy')
+        user_agent = request.meta.get('health_user_agent')
+        if response.status in self.ban_http_codes:
+            self.proxy_pool.record_failure(proxy, ban=True)
+            self.user_agent_pool.record_failure(user_agent, ban=True)
+        elif response.status >= 500:
+            self.proxy_pool.record_failure(proxy)
+        else:
+            latency = request.meta.get('download_latency', 0.0)
+            self.proxy_pool.record_success(proxy, latency)
+            self.user_agent_pool.record_success(user_agent, latency)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.proxy_pool.record_failure(request.meta.get('health_proxy'))
+        return None
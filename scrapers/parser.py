@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+# Batch parser of the records scraped from eex-transparency.com.
+#
+# A whole page of records is converted at once: every column is extracted
+# with one pass and the epoch timestamps of a column are converted to CET
+# with a single vectorized pandas call instead of one timezone lookup per
+# record and timestamp. Items are slotted EexItems with datetimes.
+
+import numpy as np
+import pandas as pd
+
+from scrapers.items import EexItem
+
+# text format of timestamps, the format of timestamps of items before they were datetimes
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def to_datetimes(milliseconds):
+    """Converts epoch milliseconds to naive CET wall time datetimes, truncated to seconds.
+
+    :param milliseconds: Sequence of epoch timestamps in milliseconds.
+    :return: List of datetimes.
+    """
+    # whole microseconds, rounded like datetime.fromtimestamp does
+    microseconds = np.round(np.asarray(milliseconds, dtype='float64') * 1000).astype('int64')
+    timestamps = pd.Series(pd.to_datetime(microseconds, unit='us'))
+    timestamps = timestamps.dt.tz_localize('UTC').dt.tz_convert('CET').dt.tz_localize(None).dt.floor('s')
+    return list(timestamps.dt.to_pydatetime())
+
+
+def parse_records(data_object, country=None):
+    """Parses a page of records to items.
+
+    :param data_object: List of source records.
+    :param country: Country of the page, e.g. 'germany'. Items have no 'country' when it is None.
+    :return: List of EexItems.
+    """
+    if not data_object:
+        return []
+
+    begin_ts = to_datetimes([record['begin'] for record in data_object])
+    end_ts = to_datetimes([record['end'] for record in data_object])
+    last_update = to_datetimes([record['modify_timestamp'] for record in data_object])
+
+    items = [
+        EexItem({
+            'type': record['type'],
+            'company': record['short_name'],
+            'facility': record['prodcon'],
+            'unit': record['unit'],
+            'fuel': record['fuel'] if 'fuel' in record else "",
+            'control_area': record['connecting_area'],
+            'begin_ts': begin_ts[i],
+            'end_ts': end_ts[i],
+            'limitation': record['energy_limitation'],
+            'reason': record['reason'],
+            'status': record['canceled'],
+            'event_id': record['event_id'],
+            'last_update': last_update[i]
+        })
+        for i, record in enumerate(data_object)
+    ]
+    if country is not None:
+        for item in items:
+            item['country'] = country
+    return items
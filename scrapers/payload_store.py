@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# On-disk store of raw page payloads.
+#
+# Every scraped page (the JSON records of 'sc.eventData' or 'sc.data') is
+# saved gzip compressed under the sha256 of its content. An index maps the
+# page key (country page url, date window, page number) to the content hash,
+# so the same content is stored once. When the store is bigger than its size
+# limit, the least recently used pages are removed.
+#
+# The index is a SQLite database (WAL), so several spiders (e.g. backfill
+# jobs) can capture to the same store. Every object has a reference count
+# and the total size of the objects is kept up to date, so a page costs a
+# few row updates and eviction only runs when the limit is exceeded.
+
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# number of least recently used pages read at once during eviction
+EVICT_BATCH_SIZE = 100
+
+
+class PayloadStore(object):
+    """Content-addressed store of page payloads.
+
+    :param directory: Directory of the store.
+    :param max_bytes: Maximum size of stored payloads (compressed). 0 means no limit.
+    """
+
+    def __init__(self, directory, max_bytes=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_file_name = os.path.join(directory, 'index.sqlite')
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        # transactions are started explicitly, writers of other processes wait for each other
+        self.connection = sqlite3.connect(self.index_file_name, timeout=60, check_same_thread=False,
+                                          isolation_level=None)
+        with self._lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS pages ('
+                                    ' key TEXT PRIMARY KEY,'
+                                    ' hash TEXT NOT NULL,'
+                                    ' accessed REAL NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS pages_accessed_idx ON pages (accessed)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS objects ('
+                                    ' hash TEXT PRIMARY KEY,'
+                                    ' size INTEGER NOT NULL,'
+                                    ' refs INTEGER NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS totals ('
+                                    ' name TEXT PRIMARY KEY,'
+                                    ' value INTEGER NOT NULL)')
+            self.connection.execute("INSERT OR IGNORE INTO totals (name, value) VALUES ('bytes', 0)")
+
+    @staticmethod
+    def page_key(url, start, end, page):
+        """Returns the key of a page of a country page url and date window."""
+        return '{0}|{1}|{2}|{3:05d}'.format(url, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), page)
+
+    def put(self, url, start, end, page, payload):
+        """Saves the payload of a page."""
+        content = json.dumps(payload, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        content_hash = hashlib.sha256(content).hexdigest()
+        key = self.page_key(url, start, end, page)
+
+        with self._lock:
+            cur = self.connection.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                row = cur.execute('SELECT hash FROM pages WHERE key = ?', (key,)).fetchone()
+                cur.execute('INSERT OR REPLACE INTO pages (key, hash, accessed) VALUES (?, ?, ?)',
+                            (key, content_hash, time.time()))
+                if row is None or row[0] != content_hash:
+                    self._add_reference(cur, content_hash, content)
+                    if row is not None:
+                        self._remove_reference(cur, row[0])
+                    self._evict(cur, key)
+                cur.execute('COMMIT')
+            except BaseException:
+                cur.execute('ROLLBACK')
+                raise
+
+    def get(self, key):
+        """Returns the payload of a page key or None."""
+        with self._lock:
+            row = self.connection.execute('SELECT hash FROM pages WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE pages SET accessed = ? WHERE key = ?', (time.time(), key))
+
+        try:
+            with gzip.open(self._object_file_name(row[0]), mode='rb') as object_file:
+                return json.loads(object_file.read().decode('utf-8'))
+        except (OSError, ValueError) as e:
+            print("ERROR: Unable to read stored payload:", key, e)
+            return None
+
+    def page_keys(self, url, start, end):
+        """Returns the keys of stored pages of a country page url and date window in page order."""
+        prefix = '{0}|{1}|{2}|'.format(url, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+        with self._lock:
+            # '}' is the character after '|', so the range has every key with the prefix
+            rows = self.connection.execute('SELECT key FROM pages WHERE key >= ? AND key < ? ORDER BY key',
+                                           (prefix, prefix[:-1] + '}')).fetchall()
+        return [row[0] for row in rows]
+
+    def total_bytes(self):
+        """Returns the size of stored objects (compressed)."""
+        with self._lock:
+            return self.connection.execute("SELECT value FROM totals WHERE name = 'bytes'").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def _object_file_name(self, content_hash):
+        return os.path.join(self.directory, 'objects', content_hash[:2], content_hash + '.json.gz')
+
+    # adds a page to the references of an object. A new object is written in the transaction,
+    # so the file of an object exists as long as its row
+    def _add_reference(self, cur, content_hash, content):
+        if cur.execute('UPDATE objects SET refs = refs + 1 WHERE hash = ?', (content_hash,)).rowcount:
+            return
+
+        object_file_name = self._object_file_name(content_hash)
+        os.makedirs(os.path.dirname(object_file_name), exist_ok=True)
+        tmp_file_name = object_file_name + '.tmp'
+        with gzip.open(tmp_file_name, mode='wb') as object_file:
+            object_file.write(content)
+        os.replace(tmp_file_name, object_file_name)
+
+        size = os.path.getsize(object_file_name)
+        cur.execute('INSERT INTO objects (hash, size, refs) VALUES (?, ?, 1)', (content_hash, size))
+        cur.execute("UPDATE totals SET value = value + ? WHERE name = 'bytes'", (size,))
+
+    # removes a page from the references of an object. The object is removed with its last page
+    def _remove_reference(self, cur, content_hash):
+        cur.execute('UPDATE objects SET refs = refs - 1 WHERE hash = ?', (content_hash,))
+        row = cur.execute('SELECT size FROM objects WHERE hash = ? AND refs <= 0', (content_hash,)).fetchone()
+        if row is None:
+            return
+
+        cur.execute('DELETE FROM objects WHERE hash = ?', (content_hash,))
+        cur.execute("UPDATE totals SET value = value - ? WHERE name = 'bytes'", (row[0],))
+        try:
+            os.remove(self._object_file_name(content_hash))
+        except OSError:
+            pass
+
+    # removes least recently used pages (but not the page just saved) until the store fits into max_bytes
+    def _evict(self, cur, saved_key):
+        if not self.max_bytes:
+            return
+
+        while cur.execute("SELECT value FROM totals WHERE name = 'bytes'").fetchone()[0] > self.max_bytes:
+            rows = cur.execute('SELECT key, hash FROM pages WHERE key != ? ORDER BY accessed LIMIT ?',
+                               (saved_key, EVICT_BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            for key, content_hash in rows:
+                cur.execute('DELETE FROM pages WHERE key = ?', (key,))
+                self._remove_reference(cur, content_hash)
+                if cur.execute("SELECT value FROM totals WHERE name = 'bytes'").fetchone()[0] <= self.max_bytes:
+                    return
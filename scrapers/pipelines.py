@@ -5,105 +5,591 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
-import json
+import io
 import os
+import collections
+import time
 import datetime
+import hashlib
+import threading
 import psycopg2
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+try:
+    from scrapers.config import POSTGRE_CREDENTIALS
+except ImportError:
+    # credentials must be given with POSTGRE_CREDENTIALS setting
+    POSTGRE_CREDENTIALS = None
+from scrapers.metrics import Metrics
+from scrapers.writer import PostgreWriter
+
+
+class DedupIndex(object):
+    """Set of 64 bit hashes of (event_id, begin_ts, end_ts, last_update) keys.
+
+    It is used to drop items which are already in database, or already seen
+    in this run, before any SQL is issued. When 'max_keys' hashes are stored
+    new keys are not added anymore and the check is left to database.
+    """
+
+    def __init__(self, max_keys=2000000):
+        self.max_keys = max_keys
+        self.hashes = set()
+
+    @staticmethod
+    def key_hash(event_id, begin_ts, end_ts, last_update):
+        key = '|'.join(DedupIndex._key_value(value) for value in (event_id, begin_ts, end_ts, last_update))
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+    @staticmethod
+    def _key_value(value):
+        # timestamps of database and of items are compared in the format of items
+        if isinstance(value, datetime.datetime):
+            return value.strftime("%Y-%m-%dT%H:%M:%S")
+        return str(value)
+
+    def item_hash(self, item):
+        return self.key_hash(item['event_id'], item['begin_ts'], item['end_ts'], item['last_update'])
+
+    def add(self, key_hash):
+        """Adds a hash, returns False if the index is full."""
+        if len(self.hashes) >= self.max_keys:
+            return False
+        self.hashes.add(key_hash)
+        return True
+
+    def discard(self, key_hash):
+        self.hashes.discard(key_hash)
+
+    def __contains__(self, key_hash):
+        return key_hash in self.hashes
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+class DimensionCache(object):
+    """LRU cache of ids of dimension values (companies, facilities...) of the normalized schema.
+
+    Ids of values never change, so cached ids are always valid. It is
+    shared by writer threads.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.ids = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, dimension, value):
+        key = (dimension, value)
+        with self._lock:
+            value_id = self.ids.get(key)
+            if value_id is not None:
+                self.ids.move_to_end(key)
+            return value_id
+
+    def put(self, dimension, value, value_id):
+        key = (dimension, value)
+        with self._lock:
+            self.ids[key] = value_id
+            self.ids.move_to_end(key)
+            while len(self.ids) > self.max_size:
+                self.ids.popitem(last=False)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class SaveTracker(object):
+    """Tells when the items handed to a pipeline are saved.
+
+    Items are numbered in the order they are added and saved in chunks of
+    consecutive numbers, which writer threads finish in any order. 'wait'
+    returns a Deferred which fires with True when every item added so far is
+    saved, or with False when one of them is not saved. The Deferreds are
+    fired by 'fire_ready' in the reactor thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # number of added items and of items taken to chunks
+        self.added = 0
+        self.chunked = 0
+        # items before this number are in finished chunks
+        self.finished_until = 0
+        # number of the first item which is not saved, None if every finished item is saved
+        self.first_unsaved = None
+        # finished chunks after 'finished_until' as {start: (end, saved)}
+        self._finished = {}
+        # (number of items, Deferred) of waiters
+        self._waiters = []
+
+    def add(self):
+        self.added += 1
+
+    def take(self, count):
+        """Returns the number of the first item of a chunk of the next 'count' items."""
+        start = self.chunked
+        self.chunked += count
+        return start
+
+    def finish(self, start, count, saved):
+        """Records a finished chunk. This is called in writer threads."""
+        with self._lock:
+            self._finished[start] = (start + count, saved)
+            while self.finished_until in self._finished:
+                end, chunk_saved = self._finished.pop(self.finished_until)
+                if not chunk_saved and self.first_unsaved is None:
+                    self.first_unsaved = self.finished_until
+                self.finished_until = end
+
+    def wait(self):
+        """Returns a Deferred firing with True when the items added so far are saved."""
+        d = defer.Deferred()
+        with self._lock:
+            self._waiters.append((self.added, d))
+        self.fire_ready()
+        return d
+
+    def fire_ready(self):
+        """Fires the waiters whose items are in finished chunks."""
+        with self._lock:
+            ready = [(self._saved(count), d) for count, d in self._waiters if count <= self.finished_until]
+            self._waiters = [(count, d) for count, d in self._waiters if count > self.finished_until]
+        for saved, d in ready:
+            d.callback(saved)
+
+    def release(self):
+        """Fires every waiter, the ones whose items are not finished with False."""
+        self.fire_ready()
+        with self._lock:
+            waiters, self._waiters = self._waiters, []
+        for count, d in waiters:
+            d.callback(False)
+
+    def _saved(self, count):
+        return self.first_unsaved is None or self.first_unsaved >= count
 
-from scrapers.config import POSTGRE_CREDENTIALS
 
 # save item to Postgre
 class PostgrePipeline(object):
     """This pipeline saves data to PostgreSQL database.
 
     Credentials to connect to database are stored in config.py,
-    POSTGRE_CREDENTIALS variable.
+    POSTGRE_CREDENTIALS variable. POSTGRE_CREDENTIALS setting overrides them.
+
+    Items are buffered and written in chunks: every chunk is streamed with
+    COPY into a temporary staging table and merged into the data table with
+    a single INSERT ... SELECT which skips rows that already exist.
+    The chunk size and the maximum time between writes are set with
+    POSTGRE_BATCH_SIZE and POSTGRE_FLUSH_INTERVAL settings.
+
+    Chunks are written in background by PostgreWriter threads with pooled
+    connections (POSTGRE_WRITERS, POSTGRE_WRITER_QUEUE_SIZE), so scraping
+    goes on while the database works. A full chunk is handed to the writer
+    from a thread of its own, and the item which fills it is processed when
+    the chunk is queued. So a slow database slows the spider down, but the
+    reactor thread never waits for the queue of the writer.
+
+    The pipeline adds 'wait' of its SaveTracker to 'item_save_waiters' of
+    the spider, which saves the checkpoint of a page when its items are
+    saved.
+
+    With POSTGRE_NORMALIZED setting, dimension values are saved to lookup
+    tables and rows to '<table>_facts' with the ids of their values. Ids are
+    resolved through a DimensionCache, and the values of a chunk which are
+    not cached are upserted with one query per dimension. The '<table>' view
+    has the columns of the data table.
     """
     pg_credentials = POSTGRE_CREDENTIALS
     schema = 'covalis1'
 
+    # schema migrations of data table. Every migration is applied once, in version order,
+    # when spider is opened. {0} is schema name and {1} is table name.
+    # no migration deletes rows: duplicates which are in the way of the unique index are moved
+    # to '<table>_duplicates', where they can be checked and restored
+    migrations = [
+        (1, 'move duplicated rows to {1}_duplicates',
+         'CREATE TABLE IF NOT EXISTS {0}.{1}_duplicates (LIKE {0}.{1});'
+         'WITH moved AS ('
+         'DELETE FROM {0}.{1} a USING {0}.{1} b '
+         'WHERE a.event_id = b.event_id '
+         'and a.begin_ts = b.begin_ts '
+         'and a.end_ts = b.end_ts '
+         'and a.last_update = b.last_update '
+         'and a.id > b.id '
+         'RETURNING a.*) '
+         'INSERT INTO {0}.{1}_duplicates SELECT * FROM moved;'),
+        (2, 'unique index on (event_id, begin_ts, end_ts, last_update)',
+         'CREATE UNIQUE INDEX IF NOT EXISTS {1}_event_key_idx '
+         'ON {0}.{1} (event_id, begin_ts, end_ts, last_update);'),
+        (3, 'index on (event_id, last_update)',
+         'CREATE INDEX IF NOT EXISTS {1}_event_id_last_update_idx '
+         'ON {0}.{1} (event_id, last_update);'),
+    ]
+
+    # columns of data table which are filled from items, in COPY order
+    columns = ('type', 'company', 'facility', 'unit', 'fuel', 'control_area', 'begin_ts', 'end_ts',
+               'limitation', 'reason', 'status', 'event_id', 'last_update')
+
+    # columns which are saved to lookup tables in the normalized schema
+    dimensions = ('company', 'facility', 'unit', 'fuel', 'control_area', 'reason')
+
     # connect to Postgre
-    def __init__(self):
-        self.connection = psycopg2.connect(database=self.pg_credentials["database"],
-                                           user=self.pg_credentials["user"],
-                                           host=self.pg_credentials["host"],
-                                           password=self.pg_credentials["password"])
-        self.cur = self.connection.cursor()
+    def __init__(self, batch_size=1000, flush_interval=10.0, dedup_max_keys=2000000,
+                 writers=2, writer_queue_size=4, credentials=None, normalized=False, dimension_cache_size=100000):
+        if credentials:
+            self.pg_credentials = credentials
+        self.connect()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.writers = writers
+        self.writer_queue_size = writer_queue_size
+        # background writer of chunks. It is started in 'open_spider'
+        self.writer = None
+        # thread queuing chunks to the writer, so the reactor thread never waits for a full queue
+        self.submit_pool = None
+        # lock protecting counters and item lists shared with writer threads
+        self._lock = threading.Lock()
+        # instrumentation of the spider. It is set in 'open_spider'
+        self.metrics = Metrics(enabled=False)
+        # keys of rows in database and of items of this run, None if disabled
+        self.dedup_index = DedupIndex(dedup_max_keys) if dedup_max_keys > 0 else None
+        self.last_flush_time = time.time()
         self.pending_items = []
+        # tells the spider when the items handed to the pipeline are saved
+        self.save_tracker = SaveTracker()
         self.failed_items = []
-        self.event_ids = []
+        # event ids saved row by row. Their version numbers are updated when spider is closing
+        self.event_ids = set()
         self.db_inserted_item_count = 0
         self.db_passed_item_count = 0
 
-    # create table to save data
+        self.normalized = normalized
+        self.dimension_cache = DimensionCache(dimension_cache_size) if normalized else None
+        # columns of the table rows are saved to, in COPY order
+        self.data_columns = tuple(column + '_id' if normalized and column in self.dimensions else column
+                                  for column in self.columns)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(batch_size=crawler.settings.getint('POSTGRE_BATCH_SIZE', 1000),
+                   flush_interval=crawler.settings.getfloat('POSTGRE_FLUSH_INTERVAL', 10.0),
+                   dedup_max_keys=crawler.settings.getint('POSTGRE_DEDUP_MAX_KEYS', 2000000),
+                   writers=crawler.settings.getint('POSTGRE_WRITERS', 2),
+                   writer_queue_size=crawler.settings.getint('POSTGRE_WRITER_QUEUE_SIZE', 4),
+                   credentials=crawler.settings.getdict('POSTGRE_CREDENTIALS') or None,
+                   normalized=crawler.settings.getbool('POSTGRE_NORMALIZED', False),
+                   dimension_cache_size=crawler.settings.getint('POSTGRE_DIMENSION_CACHE_SIZE', 100000))
+
+    # arguments of psycopg2.connect
+    def connection_kwargs(self):
+        return {
+            'database': self.pg_credentials["database"],
+            'user': self.pg_credentials["user"],
+            'host': self.pg_credentials["host"],
+            'password': self.pg_credentials.get("password"),
+            'port': self.pg_credentials.get("port", 5432)
+        }
+
+    # connection used for schema changes and for work when spider is opening or closing
+    def connect(self):
+        self.connection = psycopg2.connect(**self.connection_kwargs())
+        self.cur = self.connection.cursor()
+
+    # create table to save data and upgrade its schema
     def open_spider(self, spider):
-        self.create_table(spider.table)
+        self.metrics = getattr(spider, 'metrics', self.metrics)
+        if self.normalized:
+            self.create_normalized_tables(spider.table)
+        else:
+            self.create_table(spider.table)
+            self.migrate(spider.table)
+
+        if self.dedup_index is not None:
+            if spider.mode == 'history':
+                self.load_dedup_index(spider.table, spider.start, spider.end)
+            else:
+                self.load_dedup_index(spider.table, spider.now_date, spider.now_date)
+
+        table_name = spider.table
+        self.writer = PostgreWriter(lambda connection, chunk: self.write_tracked_chunk(connection, chunk, table_name),
+                                    self.write_failed,
+                                    self.connection_kwargs(),
+                                    workers=self.writers,
+                                    queue_size=self.writer_queue_size)
+        self.submit_pool = ThreadPool(1, 1, name='postgre-submit')
+        self.submit_pool.start()
+
+        if hasattr(spider, 'item_save_waiters'):
+            spider.item_save_waiters.append(self.save_tracker.wait)
 
     def close_spider(self, spider):
 
+        # save remaining items and wait for the writers
         try:
-            self.connection.commit()
-            self.pending_items.clear()
-
-        except psycopg2.DataError as e:
-            self.connection.rollback()
-            self.failed_items.extend(self.pending_items)
-            self.pending_items.clear()
-            print("ERROR: During save to postgre:", e.pgerror)
+            # items are processed (so their chunks are queued) before spider is closed
+            self.submit_pool.stop()
+            self.flush(spider.table)
+            self.writer.close()
+        except Exception:
+            # any item can be lost, so the spider moves no high-water mark
+            if hasattr(spider, 'unsaved_countries'):
+                spider.unsaved_countries.add(None)
+            raise
+        finally:
+            # checkpoints of saved pages are saved before spider is closed
+            self.save_tracker.release()
 
         if self.failed_items:
             print("FAILED ITEMS:")
             for failed in self.failed_items:
                 print(failed)
 
-        # update version number for every collected event ids when spider is closing
-        for event_id in self.event_ids:
-            self.update_version_no(spider.table, event_id)
+        # update version number for event ids which are not updated yet when spider is closing
+        if self.connection.closed:
+            self.connect()
+        try:
+            self.update_version_no(self.data_table(spider.table), self.event_ids)
+        except psycopg2.DatabaseError as e:
+            if not self.connection.closed:
+                self.connection.rollback()
+            print("ERROR: During update of version numbers:", e.pgerror)
 
         self.event_ids.clear()
 
-        # save item_scraped_count to log file
-        with open(spider.log_file_name, mode='w+') as log_file:
-            spider.scrape_info['item_scraped_count'] = spider.item_scraped_count
-            spider.scrape_info['db_inserted_item_count'] = self.db_inserted_item_count
-            spider.scrape_info['db_passed_item_count'] = self.db_passed_item_count
-            json.dump(spider.scrape_info, log_file, indent=4)
+        # database counts are saved to the log summary when the spider is closed
+        spider.run_log.update(db_inserted_item_count=self.db_inserted_item_count,
+                              db_passed_item_count=self.db_passed_item_count,
+                              db_failed_item_count=len(self.failed_items))
+
+        # the spider does not move the high-water marks of countries with items which are not saved
+        if hasattr(spider, 'unsaved_countries'):
+            spider.unsaved_countries.update(item.get('country') for item in self.failed_items)
 
     # save item to Postgre
+    # items are collected and saved when the chunk is full or flush interval is passed
     def process_item(self, item, spider):
+        if self.dedup_index is not None:
+            key_hash = self.dedup_index.item_hash(item)
+            with self._lock:
+                if key_hash in self.dedup_index:
+                    self.db_passed_item_count += 1
+                    return item
+                self.dedup_index.add(key_hash)
+
+        self.pending_items.append(item)
+        self.save_tracker.add()
+
+        if len(self.pending_items) >= self.batch_size \
+                or time.time() - self.last_flush_time >= self.flush_interval:
+            # the queue of the writer may be full, so the item is processed when its chunk is queued
+            d = threads.deferToThreadPool(reactor, self.submit_pool, self.writer.submit, self.take_chunk())
+            d.addCallback(lambda _: item)
+            return d
+
+        return item
+
+    # loads the keys of rows of the date window into dedup index
+    def load_dedup_index(self, table_name, start, end):
+        keys_query = ("select event_id, begin_ts, end_ts, last_update from {0}.{1} "
+                      "where begin_ts < %(end)s "
+                      "and end_ts >= %(start)s"
+                      ).format(self.schema, self.data_table(table_name))
 
+        # named cursor fetches rows from server in chunks
+        cursor = self.connection.cursor(name='dedup_keys')
+        cursor.itersize = 10000
+        cursor.execute(keys_query, {'start': start, 'end': end + datetime.timedelta(days=1)})
+        for row in cursor:
+            if not self.dedup_index.add(DedupIndex.key_hash(*row)):
+                print("Dedup index is full, remaining keys are checked by database.")
+                break
+        cursor.close()
+        self.connection.commit()
+
+        print("Dedup index loaded with {0} keys.".format(len(self.dedup_index)))
+
+    # hand pending items to the background writer
+    # this blocks while the queue of writer is full, it is called when spider is closing
+    def flush(self, table_name):
+        chunk = self.take_chunk()
+        if chunk[1]:
+            self.writer.submit(chunk)
+
+    # returns the pending items as a chunk for the writer: the number of its first item and the items
+    def take_chunk(self):
+        self.last_flush_time = time.time()
+        items = list(self.pending_items)
+        self.pending_items.clear()
+        return self.save_tracker.take(len(items)), items
+
+    # save a chunk of the writer and tell the save tracker about it. This is called in writer threads
+    def write_tracked_chunk(self, connection, chunk, table_name):
+        start, items = chunk
+        saved = self.write_chunk(connection, items, table_name)
+        self.chunk_finished(start, items, saved)
+
+    def chunk_finished(self, start, items, saved):
+        self.save_tracker.finish(start, len(items), saved)
+        reactor.callFromThread(self.save_tracker.fire_ready)
+
+    # save a chunk of items. This is called in writer threads
+    # connection errors are raised to the writer, which retries with a new connection
+    # returns true when every item is saved
+    def write_chunk(self, connection, items, table_name):
+        cur = connection.cursor()
         try:
-            self.postgre_upsert(item, spider.table)
-
-        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
-            print ("ERROR: During save to postgre:", e.pgerror)
-            self.connection.rollback()
-            self.failed_items.extend(self.pending_items)
-            self.pending_items.clear()
-        except psycopg2.DatabaseError:
-            self.connection = psycopg2.connect(database=self.pg_credentials["database"],
-                                               user=self.pg_credentials["user"],
-                                               host=self.pg_credentials["host"],
-                                               password=self.pg_credentials["password"])
-            self.cur = self.connection.cursor()
-            self.postgre_upsert(item, spider.table)
-
-        if len(self.pending_items) > 10:
+            self.postgre_copy(cur, items, table_name)
+        except psycopg2.DataError as e:
+            # a bad row fails the whole chunk, so find it with row by row inserts
+            print("ERROR: During save to postgre:", e.pgerror)
+            connection.rollback()
+            return self.save_items_one_by_one(cur, items, table_name)
+        except psycopg2.IntegrityError as e:
+            print("ERROR: During save to postgre:", e.pgerror)
+            connection.rollback()
+            self.add_failed_items(items)
+            return False
+        return True
+
+    # this is called by the writer when a chunk can not be saved
+    def write_failed(self, chunk, error):
+        start, items = chunk
+        print("ERROR: Unexpected error during save to postgre:", error)
+        self.add_failed_items(items)
+        self.chunk_finished(start, items, False)
+
+    # keeps items which are not saved. They are removed from dedup index,
+    # so that the same items are tried again if they are scraped again
+    def add_failed_items(self, items):
+        with self._lock:
+            self.failed_items.extend(items)
+            if self.dedup_index is not None:
+                for item in items:
+                    self.dedup_index.discard(self.dedup_index.item_hash(item))
+
+    # table which rows are saved to, the facts table of the normalized schema
+    def data_table(self, table_name):
+        return '{0}_facts'.format(table_name) if self.normalized else table_name
+
+    # returns the ids of the dimension values of items by dimension and value.
+    # values which are not cached are upserted to lookup tables with one query per dimension
+    def resolve_dimension_ids(self, cur, items, table_name):
+        ids = {}
+        for dimension in self.dimensions:
+            resolved = {}
+            missing = []
+            for value in set(item[dimension] for item in items):
+                if value is None:
+                    continue
+                value_id = self.dimension_cache.get(dimension, value)
+                if value_id is None:
+                    missing.append(value)
+                else:
+                    resolved[value] = value_id
+
+            if missing:
+                # sorted, so writers inserting the same new values never deadlock
+                missing.sort()
+                lookup_table = '{0}.{1}_{2}'.format(self.schema, table_name, dimension)
+                cur.execute("INSERT INTO {0} (value) SELECT unnest(%(values)s::text[]) "
+                            "ON CONFLICT (value) DO NOTHING;".format(lookup_table), {'values': missing})
+                cur.execute("SELECT value, id FROM {0} WHERE value = any(%(values)s::text[]);".format(lookup_table),
+                            {'values': missing})
+                for value, value_id in cur.fetchall():
+                    resolved[value] = value_id
+                    self.dimension_cache.put(dimension, value, value_id)
+            ids[dimension] = resolved
+
+        # ids are cached, so they are committed even if the chunk fails
+        cur.connection.commit()
+        return ids
+
+    # returns the values of items in the order of data columns
+    def item_rows(self, cur, items, table_name):
+        if not self.normalized:
+            return [tuple(item[column] for column in self.columns) for item in items]
+
+        ids = self.resolve_dimension_ids(cur, items, table_name)
+        return [tuple(ids[column].get(item[column]) if column in ids else item[column] for column in self.columns)
+                for item in items]
+
+    # save a chunk of items with COPY into staging table and a single merge query
+    def postgre_copy(self, cur, items, table_name):
+        rows = self.item_rows(cur, items, table_name)
+        table_name = self.data_table(table_name)
+        staging_table = '{0}_staging'.format(table_name)
+        columns = ','.join(self.data_columns)
+
+        # temporary table is not written to WAL and is private to this connection
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS {0} ON COMMIT DELETE ROWS AS "
+                    "SELECT {3} FROM {1}.{2} WITH NO DATA;"
+                    .format(staging_table, self.schema, table_name, columns))
+
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(self._copy_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        with self.metrics.timer('sql_copy'):
+            cur.copy_expert("COPY {0} ({1}) FROM STDIN".format(staging_table, columns), buffer)
+
+        # writers copy in parallel, but merge one by one so they never deadlock on the same events
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", ('{0}.{1}'.format(self.schema, table_name),))
+
+        merge_query = ("INSERT INTO {0}.{1} ({2}) "
+                       "SELECT DISTINCT ON (event_id, begin_ts, end_ts, last_update) {2} "
+                       "FROM {3} s "
+                       "WHERE NOT EXISTS ("
+                       "select 1 from {0}.{1} t "
+                       "WHERE "
+                       "t.event_id = s.event_id "
+                       "and t.begin_ts = s.begin_ts "
+                       "and t.end_ts = s.end_ts "
+                       "and t.last_update = s.last_update) "
+                       "ON CONFLICT DO NOTHING "
+                       "RETURNING event_id;"
+                       ).format(self.schema, table_name, columns, staging_table)
+        with self.metrics.timer('sql_merge'):
+            cur.execute(merge_query)
+            inserted_count = cur.rowcount
+
+            # only events which got new rows need new version numbers
+            # they are updated in the same transaction as the chunk
+            self.update_version_no(table_name, set(row[0] for row in cur.fetchall()), cur=cur, commit=False)
+
+            cur.connection.commit()
+
+        self.metrics.count('db_rows_inserted', value=inserted_count)
+        self.metrics.count('db_rows_passed', value=len(items) - inserted_count)
+        with self._lock:
+            self.db_inserted_item_count += inserted_count
+            self.db_passed_item_count += len(items) - inserted_count
+
+    # save items with one query per item so that only the bad items fail
+    # returns true when every item is saved
+    def save_items_one_by_one(self, cur, items, table_name):
+        saved = True
+        for item in items:
             try:
-                self.connection.commit()
-            except psycopg2.DataError as e:
-                self.connection.rollback()
-                self.failed_items.extend(self.pending_items)
+                self.postgre_upsert(cur, item, table_name)
+                cur.connection.commit()
+            except (psycopg2.DataError, psycopg2.IntegrityError) as e:
                 print("ERROR: During save to postgre:", e.pgerror)
-            except Exception as e:
-               self.connection.rollback()
-               self.failed_items.extend(self.pending_items)
-               print("ERROR: Unexpected error during save to postgre:", e)
-            finally:
-                self.pending_items.clear()
+                cur.connection.rollback()
+                self.add_failed_items([item])
+                saved = False
+        return saved
 
-
-        return item
+    # converts a value to text format of COPY
+    @staticmethod
+    def _copy_value(value):
+        if value is None:
+            return '\\N'
+        return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
 
     def create_table(self, table_name):
         """Creates a table to hold the data if it does not exist."""
@@ -132,7 +618,119 @@ class PostgrePipeline(object):
             self.cur.execute(create_query)
             self.connection.commit()
 
-    def postgre_upsert(self, item, table_name):
+    def migrate(self, table_name):
+        """Applies the schema migrations which are not applied to the table yet."""
+        table_name = table_name.lower()
+
+        # spiders started at the same time wait here for each other
+        self.cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", ('{0}.{1}'.format(self.schema, table_name),))
+        self.cur.execute('CREATE TABLE IF NOT EXISTS {0}.{1}_migrations('
+                         'version INTEGER PRIMARY KEY,'
+                         'description TEXT,'
+                         'applied_at TIMESTAMP DEFAULT now()'
+                         ');'.format(self.schema, table_name))
+        self.cur.execute('select version from {0}.{1}_migrations;'.format(self.schema, table_name))
+        applied_versions = set(row[0] for row in self.cur.fetchall())
+
+        for version, description, query in self.migrations:
+            if version in applied_versions:
+                continue
+
+            description = description.format(self.schema, table_name)
+            print("Applying migration {0}: {1}".format(version, description))
+            self.cur.execute(query.format(self.schema, table_name))
+            if self.cur.rowcount >= 0:
+                # rows changed by the last statement of the migration
+                print("Migration {0}: {1} row(s)".format(version, self.cur.rowcount))
+            self.cur.execute('INSERT INTO {0}.{1}_migrations (version, description) '
+                             'VALUES (%(version)s, %(description)s);'.format(self.schema, table_name),
+                             {'version': version, 'description': description})
+
+        self.connection.commit()
+
+    def create_normalized_tables(self, table_name):
+        """Creates the lookup tables, the facts table and the view of the normalized schema.
+
+        An existing data table is migrated, its rows are copied to the
+        normalized tables and it is renamed to '<table>_denormalized', so the
+        view can take its name.
+        """
+        table_name = table_name.lower()
+        self.cur.execute("SELECT table_type FROM information_schema.tables WHERE table_schema=%s and table_name=%s",
+                         (self.schema, table_name))
+        row = self.cur.fetchone()
+        if row is not None and row[0] == 'BASE TABLE':
+            self.migrate(table_name)
+
+        # spiders started at the same time wait here for each other
+        self.cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", ('{0}.{1}'.format(self.schema, table_name),))
+
+        for dimension in self.dimensions:
+            self.cur.execute('CREATE TABLE IF NOT EXISTS {0}.{1}_{2}('
+                             'id SERIAL PRIMARY KEY,'
+                             'value TEXT NOT NULL UNIQUE'
+                             ');'.format(self.schema, table_name, dimension))
+
+        self.cur.execute('CREATE TABLE IF NOT EXISTS {0}.{1}_facts('
+                         'id BIGSERIAL PRIMARY KEY,'
+                         'type VARCHAR(64),'
+                         'company_id INTEGER REFERENCES {0}.{1}_company (id),'
+                         'facility_id INTEGER REFERENCES {0}.{1}_facility (id),'
+                         'unit_id INTEGER REFERENCES {0}.{1}_unit (id),'
+                         'fuel_id INTEGER REFERENCES {0}.{1}_fuel (id),'
+                         'control_area_id INTEGER REFERENCES {0}.{1}_control_area (id),'
+                         'begin_ts TIMESTAMP,'
+                         'end_ts TIMESTAMP,'
+                         'limitation DOUBLE PRECISION,'
+                         'reason_id INTEGER REFERENCES {0}.{1}_reason (id),'
+                         'status VARCHAR(16),'
+                         'event_id VARCHAR(128),'
+                         'last_update TIMESTAMP,'
+                         'version_no INTEGER DEFAULT 1 '
+                         ');'.format(self.schema, table_name))
+        self.cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS {1}_facts_event_key_idx '
+                         'ON {0}.{1}_facts (event_id, begin_ts, end_ts, last_update);'.format(self.schema, table_name))
+        self.cur.execute('CREATE INDEX IF NOT EXISTS {1}_facts_event_id_last_update_idx '
+                         'ON {0}.{1}_facts (event_id, last_update);'.format(self.schema, table_name))
+
+        # the table is locked above, so it is still a table here if it is not converted by another spider
+        self.cur.execute("SELECT table_type FROM information_schema.tables WHERE table_schema=%s and table_name=%s",
+                         (self.schema, table_name))
+        row = self.cur.fetchone()
+        if row is not None and row[0] == 'BASE TABLE':
+            print("Converting {0}.{1} to the normalized schema...".format(self.schema, table_name))
+            for dimension in self.dimensions:
+                self.cur.execute('INSERT INTO {0}.{1}_{2} (value) '
+                                 'SELECT DISTINCT {2} FROM {0}.{1} WHERE {2} IS NOT NULL '
+                                 'ON CONFLICT (value) DO NOTHING;'.format(self.schema, table_name, dimension))
+            self.cur.execute('INSERT INTO {0}.{1}_facts (id,{2},version_no) '
+                             'SELECT t.id,{3},t.version_no FROM {0}.{1} t {4};'.format(
+                                 self.schema, table_name, ','.join(self.data_columns),
+                                 ','.join('{0}_d.id'.format(column) if column in self.dimensions
+                                          else 't.' + column for column in self.columns),
+                                 self._join_clause(table_name, 'value', 't', '')))
+            self.cur.execute("SELECT setval(pg_get_serial_sequence('{0}.{1}_facts', 'id'), "
+                             "coalesce(max(id), 0) + 1, false) FROM {0}.{1}_facts;".format(self.schema, table_name))
+            self.cur.execute('ALTER TABLE {0}.{1} RENAME TO {1}_denormalized;'.format(self.schema, table_name))
+
+        # view with the name and the columns of the data table for readers
+        self.cur.execute('CREATE OR REPLACE VIEW {0}.{1} AS '
+                         'SELECT f.id,{2},f.version_no FROM {0}.{1}_facts f {3};'.format(
+                             self.schema, table_name,
+                             ','.join('{0}_d.value AS {0}'.format(column) if column in self.dimensions
+                                      else 'f.' + column for column in self.columns),
+                             self._join_clause(table_name, 'id', 'f', '_id')))
+        self.connection.commit()
+
+    # joins the lookup tables of the normalized schema on '<alias>.<dimension><suffix>' = '<lookup>.<key>'
+    def _join_clause(self, table_name, key, alias, suffix):
+        return ' '.join('LEFT JOIN {0}.{1}_{2} {2}_d ON {2}_d.{3} = {4}.{2}{5}'.format(
+            self.schema, table_name, dimension, key, alias, suffix) for dimension in self.dimensions)
+
+    def postgre_upsert(self, cur, item, table_name):
+        row = self.item_rows(cur, [item], table_name)[0]
+        table_name = self.data_table(table_name)
+
         # check if duplicated item exists
         item_exists_query = ("select id from {0}.{1} "
                                     "WHERE "
@@ -145,75 +743,182 @@ class PostgrePipeline(object):
                                     "and last_update = "
                                     "%(last_update)s "
                                     ).format(self.schema, table_name)
-        self.cur.execute(item_exists_query, {'event_id': item['event_id'], 'begin_ts': item['begin_ts'],
-                                             'end_ts': item['end_ts'], 'last_update': item['last_update']})
-        rows = self.cur.fetchall()
+        cur.execute(item_exists_query, {'event_id': item['event_id'], 'begin_ts': item['begin_ts'],
+                                        'end_ts': item['end_ts'], 'last_update': item['last_update']})
+        rows = cur.fetchall()
 
         if len(rows) > 0:
-            self.db_passed_item_count += 1
-            pass
+            with self._lock:
+                self.db_passed_item_count += 1
         else:
-            insert_query = ("INSERT INTO {0}.{1} ("
-                            "type,"
-                            "company,"
-                            "facility,"
-                            "unit,"
-                            "fuel,"
-                            "control_area,"
-                            "begin_ts,"
-                            "end_ts,"
-                            "limitation,"
-                            "reason,"
-                            "status,"
-                            "event_id,"
-                            "last_update"
-                            ") "
-                            "VALUES ("
-                            "%(type)s,"
-                            "%(company)s,"
-                            "%(facility)s,"
-                            "%(unit)s,"
-                            "%(fuel)s,"
-                            "%(control_area)s,"
-                            "%(begin_ts)s,"
-                            "%(end_ts)s,"
-                            "%(limitation)s,"
-                            "%(reason)s,"
-                            "%(status)s,"
-                            "%(event_id)s,"
-                            "%(last_update)s);"
-                            ).format(self.schema, table_name)
-
-            self.pending_items.append(item)
-            self.cur.execute(insert_query, item)
-
-            self.db_inserted_item_count += 1
+            insert_query = ("INSERT INTO {0}.{1} ({2}) VALUES ({3});"
+                            ).format(self.schema, table_name, ','.join(self.data_columns),
+                                     ','.join(['%s'] * len(self.data_columns)))
+
+            cur.execute(insert_query, row)
+
+            with self._lock:
+                self.db_inserted_item_count += 1
 
         # collect event_ids to update
-        if item["event_id"] not in self.event_ids:
-            self.event_ids.append(item['event_id'])
+        with self._lock:
+            self.event_ids.add(item['event_id'])
 
     # the function to update version number
-    def update_version_no(self, table_name, event_id):
-        events_query = ("select id from {0}.{1} "
-                        "where event_id="
-                        "%(event_id)s "
-                        "order by last_update;"
-                        ).format(self.schema, table_name)
-        self.cur.execute(events_query, {'event_id': event_id})
-        rows = self.cur.fetchall()
-
-        version_no = 1
-        for row in rows:
-            id = row[0]
-            update_version_no_query = ("UPDATE {0}.{1} SET "
-                                        "version_no = "
-                                        "%(version_no)s "
-                                        "WHERE "
-                                        "id = "
-                                        "%(id)s"
-                                        ).format(self.schema, table_name)
-            self.cur.execute(update_version_no_query, {'version_no': version_no, 'id': id})
-            version_no += 1
+    # version numbers of all given events are recomputed with a single query
+    def update_version_no(self, table_name, event_ids, cur=None, commit=True):
+        event_ids = list(event_ids)
+        if not event_ids:
+            return
 
-        self.connection.commit()
+        if cur is None:
+            cur = self.cur
+
+        update_version_no_query = ("UPDATE {0}.{1} t SET "
+                                   "version_no = v.version_no "
+                                   "FROM ("
+                                   "select id, row_number() over "
+                                   "(partition by event_id order by last_update, id) as version_no "
+                                   "from {0}.{1} "
+                                   "where event_id = any(%(event_ids)s)"
+                                   ") v "
+                                   "WHERE "
+                                   "t.id = v.id "
+                                   "and t.version_no is distinct from v.version_no"
+                                   ).format(self.schema, table_name)
+        cur.execute(update_version_no_query, {'event_ids': event_ids})
+
+        if commit:
+            cur.connection.commit()
+
+
+# save items to Parquet files
+class ParquetPipeline(object):
+    """This pipeline writes items to Parquet files partitioned by country, year and month.
+
+    Files are written to PARQUET_EXPORT_DIR as
+    country=<country>/year=<YYYY>/month=<MM>/part-<run>.parquet, the month is
+    the month of begin_ts. Items of a partition are buffered and written as a
+    row group when PARQUET_ROW_GROUP_SIZE items are collected. When more than
+    PARQUET_MAX_BUFFERED_ROWS items are buffered in all partitions, the
+    biggest buffer is written, so memory stays flat.
+
+    The pipeline is enabled with PARQUET_EXPORT setting or with the
+    'export=parquet' spider argument. It needs pyarrow.
+    """
+
+    def __init__(self, export_dir='parquet', row_group_size=50000, max_buffered_rows=200000, enabled=False):
+        self.export_dir = export_dir
+        self.row_group_size = row_group_size
+        self.max_buffered_rows = max_buffered_rows
+        self.enabled = enabled
+        self.run_name = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H-%M-%S")
+        # partition -> list of buffered items
+        self.buffers = {}
+        self.buffered_rows = 0
+        # partition -> ParquetWriter
+        self.writers = {}
+        self.exported_item_count = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(export_dir=crawler.settings.get('PARQUET_EXPORT_DIR', 'parquet'),
+                   row_group_size=crawler.settings.getint('PARQUET_ROW_GROUP_SIZE', 50000),
+                   max_buffered_rows=crawler.settings.getint('PARQUET_MAX_BUFFERED_ROWS', 200000),
+                   enabled=crawler.settings.getbool('PARQUET_EXPORT', False))
+
+    def open_spider(self, spider):
+        if getattr(spider, 'export', None) == 'parquet':
+            self.enabled = True
+        if not self.enabled:
+            return
+
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            print("ERROR: pyarrow is not installed, Parquet export is disabled.")
+            self.enabled = False
+            return
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.schema = pyarrow.schema([
+            pyarrow.field('type', pyarrow.string()),
+            pyarrow.field('company', pyarrow.string()),
+            pyarrow.field('facility', pyarrow.string()),
+            pyarrow.field('unit', pyarrow.string()),
+            pyarrow.field('fuel', pyarrow.string()),
+            pyarrow.field('control_area', pyarrow.string()),
+            pyarrow.field('begin_ts', pyarrow.timestamp('s')),
+            pyarrow.field('end_ts', pyarrow.timestamp('s')),
+            pyarrow.field('limitation', pyarrow.float64()),
+            pyarrow.field('reason', pyarrow.string()),
+            pyarrow.field('status', pyarrow.string()),
+            pyarrow.field('event_id', pyarrow.string()),
+            pyarrow.field('last_update', pyarrow.timestamp('s')),
+        ])
+
+    def close_spider(self, spider):
+        if not self.enabled:
+            return
+
+        for partition in list(self.buffers):
+            self.write_row_group(partition)
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+        print("Parquet export: {0} items written to {1}".format(self.exported_item_count, self.export_dir))
+
+    def process_item(self, item, spider):
+        if not self.enabled:
+            return item
+
+        begin_ts = self._to_datetime(item['begin_ts'])
+        partition = (item.get('country') or 'unknown', begin_ts.year if begin_ts else 0, begin_ts.month if begin_ts else 0)
+
+        self.buffers.setdefault(partition, []).append(item)
+        self.buffered_rows += 1
+
+        if len(self.buffers[partition]) >= self.row_group_size:
+            self.write_row_group(partition)
+        elif self.buffered_rows > self.max_buffered_rows:
+            self.write_row_group(max(self.buffers, key=lambda key: len(self.buffers[key])))
+
+        return item
+
+    # writes buffered items of a partition as a row group
+    def write_row_group(self, partition):
+        items = self.buffers.pop(partition, [])
+        if not items:
+            return
+        self.buffered_rows -= len(items)
+
+        columns = []
+        for field in self.schema:
+            if field.name in ('begin_ts', 'end_ts', 'last_update'):
+                values = [self._to_datetime(item[field.name]) for item in items]
+            else:
+                values = [item[field.name] for item in items]
+            columns.append(self.pa.array(values, type=field.type))
+        table = self.pa.Table.from_arrays(columns, names=[field.name for field in self.schema])
+
+        writer = self.writers.get(partition)
+        if writer is None:
+            country, year, month = partition
+            directory = os.path.join(self.export_dir, 'country={0}'.format(country),
+                                     'year={0:04d}'.format(year), 'month={0:02d}'.format(month))
+            os.makedirs(directory, exist_ok=True)
+            file_name = os.path.join(directory, 'part-{0}.parquet'.format(self.run_name))
+            writer = self.pq.ParquetWriter(file_name, self.schema, compression='snappy')
+            self.writers[partition] = writer
+
+        writer.write_table(table)
+        self.exported_item_count += len(items)
+
+    @staticmethod
+    def _to_datetime(value):
+        if value is None or isinstance(value, datetime.datetime):
+            return value
+        return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
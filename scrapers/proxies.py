@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+# Health scored pools of proxies and user agents.
+#
+# Every proxy has a moving average of its latency and error rate. Requests
+# and browser sessions get the better of two random healthy proxies, so
+# fast proxies get most of the work. A small share of requests goes to any
+# healthy proxy, so slow proxies are measured again now and then. A proxy which fails several times in a row or is banned (403,
+# 407, 429...) is put on cooldown, and every further cooldown is twice as
+# long. User agents are scored the same way by their ban signals.
+
+import random
+import threading
+import time
+
+
+class _Health(object):
+
+    def __init__(self):
+        # moving averages, None until the first measurement
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures_in_row = 0
+        self.cooldowns = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+
+
+class HealthPool(object):
+    """Picks the healthiest of a list of keys (proxy urls or user agents).
+
+    :param keys: List of keys.
+    :param cooldown: Seconds of the first cooldown of a key.
+    :param max_cooldown: Maximum seconds of a cooldown.
+    :param max_failures: Number of failures in a row which put a key on cooldown.
+    :param alpha: Weight of the last measurement in the moving averages.
+    :param explore: Share of choices which take any healthy key.
+    """
+
+    def __init__(self, keys, cooldown=60.0, max_cooldown=900.0, max_failures=3, alpha=0.3, explore=0.05):
+        self.keys = list(keys)
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_failures = max_failures
+        self.alpha = alpha
+        self.explore = explore
+        self.health = {key: _Health() for key in self.keys}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def __len__(self):
+        return len(self.keys)
+
+    # lower is better. Unmeasured keys are tried first
+    def _score(self, health):
+        if health.latency is None:
+            return 0.0
+        return health.latency * (1.0 + 4.0 * health.error_rate)
+
+    def choose(self):
+        """Returns the better of two random healthy keys, or None if the pool is empty."""
+        if not self.keys:
+            return None
+        now = time.time()
+        with self._lock:
+            healthy = [key for key in self.keys if self.health[key].cooldown_until <= now]
+            if not healthy:
+                # every key is on cooldown, the one which comes back first is used
+                return min(self.keys, key=lambda key: self.health[key].cooldown_until)
+            if len(healthy) == 1 or self._random.random() < self.explore:
+                return self._random.choice(healthy)
+            first, second = self._random.sample(healthy, 2)
+            return min(first, second, key=lambda key: self._score(self.health[key]))
+
+    def record_success(self, key, latency):
+        """Records a successful request of 'latency' seconds."""
+        with self._lock:
+            health = self.health.get(key)
+            if health is None:
+                return
+            health.requests += 1
+            health.latency = latency if health.latency is None \
+                else (1 - self.alpha) * health.latency + self.alpha * latency
+            health.error_rate *= (1 - self.alpha)
+            health.failures_in_row = 0
+            # a recovered key gets shorter cooldowns again
+            health.cooldowns = max(0, health.cooldowns - 1)
+
+    def record_failure(self, key, ban=False):
+        """Records a failed request. A ban puts the key on cooldown immediately.
+
+        :return: True if the key is put on cooldown.
+        """
+        with self._lock:
+            health = self.health.get(key)
+            if health is None:
+                return False
+            health.requests += 1
+            health.error_rate = (1 - self.alpha) * health.error_rate + self.alpha
+            health.failures_in_row += 1
+            if not ban and health.failures_in_row < self.max_failures:
+                return False
+
+            seconds = min(self.cooldown * 2 ** health.cooldowns, self.max_cooldown)
+            health.cooldowns += 1
+            health.failures_in_row = 0
+            health.cooldown_until = time.time() + seconds
+        print("{0} is on cooldown for {1:.0f} s{2}.".format(key, seconds, ' (banned)' if ban else ''))
+        return True
+
+    def is_healthy(self, key):
+        with self._lock:
+            health = self.health.get(key)
+            return health is None or health.cooldown_until <= time.time()
+
+    def stats(self):
+        """Returns the health of every key as a list of dictionaries."""
+        now = time.time()
+        with self._lock:
+            return [{'key': key,
+                     'latency': health.latency,
+                     'error_rate': round(health.error_rate, 3),
+                     'requests': health.requests,
+                     'cooldown': max(0.0, round(health.cooldown_until - now, 1))}
+                    for key, health in self.health.items()]
+
+
+def read_list(file_name):
+    """Reads a list file of proxies or user agents. Empty lines and '#' comments are skipped."""
+    if not file_name:
+        return []
+    with open(file_name) as list_file:
+        return [line.strip() for line in list_file if line.strip() and not line.strip().startswith('#')]
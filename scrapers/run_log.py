@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# Structured log of a spider run.
+#
+# Events of the run (start, failed data, close) are appended to a JSON Lines
+# file ('logs/<time>.log.jsonl') in buffered writes, so a failure costs one
+# short line instead of rewriting the whole log. Failures are written at once,
+# because backfill rebuilds crashed runs from them, and other events at least
+# every 'flush_interval' seconds. A failure of the same date window and
+# url is logged once. When the run is closed, the summary (the old
+# 'logs/<time>.log' JSON) is written atomically from the events.
+#
+# 'aggregate_runs' reads the logs of a directory for the 'runlogs' command.
+# Runs which crashed before writing a summary are rebuilt from their events.
+
+import glob
+import json
+import os
+import threading
+import time
+
+
+class RunLog(object):
+    """Append-only event log and summary of a run.
+
+    :param file_name: File of the summary. Events are written to file_name + '.jsonl'.
+    :param summary: Initial values of the summary, e.g. start_date and end_date.
+    :param buffer_size: Number of events kept in memory before they are written.
+    :param flush_interval: Maximum number of seconds an event is kept in memory. Failures are written at once.
+    """
+
+    def __init__(self, file_name, summary, buffer_size=100, flush_interval=5.0):
+        self.file_name = file_name
+        self.events_file_name = file_name + '.jsonl'
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.time()
+
+        self.summary = dict(summary)
+        self.summary.setdefault('item_scraped_count', 0)
+        self.summary.setdefault('failed_data', {})
+        # (failed date key, url) pairs which are logged already
+        self._failures = set()
+
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.event('start', **summary)
+        self.flush()
+
+        # buffered events are written in background even when no further event comes
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name='run-log-flush')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def event(self, kind, flush=False, **fields):
+        """Appends an event to the log. With 'flush', the event is written at once."""
+        fields['event'] = kind
+        fields['time'] = round(time.time(), 3)
+        with self._lock:
+            self._buffer.append(json.dumps(fields, sort_keys=True))
+            if not flush and len(self._buffer) < self.buffer_size \
+                    and time.time() - self._last_flush < self.flush_interval:
+                return
+        self.flush()
+
+    def failed(self, failed_date_str, url):
+        """Logs failed data of a date window and url once."""
+        with self._lock:
+            if (failed_date_str, url) in self._failures:
+                return
+            self._failures.add((failed_date_str, url))
+            self.summary['failed_data'].setdefault(failed_date_str, []).append(url)
+        self.event('failed', flush=True, key=failed_date_str, url=url)
+
+    def update(self, **values):
+        """Sets values of the summary."""
+        with self._lock:
+            self.summary.update(values)
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            self._last_flush = time.time()
+            if not lines:
+                return
+            with open(self.events_file_name, mode='a') as events_file:
+                events_file.write('\n'.join(lines) + '\n')
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self, reason=None):
+        """Logs the end of the run and writes the summary."""
+        self._closed.set()
+        self._flusher.join()
+        with self._lock:
+            summary = dict(self.summary)
+        self.event('close', reason=reason, **{key: value for key, value in summary.items() if key != 'failed_data'})
+        self.flush()
+
+        # write to a temporary file first, so a crash never leaves a broken summary
+        tmp_file_name = self.file_name + '.tmp'
+        with open(tmp_file_name, mode='w') as log_file:
+            json.dump(summary, log_file, indent=4)
+        os.replace(tmp_file_name, self.file_name)
+
+
+# rebuilds the summary of a run from its events
+def _read_events(events_file_name):
+    summary = {'item_scraped_count': 0, 'failed_data': {}, 'crashed': True}
+    with open(events_file_name) as events_file:
+        for line in events_file:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # last line of a crashed run can be cut
+                continue
+            kind = event.pop('event', None)
+            event.pop('time', None)
+            if kind == 'failed':
+                urls = summary['failed_data'].setdefault(event['key'], [])
+                if event['url'] not in urls:
+                    urls.append(event['url'])
+            elif kind == 'start':
+                summary.update(event)
+            elif kind == 'close':
+                summary.update(event)
+                summary['crashed'] = False
+    return summary
+
+
+def read_run(file_name):
+    """Returns the summary of a run from its summary or, if it has none, from its events."""
+    if file_name.endswith('.jsonl'):
+        summary_file_name, events_file_name = file_name[:-len('.jsonl')], file_name
+    else:
+        summary_file_name, events_file_name = file_name, file_name + '.jsonl'
+
+    if os.path.exists(summary_file_name):
+        try:
+            with open(summary_file_name) as summary_file:
+                return json.load(summary_file)
+        except ValueError:
+            # summary of the old format, broken by a crash during rewrite
+            pass
+    if os.path.exists(events_file_name):
+        return _read_events(events_file_name)
+    return None
+
+
+def aggregate_runs(directory='logs', since=None):
+    """Aggregates the runs of a log directory.
+
+    :param directory: Directory of run logs (searched recursively).
+    :param since: Only runs with a start date from this 'YYYY-MM-DD' date.
+    :return: Dictionary of totals and failures by date window and url.
+    """
+    file_names = set()
+    for pattern in ('*.log', '*.log.jsonl'):
+        for file_name in glob.glob(os.path.join(directory, '**', pattern), recursive=True):
+            file_names.add(file_name[:-len('.jsonl')] if file_name.endswith('.jsonl') else file_name)
+
+    totals = {
+        'runs': 0,
+        'crashed_runs': 0,
+        'item_scraped_count': 0,
+        'db_inserted_item_count': 0,
+        'db_passed_item_count': 0,
+        'failed_data': {}
+    }
+    for file_name in sorted(file_names):
+        run = read_run(file_name)
+        if run is None:
+            continue
+        if since is not None and _normalize_date(run.get('start_date')) < since:
+            continue
+
+        totals['runs'] += 1
+        totals['crashed_runs'] += 1 if run.get('crashed') else 0
+        for key in ('item_scraped_count', 'db_inserted_item_count', 'db_passed_item_count'):
+            totals[key] += run.get(key) or 0
+        for failed_date_str, urls in run.get('failed_data', {}).items():
+            failures = totals['failed_data'].setdefault(failed_date_str, {})
+            # old logs can have the same url many times
+            for url in set(urls):
+                failures[url] = failures.get(url, 0) + 1
+    return totals
+
+
+# returns 'YYYY-MM-DD' of dates like '2017-8-24' of old logs
+def _normalize_date(value):
+    if not value:
+        return ''
+    try:
+        return '-'.join('{0:02d}'.format(int(part)) for part in value.split('-')[:3])
+    except ValueError:
+        return value
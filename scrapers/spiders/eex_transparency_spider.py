@@ -1,18 +1,29 @@
 import scrapy
 import datetime
 import time
-import pytz
 import json
+import os
+import threading
 
 from selenium.common import exceptions as selenium_exceptions
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
 
 import calendar
 
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.spidermiddlewares.httperror import HttpError
+from twisted.internet import defer, reactor
+
+from urllib.parse import urlencode, urlparse
+
+from scrapers.browser import BrowserPool, BrowserSession
+from scrapers.checkpoint import Checkpoint, PageMark
+from scrapers.metrics import Metrics
+from scrapers.parser import parse_records
+from scrapers.payload_store import PayloadStore
+from scrapers.run_log import RunLog
+from scrapers.state import SpiderState
+
 class EexTransparencySpider(scrapy.Spider):
     name = 'eex_transparency'
 
@@ -53,19 +64,37 @@ class EexTransparencySpider(scrapy.Spider):
                         'https://www.eex-transparency.com/homepage/power/the-netherlands/production/availability/non-usability'
                         ]
 
+    # browser mode issues a single scrapy request and runs the browsers in BrowserPool,
+    # api mode uses scrapy's normal concurrency (CONCURRENT_REQUESTS)
     custom_settings = {
-        'CONCURRENT_REQUESTS': 1, # Because of the browser automation
         'ITEM_PIPELINES': {
-            'scrapers.pipelines.PostgrePipeline': 500
+            'scrapers.pipelines.PostgrePipeline': 500,
+            'scrapers.pipelines.ParquetPipeline': 600
         }
     }
     
+    # scheme and host of the site. Urls of the lists above are moved to EEX_BASE_URL setting
+    base_url = 'https://www.eex-transparency.com'
+
     # constuctor function of Spider class
-    def __init__(self, mode='recent', period=None, country=None):
+    def __init__(self, mode='recent', period=None, country=None, workers=None, fetch_mode='browser',
+                 resume=None, start=None, end=None, shard=None, incremental=None, source='live',
+                 export=None, log_file=None):
         super().__init__()
-        
+
+        # number of days of every history job. None means the whole date window
+        self.shard_days = int(shard) if shard else None
+
         if mode == 'history':
-            if period == None:
+            if start is not None and end is not None:
+                # date window given as 'YYYY-MM-DD' strings
+                # this is datetime value
+                self.start      = datetime.datetime.strptime(start, '%Y-%m-%d')
+                # this is datetime value
+                self.end        = datetime.datetime.strptime(end, '%Y-%m-%d')
+                if self.end < self.start:
+                    print('Parameter error')
+            elif period == None:
                 print('Parameter error')
             else:
                 self.period = period
@@ -98,6 +127,9 @@ class EexTransparencySpider(scrapy.Spider):
                 
         # current time. This is string value
         now_date = datetime.datetime.utcnow().strftime("%Y-%m-%d")
+        if mode == 'recent' and source == 'replay' and start is not None:
+            # the day of stored recent data to replay
+            now_date = start
         # current time. This is date time value
         self.now_date   = datetime.datetime.strptime(now_date, '%Y-%m-%d')
 
@@ -107,161 +139,553 @@ class EexTransparencySpider(scrapy.Spider):
         
         # 'history' or 'recent'    
         self.mode = mode
+
+        # 'browser' renders every page with selenium,
+        # 'api' requests the JSON data of the pages directly with scrapy
+        self.fetch_mode = fetch_mode
         
         # instance of ScrapeJS object
         self.scraper = ScrapeJS()
 
-        # Selenium webdriver
-        self.driver = webdriver.PhantomJS('./phantomjs/linux/phantomjs')
-        # self.driver = webdriver.Chrome('./chromedriver')
+        # number of browsers scraping at the same time
+        # if None, BROWSER_POOL_SIZE setting is used
+        self.workers = workers
+
+        # pool of browser sessions. It is created in 'submit_browser_jobs'
+        self.browser_pool = None
+        # the response items of browsers are scraped for, and the pending call draining the pool
+        self._pool_response = None
+        self._drain_call = None
+
+        # lock protecting counters and log info shared between browser workers
+        self._lock = threading.Lock()
+
+        # progress of history jobs. With 'resume' argument, the interrupted run is continued
+        if mode == 'history' and start is not None and end is not None:
+            checkpoint_name = '_'.join([mode, start, end])
+        else:
+            checkpoint_name = '_'.join([mode, getattr(self, 'period', now_date)])
+        if country:
+            checkpoint_name += '_' + country
+        if self.shard_days:
+            checkpoint_name += '_' + str(self.shard_days) + 'd'
+        self.checkpoint = Checkpoint('checkpoints/' + checkpoint_name + '.json',
+                                     resume=resume in ('1', 'true', 'yes', True))
+        # callables of pipelines returning a Deferred which fires with True when the items handed
+        # to the pipeline so far are saved. The checkpoint of a page is saved after its items
+        self.item_save_waiters = []
+
+        # in 'recent' mode, records not newer than the last run's high-water mark are dropped.
+        # if None, RECENT_INCREMENTAL setting is used
+        self.incremental = None if incremental is None else incremental in ('1', 'true', 'yes', True)
+
+        # state kept between runs. It is loaded in 'from_crawler'
+        self.state = None
+
+        # the newest modify_timestamp of every country page in this run.
+        # high-water marks are moved forward when the run is finished
+        self.high_water_marks = {}
+
+        # countries of items which pipelines failed to save. It is filled by PostgrePipeline when it is closed.
+        # high-water marks of these countries are not moved, so their records are scraped again in the next run
+        self.unsaved_countries = set()
+
+        # 'live' scrapes the site, 'replay' parses the payloads saved in payload store
+        self.source = source
+
+        # 'parquet' enables ParquetPipeline in addition to PARQUET_EXPORT setting
+        self.export = export
+
+        # store of raw page payloads. It is created in 'from_crawler'
+        # when PAYLOAD_CAPTURE setting is enabled or in 'replay' source
+        self.payload_store = None
+
+        # timing and throughput instrumentation. It is replaced in 'from_crawler'
+        # with the one configured by METRICS_* settings
+        self.metrics = Metrics(enabled=False)
+
+        # setting log file. 'log_file' argument is used by the backfill command to find the log of a job
+        self.log_file_name = log_file or 'logs/' + datetime.datetime.utcnow().strftime("%Y-%m-%dT%H-%M-%S") + '.log'
 
-        # setting log file
-        self.log_file_name = 'logs/' + datetime.datetime.utcnow().strftime("%Y-%m-%dT%H-%M-%S") + '.log'
-        
         # all count of scrated items. This value is saved to log file
         self.item_scraped_count = 0
-        
-        # initialize log info
-        with open(self.log_file_name, mode='w+') as log_file:
-            if mode == 'history':
-                self.scrape_info = {
-                    'start_date': start,
-                    'end_date': end,
-                    'item_scraped_count': 0,
-                    'failed_data': {}
-                }
-            elif mode == 'recent':
-                self.scrape_info = {
-                    'start_date': now_date,
-                    'end_date': now_date,
-                    'item_scraped_count': 0,
-                    'failed_data': {}
-                }
-            json.dump(self.scrape_info, log_file, indent=4)
+
+        # initialize log info. Events are appended to '<log file>.jsonl',
+        # the summary is written to the log file when the spider is closed
+        if mode == 'history':
+            self.run_log = RunLog(self.log_file_name, {'start_date': start, 'end_date': end})
+        else:
+            self.run_log = RunLog(self.log_file_name, {'start_date': now_date, 'end_date': now_date})
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.state = SpiderState(crawler.settings.get('SPIDER_STATE_FILE', 'state/spider_state.json'))
+        if spider.incremental is None:
+            spider.incremental = crawler.settings.getbool('RECENT_INCREMENTAL', True)
+        if spider.source == 'replay':
+            # replayed data is always parsed again
+            spider.incremental = False
+        spider.metrics = Metrics(enabled=crawler.settings.getbool('METRICS_ENABLED', False),
+                                 snapshot_file=crawler.settings.get('METRICS_SNAPSHOT_FILE'),
+                                 snapshot_interval=crawler.settings.getfloat('METRICS_SNAPSHOT_INTERVAL', 30.0))
+        spider.metrics.start()
+        base_url = crawler.settings.get('EEX_BASE_URL', spider.base_url).rstrip('/')
+        if base_url != spider.base_url:
+            # e.g. the local stand-in site of benchmarks
+            spider.history_url_list = [spider.rebase_url(url, base_url) for url in spider.history_url_list]
+            spider.recent_url_list = [spider.rebase_url(url, base_url) for url in spider.recent_url_list]
+            spider.base_url = base_url
+        if spider.source == 'replay' or crawler.settings.getbool('PAYLOAD_CAPTURE', False):
+            spider.payload_store = PayloadStore(crawler.settings.get('PAYLOAD_STORE_DIR', 'payloads'),
+                                                crawler.settings.getint('PAYLOAD_STORE_MAX_BYTES', 0))
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    # the spider has no requests while browsers work, it is kept open until their jobs are finished
+    def spider_idle(self, spider):
+        if self.browser_pool is not None:
+            raise DontCloseSpider
+
+    # this function is called when spider is closed
+    # high-water marks are saved only when the run is finished, so an interrupted run is scraped again.
+    # pipelines are closed before, so the countries of items which are not saved are known here
+    def closed(self, reason):
+        # browsers of an interrupted run
+        self._close_browser_pool()
+
+        self.run_log.update(item_scraped_count=self.item_scraped_count)
+        self.run_log.close(reason)
+
+        self.metrics.stop()
+        for key, value in self.metrics.stats().items():
+            self.crawler.stats.set_value(key, value)
+
+        if self.payload_store is not None:
+            self.payload_store.close()
+
+        if self.state is None:
+            return
+
+        if reason == 'finished':
+            for url, modify_timestamp in self.high_water_marks.items():
+                # items without a country can be of any country page
+                if None in self.unsaved_countries or self.get_country(url) in self.unsaved_countries:
+                    print("Items of {0} are not saved, its high-water mark is not moved.".format(url))
+                    continue
+                self.state.set_max('high_water_marks', url, modify_timestamp)
+        self.state.save()
 
     # redefined function of scrapy.Spider
     # This function is called at first after calling of __init__ constructor function
     # check whether spider is connected target website successfully
     def start_requests(self):
-        yield scrapy.Request('https://www.eex-transparency.com/', callback=self.start_requests_selenium)
+        if self.source == 'replay':
+            # nothing is downloaded from the site, the local index of payload store is requested instead
+            index_url = 'file://' + os.path.abspath(self.payload_store.index_file_name)
+            yield scrapy.Request(index_url, callback=self.parse_replay, meta={'dont_obey_robotstxt': True})
+            return
+
+        yield scrapy.Request(self.base_url + '/', callback=self.start_requests_selenium)
+
+    # this function is called in 'replay' source
+    # parses the stored payloads of every job and yields the items to pipelines
+    def parse_replay(self, response):
+        print('Start replaying stored payloads...')
+
+        for url, start, end in self.get_jobs():
+            page_keys = self.payload_store.page_keys(url, start, end)
+            print("Replay for country: ", url, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'),
+                  len(page_keys), "page(s)")
+
+            for page_key in page_keys:
+                data_object = self.payload_store.get(page_key)
+                if data_object:
+                    for item in self.parse_data_object(data_object, url):
+                        yield item
+
+    # calls a ScrapeJS helper returning the records of the current page
+    def get_page_data(self, driver, function, url, start, end, page):
+        with self.metrics.timer('get_data', self.get_country(url)):
+            data_object = self.scraper.call(driver, function)
+        self._page_fetched(driver, url, start, end, page, data_object)
+        return data_object
+
+    # counts a scraped page. The payload is saved to payload store when capture is enabled
+    def _page_fetched(self, driver, url, start, end, page, data_object):
+        self.metrics.count('pages', self.get_country(url))
+        driver.count_page()
+        if self.payload_store is not None and data_object is not None:
+            self.payload_store.put(url, start, end, page, data_object)
 
     # this function is called when spider is connected to target website.
+    # every country url is a job which is handed to a free browser of the pool.
+    # items are sent to pipelines as soon as any browser produces them
     def start_requests_selenium(self, response):
         print("Connection OK. Start scraping...")
 
+        if self.fetch_mode == 'api':
+            for request in self.start_requests_api():
+                yield request
+            return
+        elif self.fetch_mode != 'browser':
+            print('Parameter Error.')
+            yield
+            return
+
         if self.mode == 'recent':
             print('Start scraping with recent mode...')
-            for url in self.recent_url_list:
-                print("Recent for country: ", url)
-                items = self.parse_recent(url)
-                if items is None:
-                    yield
-                else:
-                    for item in items:
-                        yield item
+            job_func = self._scrape_recent_job
 
         elif self.mode == 'history':
             print('Start scraping with history mode...')
-
-            for url in self.history_url_list:
-                print("History for country: ", url)
-                items = self.parse_history(url)
-                if items is None:
-                    yield
-                else:
-                    for item in items:
-                        yield item
+            job_func = self._scrape_history_job
 
         else:
             print('Parameter Error.')
             yield
-    
-    # this function is called in 'history' mode
-    # fetches data from given url, parse items and yield them to pipelines
-    def parse_history(self, url):
-        self.driver.get(url)
-        
-        # check whether first page is loaded
-        first_page_loaded = self._load_page(self.start, self.end, url)
-        
-        # if first page is loaded successfully
-        if first_page_loaded:
-            pass
-        else:
-            print("Unable to load page. Skipping.")
-            yield
-        
-        print("[*] Parsing page")
+            return
 
-        # get first page data
-        data_object = self.driver.execute_script(self.scraper.get_history_table_data())
-        # parse items of first page
-        items = self.parse_data_object(data_object)
-        if items is None:
-            print('Items not found in that url: ', url)
-            yield
-        else:
+        self.submit_browser_jobs(self.get_jobs(), job_func, response)
+
+    # hands jobs to the browser pool. The pool is created for the first jobs
+    # and closed when all of its jobs are finished.
+    # the items of the jobs are sent to pipelines as the items of 'response'
+    def submit_browser_jobs(self, jobs, job_func, response):
+        if self.browser_pool is None:
+            workers = self.workers if self.workers is not None else self.settings.getint('BROWSER_POOL_SIZE', 1)
+            self.browser_pool = BrowserPool(workers, self._create_session,
+                                            queue_size=self.settings.getint('BROWSER_POOL_QUEUE_SIZE', 1000))
+            print('Scraping with {0} browser(s)...'.format(self.browser_pool.size))
+
+        self._pool_response = response
+        if self.browser_pool.submit(jobs, job_func) and self._drain_call is None:
+            self._drain_call = reactor.callLater(0, self._drain_browser_pool)
+
+    # sends the items produced by the browsers to pipelines. This runs in the reactor thread and never
+    # waits for the browsers: when no item is ready, it is called again after BROWSER_POLL_INTERVAL seconds.
+    # the next items are taken when the pipelines have processed the previous ones,
+    # so the browsers are paused by the bounded queue of the pool while the pipelines are slow.
+    # page marks are not sent to pipelines, they are saved to checkpoint when the items before them are saved
+    def _drain_browser_pool(self):
+        self._drain_call = None
+        if self.browser_pool is None:
+            return
+
+        items = self.browser_pool.poll(self.settings.getint('CONCURRENT_ITEMS', 100))
+        if items:
+            scraper = self.crawler.engine.scraper
+            processed = []
             for item in items:
-                yield item
-            
-            # check where next page exists
-            check_next_page = self.driver.execute_script(self.scraper.check_next_page())
-            if check_next_page:
-                
-                # if first page exists then repeat to fetch next page data with 'parse_history_details' function
-                self.driver.execute_script(self.scraper.load_next_page())
-                items = self.parse_history_details(url)
-                
-                if items is None:
-                    print('Items not found in that url: ', url)
-                    # log file
-                    yield
+                if isinstance(item, PageMark):
+                    d = defer.DeferredList(list(processed))
+                    d.addCallback(lambda _, mark=item: self.save_page_mark(mark))
                 else:
-                    for item in items:
-                        yield item
-    
-    # this function is recursive function 
-    # this function is fetching data until next page not exists
-    # this function is similar with 'page_history'
-    def parse_history_details(self, url):
-        page_loaded = self._load_page_history(url)
-        
-        if page_loaded:
-            pass
+                    processed.append(defer.maybeDeferred(scraper._process_spidermw_output, item,
+                                                         self._pool_response.request, self._pool_response, self))
+            d = defer.DeferredList(processed)
+            d.addBoth(lambda _: self._schedule_drain(0))
+        elif self.browser_pool.pending:
+            self._schedule_drain(self.settings.getfloat('BROWSER_POLL_INTERVAL', 0.1))
         else:
-            print("Unable to load page. Skipping.")
-            yield
-        
-        data_object = self.driver.execute_script(self.scraper.get_history_table_data())
-        items = self.parse_data_object(data_object)
-        if items is None:
-            # print('Items not found in that url: ', url)
-            yield
+            self._close_browser_pool()
+
+    # saves the page mark to checkpoint when the pipelines have saved the items yielded before it.
+    # if any of them is not saved, the checkpoint is not moved, so a resumed run scrapes the page again
+    def save_page_mark(self, mark):
+        d = defer.DeferredList([waiter() for waiter in self.item_save_waiters])
+        d.addCallback(self._page_mark_saved, mark)
+        return d
+
+    def _page_mark_saved(self, results, mark):
+        if all(success and saved for success, saved in results):
+            self.checkpoint.save(mark.key, mark.page, mark.last_event_id, done=mark.done, page_size=mark.page_size)
         else:
+            print("Items are not saved, checkpoint is not moved past page {0}: {1}".format(mark.page, mark.key))
+
+    def _schedule_drain(self, delay):
+        if self.browser_pool is not None and self._drain_call is None:
+            self._drain_call = reactor.callLater(delay, self._drain_browser_pool)
+
+    def _close_browser_pool(self):
+        if self._drain_call is not None and self._drain_call.active():
+            self._drain_call.cancel()
+        self._drain_call = None
+        if self.browser_pool is not None:
+            self.browser_pool.close()
+            self.browser_pool = None
+
+    # creates a new browser session (BROWSER setting). This is called once for every browser of the pool
+    def _create_session(self):
+        # pools of the proxy middleware, so browsers use the same proxies as requests
+        return BrowserSession.from_settings(self.settings,
+                                            proxy_pool=getattr(self, 'proxy_pool', None),
+                                            user_agent_pool=getattr(self, 'user_agent_pool', None))
+
+    # returns the jobs of the run as (url, start, end) tuples
+    # in 'history' mode the date window is split into shards of 'shard_days' days
+    # (HISTORY_SHARD_DAYS setting if 'shard' argument is not given),
+    # every (country, shard) pair is an independent job
+    def get_jobs(self):
+        if self.mode == 'recent':
+            return [(url, self.now_date, self.now_date) for url in self.recent_url_list]
+
+        shard_days = self.shard_days
+        if shard_days is None:
+            shard_days = self.settings.getint('HISTORY_SHARD_DAYS', 0)
+
+        shards = []
+        shard_start = self.start
+        while shard_start <= self.end:
+            if shard_days > 0:
+                shard_end = min(shard_start + datetime.timedelta(days=shard_days - 1), self.end)
+            else:
+                shard_end = self.end
+            shards.append((shard_start, shard_end))
+            shard_start = shard_end + datetime.timedelta(days=1)
+
+        return [(url, shard_start, shard_end) for url in self.history_url_list for shard_start, shard_end in shards]
+
+    # the job of a browser worker in 'recent' mode
+    def _scrape_recent_job(self, driver, job):
+        url, start, end = job
+        print("Recent for country: ", url)
+        items = self.parse_recent(driver, url)
+        if items is not None:
             for item in items:
                 yield item
-            
-            check_next_page = self.driver.execute_script(self.scraper.check_next_page())
-            
-            if check_next_page:
-                self.driver.execute_script(self.scraper.load_next_page())
-                items = self.parse_history_details(url)
-                
-                if items is None:
-                    print('Items not found in that url: ', url)
-                    # log file
-                    yield
+
+    # the job of a browser worker in 'history' mode
+    def _scrape_history_job(self, driver, job):
+        url, start, end = job
+        print("History for country: ", url, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+        items = self.parse_history(driver, url, start, end)
+        if items is not None:
+            for item in items:
+                yield item
+
+    # this function is called in 'api' fetch mode instead of the browser pool
+    # yields one request for the JSON data of every country page
+    def start_requests_api(self):
+        if self.mode == 'recent':
+            print('Start scraping with recent mode (api)...')
+
+        elif self.mode == 'history':
+            print('Start scraping with history mode (api)...')
+
+        else:
+            print('Parameter Error.')
+            return
+
+        for url, start, end in self.get_jobs():
+            print("Api for country: ", url, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+            yield self._api_request(url, start, end, 0)
+
+    # builds the request for one page of JSON data behind a country page
+    # the parameters are the same as the ones 'setDates' sets in the browser
+    def _api_request(self, url, start, end, offset):
+        page_size = self.settings.getint('EEX_API_PAGE_SIZE', 1000)
+        params = {
+            'from': start.strftime('%Y-%m-%d'),
+            'to': end.strftime('%Y-%m-%d'),
+            'canceled': 'all',
+            'offset': offset,
+            'limit': page_size,
+        }
+        api_url = self.get_api_url(url) + '?' + urlencode(params)
+        return scrapy.Request(api_url, callback=self.parse_api, errback=self.parse_api_error,
+                              headers={'Accept': 'application/json'},
+                              meta={'page_url': url, 'start': start, 'end': end,
+                                    'offset': offset, 'page_size': page_size})
+
+    # returns the url of JSON endpoint behind a country page
+    # EEX_API_URL may use {path} (path of the page url) and {country}.
+    # the endpoint is not documented by the site: the default layout is the one of the local stand-in
+    # (benchmarks/mock_eex.py), whose page loads its rows from '/api/<page path>'. For the live site,
+    # EEX_API_URL is set to the XHR url the country page requests (network tab of the browser)
+    def get_api_url(self, url):
+        path = urlparse(url).path.strip('/')
+        template = self.settings.get('EEX_API_URL', 'https://www.eex-transparency.com/api/{path}')
+        return template.format(path=path, country=self.get_country(url))
+
+    # returns the url with the scheme and host of 'base_url'
+    @staticmethod
+    def rebase_url(url, base_url):
+        parsed_url = urlparse(url)
+        return base_url + parsed_url.path + ('?' + parsed_url.query if parsed_url.query else '')
+
+    # returns the country of a country page url, e.g. 'germany'
+    @staticmethod
+    def get_country(url):
+        return urlparse(url).path.strip('/').split('/')[2]
+
+    # parses one page of JSON data and requests the next page while pages are full
+    def parse_api(self, response):
+        meta = response.meta
+        try:
+            data_object = json.loads(response.text)
+        except ValueError:
+            print("ERROR: Invalid JSON data: ", response.url)
+            self._fail_over_api(meta, 'invalid JSON', response)
+            return
+
+        # the endpoint may return the records directly or wrapped in an object
+        if isinstance(data_object, dict):
+            data_object = data_object.get('eventData', data_object.get('data'))
+
+        if not data_object:
+            print('Items not found in that url: ', meta['page_url'])
+            return
+
+        self.metrics.count('pages', self.get_country(meta['page_url']))
+        if self.payload_store is not None:
+            self.payload_store.put(meta['page_url'], meta['start'], meta['end'],
+                                   meta['offset'] // meta['page_size'], data_object)
+
+        if len(data_object) >= meta['page_size']:
+            yield self._api_request(meta['page_url'], meta['start'], meta['end'],
+                                    meta['offset'] + len(data_object))
+
+        if self.mode == 'recent':
+            data_object = self.filter_new_records(meta['page_url'], data_object)
+
+        for item in self.parse_data_object(data_object, meta['page_url']):
+            yield item
+
+    # this function is called when a JSON data request fails
+    def parse_api_error(self, failure):
+        print("ERROR: Api request failed: ", failure.request.url, failure.value)
+        if failure.check(HttpError) and failure.value.response.status == 404:
+            self._fail_over_api(failure.request.meta, 'HTTP 404', failure.value.response)
+        else:
+            self._log_failed_api(failure.request.meta)
+
+    # this function is called when the endpoint does not serve the data of a page (no JSON or 404),
+    # e.g. EEX_API_URL does not match the site. Instead of recording empty results, the whole job
+    # is scraped again with a browser (EEX_API_BROWSER_FAILOVER setting)
+    def _fail_over_api(self, meta, reason, response):
+        if not self.settings.getbool('EEX_API_BROWSER_FAILOVER', True):
+            self._log_failed_api(meta)
+            return
+
+        print("Api endpoint failed ({0}), scraping the job with a browser: {1}".format(reason, meta['page_url']))
+        self.run_log.event('api_failover', flush=True, url=meta['page_url'], reason=reason)
+        job_func = self._scrape_history_job if self.mode == 'history' else self._scrape_recent_job
+        self.submit_browser_jobs([(meta['page_url'], meta['start'], meta['end'])], job_func, response)
+
+    def _log_failed_api(self, meta):
+        self._log_failed_data(self._failed_data_key(meta['start'], meta['end']), meta['page_url'])
+
+    # this function is called in 'history' mode
+    # fetches data from given url page by page, parse items and yield them to pipelines
+    # a page mark is yielded after the items of every page. It is saved to checkpoint when the items
+    # are saved, so the job can be resumed from the first page which is not saved yet
+    def parse_history(self, driver, url, start, end):
+        job_key = Checkpoint.job_key(url, start, end)
+        state = self.checkpoint.get(job_key)
+
+        if state is not None and state['done']:
+            print("Already scraped, skipping: ", url)
+            return
+
+        # number of pages scraped in the interrupted run
+        resume_page = state['page'] if state is not None else 0
+        last_event_id = state['last_event_id'] if state is not None else None
+        # pages of the interrupted run are counted in its page size
+        resume_page_size = state.get('page_size') if state is not None else None
+        country = self.get_country(url)
+
+        with self.metrics.timer('driver_get', country):
+            driver.get(url)
+
+        # check whether first page is loaded
+        if not self._load_page(driver, start, end, url, page_size=resume_page_size):
+            print("Unable to load page. Skipping.")
+            return
+
+        page_size = self.scraper.call(driver, 'getPageSize')
+        if resume_page and page_size != resume_page_size:
+            print("Page size of the interrupted run is not accepted, scraping all pages again: ", url)
+            resume_page = 0
+
+        # big pages are read in slices, so only one slice is in memory of the spider at a time.
+        # payload capture needs whole pages
+        slice_size = self.settings.getint('PAGE_SLICE_SIZE', 0) if self.payload_store is None else 0
+
+        page = 0
+        while True:
+            # one round trip returns the rows of the page (not for pages scraped in the interrupted run),
+            # tells whether a next page exists and starts loading it
+            fetch = page >= resume_page - 1
+            with self.metrics.timer('page_step', country):
+                step = self.scraper.call(driver, 'pageStep', fetch, True, slice_size)
+            if step is None:
+                print("ERROR: Page is replaced during scraping.")
+                self._log_failed_data(self._failed_data_key(start, end), url)
+                return
+
+            if fetch:
+                # the whole page or its first slice
+                data_object = step['data']
+                sliced = data_object is not None and len(data_object) < step['rows']
+                if sliced:
+                    self._page_fetched(driver, url, start, end, page, None)
+                    last_rows = self.scraper.call(driver, 'getRowsSlice', step['rows'] - 1, 1)
+                    page_last_event_id = last_rows[-1]['event_id'] if last_rows else None
                 else:
-                    for item in items:
-                        yield item
+                    self._page_fetched(driver, url, start, end, page, data_object)
+                    page_last_event_id = data_object[-1]['event_id'] if data_object else None
+
+                # the last page of the interrupted run is only read to check that the data did not move
+                if page == resume_page - 1 and page_last_event_id == last_event_id:
+                    pass
+                elif data_object:
+                    if page == resume_page - 1:
+                        print("Checkpoint does not match the page, scraping it again: ", url)
+                    print("[*] Parsing page ", page + 1)
+                    data_slices = self._page_slices(driver, url, data_object, step['rows']) if sliced else [data_object]
+                    for data_slice in data_slices:
+                        for item in self.parse_data_object(data_slice, url):
+                            yield item
+                else:
+                    print('Items not found in that url: ', url)
+
+                yield PageMark(job_key, page + 1, page_last_event_id, False, page_size)
+            else:
+                print("[*] Skipping page ", page + 1)
+
+            if not step['advanced']:
+                break
+            if not self._load_page_history(driver, start, end, url):
+                print("Unable to load page. Skipping.")
+                return
+            page += 1
+
+        yield PageMark(job_key, page + 1, None, True, page_size)
+
+    # yields the rows of a page slice by slice, starting with the first slice returned by 'pageStep'.
+    # the rest is read from the copy of the rows which 'pageStep' keeps in the page
+    def _page_slices(self, driver, url, first_slice, row_count):
+        yield first_slice
+        slice_size = len(first_slice)
+        offset = slice_size
+        while offset < row_count:
+            with self.metrics.timer('get_slice', self.get_country(url)):
+                data_slice = self.scraper.call(driver, 'getRowsSlice', offset, slice_size)
+            if not data_slice:
+                print("ERROR: Rows of the page are lost after {0} of {1}: {2}".format(offset, row_count, url))
+                return
+            yield data_slice
+            offset += len(data_slice)
 
     # this function is called in 'recent' mode
     # fetch 'recent' data from a give url, parse items and yield them to pipelines.
-    def parse_recent(self, url):
-        self.driver.get(url)
+    def parse_recent(self, driver, url):
+        with self.metrics.timer('driver_get', self.get_country(url)):
+            driver.get(url)
 
         print('[*] Loading page')
-        page_loaded = self._load_page(self.now_date, self.now_date, url)
+        page_loaded = self._load_page(driver, self.now_date, self.now_date, url)
 
         if page_loaded:
             pass
@@ -270,9 +694,10 @@ class EexTransparencySpider(scrapy.Spider):
             return
 
         print("[*] Parsing page")
-        data_object = self.driver.execute_script(self.scraper.get_recent_table_data())
+        data_object = self.get_page_data(driver, 'getRecentTableData', url, self.now_date, self.now_date, 0)
+        data_object = self.filter_new_records(url, data_object)
 
-        items = self.parse_data_object(data_object)
+        items = self.parse_data_object(data_object, url)
         if items is None:
             print('Items not found in that url: ', url)
             yield
@@ -281,106 +706,219 @@ class EexTransparencySpider(scrapy.Spider):
                 yield item
 
     
+    # drops the records of a country page which are not newer than its high-water mark,
+    # so unchanged records of 'recent' mode never reach the pipelines
+    def filter_new_records(self, url, data_object):
+        if not data_object or not self.incremental:
+            return data_object
+
+        newest = max(record['modify_timestamp'] for record in data_object)
+        with self._lock:
+            if newest > self.high_water_marks.get(url, newest - 1):
+                self.high_water_marks[url] = newest
+
+        high_water_mark = self.state.get('high_water_marks', url)
+        if high_water_mark is None:
+            return data_object
+
+        new_records = [record for record in data_object if record['modify_timestamp'] > high_water_mark]
+        print("{0} of {1} records are new.".format(len(new_records), len(data_object)))
+        return new_records
+
     # this functions checks if current page is loaded and page is empty
     # and set start and end dates to selenium web browser using 'set_dates' function
     # returns true when page is loaded successfully
     # also returns true when page is loaded successfully and page is empty
     # returns false when page is failed to load
-    # time limit is 20 seconds
-    def _load_page(self, start, end, url):
-        
+    # the page is refreshed when it is not loaded or the new dates are not loaded in the current scope
+    # time limit is PAGE_READY_TIMEOUT seconds
+    # in 'history' mode the largest page size the page accepts is set before the dates,
+    # or 'page_size' when it is given (the size of an interrupted run)
+    def _load_page(self, driver, start, end, url, page_size=None):
         if self.mode == 'history':
             print("---- Loading date: ", start, ' ', end, ' ----')
 
-            try:
-                self.driver.execute_script(self.scraper.set_dates(start, end))
-            except selenium_exceptions.WebDriverException as e:
-                print("LOAD DATE ERROR:", e.msg)
-                self._log_failed_data(self.period, url)
+            # the default rows of the page must be loaded first,
+            # otherwise they could be taken for the rows of the new dates
+            if self.wait_page_ready(driver, url, self.settings.getfloat('PAGE_READY_TIMEOUT', 20)) is None:
+                print('Page is not loaded, refreshing.')
+                if not self._refresh_page(driver, start, end, url):
+                    return False
+
+            sizes = [page_size] if page_size else self.get_page_sizes(url)
+            page_size = self._set_page_size(driver, url, sizes)
+            if not self._set_dates(driver, start, end, url):
                 return False
 
+            # a page size which the site rejects shows up as a failed load or as a size reset by the page,
+            # then the next smaller size is tried
+            while page_size:
+                state = self.wait_page_ready(driver, url, self.settings.getfloat('PAGE_SCOPE_TIMEOUT', 5))
+                if state is not None and self.scraper.call(driver, 'getPageSize') == page_size:
+                    self.state.set('page_sizes', url, page_size)
+                    return True
 
-        self.driver.refresh()
+                print("Page size {0} is not accepted: {1}".format(page_size, url))
+                sizes = [size for size in sizes if size < page_size]
+                page_size = self._set_page_size(driver, url, sizes)
+                if not page_size:
+                    # the default size of the site, it is loaded below
+                    self.scraper.call(driver, 'setPageSize', None)
+                if not self._set_dates(driver, start, end, url):
+                    return False
+
+        refresh = self.settings.getbool('PAGE_REFRESH', False)
+        if not refresh:
+            # in 'recent' mode the page is just opened, so it gets the whole ready timeout,
+            # in 'history' mode only the new dates are loaded in the current scope
+            if self.mode == 'recent':
+                timeout = self.settings.getfloat('PAGE_READY_TIMEOUT', 20)
+            else:
+                timeout = self.settings.getfloat('PAGE_SCOPE_TIMEOUT', 5)
+            if self.wait_page_ready(driver, url, timeout) is not None:
+                return True
+            print('Page is not loaded in current scope, refreshing.')
+
+        return self._refresh_page(driver, start, end, url)
+
+    # refreshes the page and waits until it is loaded
+    # returns false and logs the date window as failed when the page is not loaded in PAGE_READY_TIMEOUT seconds
+    def _refresh_page(self, driver, start, end, url):
+        with self.metrics.timer('refresh', self.get_country(url)):
+            driver.refresh()
 
         # check that page loaded
-        try:
-            WebDriverWait(self.driver, 20).until(EC.presence_of_element_located((By.XPATH, "//div[@class='timestamp']")))
+        if self.wait_page_ready(driver, url, self.settings.getfloat('PAGE_READY_TIMEOUT', 20)) is not None:
             return True
-        except TimeoutException:
-            # check that data is empty
-            isEmpty = self.driver.execute_script(self.scraper.is_empty_table_data())
-            if isEmpty:
-                print('There is no data reported.')
-                return True
 
-            print("ERROR: Page load timeout.")
-            if self.mode == 'history':
-                self._log_failed_data(self.period, url)
-            elif self.mode == 'recent':
-                self._log_failed_data(start, url)
-            return False
+        print("ERROR: Page load timeout.")
+        # a slow page counts against the proxy of the browser
+        driver.report_failure()
+        self._log_failed_data(self._failed_data_key(start, end), url)
+        return False
     
-    # similar with _load_page function 
-    # this function is called in recursive function 'parse_history_details' for fast load page    
-    def _load_page_history(self, url):
+    # sets the dates of the page, which starts loading their rows
+    def _set_dates(self, driver, start, end, url):
         try:
-            WebDriverWait(self.driver, 20).until(EC.presence_of_element_located((By.XPATH, "//div[@class='timestamp']")))
-            return True
-        except TimeoutException:
-            print("ERROR: Page load timeout.")
-            self._log_failed_data(self.period, url)
+            with self.metrics.timer('set_dates', self.get_country(url)):
+                self.scraper.call(driver, 'setDates', start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+        except selenium_exceptions.WebDriverException as e:
+            print("LOAD DATE ERROR:", e.msg)
+            self._log_failed_data(self._failed_data_key(start, end), url)
             return False
+        return True
+
+    # returns the page sizes to try for a country page, largest first.
+    # the sizes of PAGE_SIZES setting are tried from the size accepted in earlier runs,
+    # none when the page has no page size
+    def get_page_sizes(self, url):
+        sizes = sorted(self.settings.getlist('PAGE_SIZES', []), key=int, reverse=True)
+        accepted = self.state.get('page_sizes', url) if self.state is not None else None
+        if accepted is None:
+            return [int(size) for size in sizes]
+        return [int(size) for size in sizes if int(size) <= accepted]
+
+    # sets the first page size the scope of the page takes and returns it
+    # returns None when the page has no page size or no size is taken
+    # the size is used by the next load of rows
+    def _set_page_size(self, driver, url, sizes):
+        for size in sizes:
+            applied = self.scraper.call(driver, 'setPageSize', size)
+            if applied is None:
+                print("Page has no page size: ", url)
+                self.state.set('page_sizes', url, 0)
+                return None
+            if applied == size:
+                return size
+            print("Page size {0} is not taken: {1}".format(size, url))
+        return None
+
+    # similar with _load_page function 
+    # this function is called in 'parse_history' after loading next page for fast load page
+    def _load_page_history(self, driver, start, end, url):
+        if self.wait_page_ready(driver, url, self.settings.getfloat('PAGE_READY_TIMEOUT', 20)) is not None:
+            return True
+
+        print("ERROR: Page load timeout.")
+        # a slow page counts against the proxy of the browser
+        driver.report_failure()
+        self._log_failed_data(self._failed_data_key(start, end), url)
+        return False
+
+    # polls the Angular scope of the page until new rows are loaded or the page reports no data
+    # the poll interval starts short and grows, so fast pages return quickly
+    # returns 'data', 'empty' or None when the page is not ready in 'timeout' seconds
+    def wait_page_ready(self, driver, url, timeout):
+        interval = self.settings.getfloat('PAGE_POLL_INTERVAL', 0.05)
+        max_interval = self.settings.getfloat('PAGE_POLL_MAX_INTERVAL', 0.5)
+        deadline = time.time() + timeout
+
+        with self.metrics.timer('wait', self.get_country(url)):
+            while True:
+                try:
+                    state = self.scraper.call(driver, 'getPageState')
+                except selenium_exceptions.WebDriverException:
+                    # page is being replaced
+                    state = None
+
+                if state and state['changed'] and not state['loading']:
+                    if state['noData']:
+                        print('There is no data reported.')
+                        return 'empty'
+                    if state['timestamp'] and state['rows'] >= 0:
+                        return 'data'
+
+                if time.time() + interval > deadline:
+                    return None
+                time.sleep(interval)
+                interval = min(interval * 1.5, max_interval)
+
+    # returns the key of 'failed_data' in log file for a date window
+    # the date in 'recent' mode, the period when the whole month is scraped at once
+    # and 'YYYY-MM-DD/YYYY-MM-DD' for other windows of 'history' mode
+    def _failed_data_key(self, start, end):
+        if self.mode == 'recent':
+            return start.strftime('%Y-%m-%d')
+        if getattr(self, 'period', None) is not None and (start, end) == (self.start, self.end):
+            return self.period
+        return start.strftime('%Y-%m-%d') + '/' + end.strftime('%Y-%m-%d')
 
     # this function is called for logging failed data
-    def _log_failed_data(self, date, url):
-        with open(self.log_file_name, mode='w+') as log_file:
-            if self.mode == 'recent':
-                failed_date_str = date.strftime('%Y-%m-%d')
-            else:
-                failed_date_str = date
-               
-            if failed_date_str not in self.scrape_info['failed_data'].keys():
-                self.scrape_info['failed_data'][failed_date_str] = []
-                self.scrape_info['failed_data'][failed_date_str].append(url)
-            else:
-                self.scrape_info['failed_data'][failed_date_str].append(url)
-            json.dump(self.scrape_info, log_file, indent=4)
+    # the same date window and url is logged once
+    def _log_failed_data(self, failed_date_str, url):
+        self.run_log.failed(failed_date_str, url)
 
     
     # the function that parse scraped data for using in pipelines
     # returned items are sent to pipelines
-    def parse_data_object(self, data_object):
+    def parse_data_object(self, data_object, url=None):
         """
         Parses data object to items
         :param data_object: Source data object.
-        :param parse_date: Parse date for the pipeline.
+        :param url: Country page url of the data object.
         :return: Yields availability item.
         """
         if data_object is None:
             yield
         else:
-            for record in data_object:
-                item = {
-                    'type': record['type'],
-                    'company': record['short_name'],
-                    'facility': record['prodcon'],
-                    'unit': record['unit'],
-                    'fuel': record['fuel'] if 'fuel' in record.keys() else "" ,
-                    'control_area': record['connecting_area'],
-                    'begin_ts': datetime.datetime.fromtimestamp(record['begin'] / 1000, tz=pytz.timezone('CET')).strftime("%Y-%m-%dT%H:%M:%S"),
-                    'end_ts': datetime.datetime.fromtimestamp(record['end'] / 1000, tz=pytz.timezone('CET')).strftime("%Y-%m-%dT%H:%M:%S"),
-                    'limitation': record['energy_limitation'],
-                    'reason': record['reason'],
-                    'status': record['canceled'],
-                    'event_id': record['event_id'],
-                    'last_update': datetime.datetime.fromtimestamp(record['modify_timestamp'] / 1000, tz=pytz.timezone('CET')).strftime("%Y-%m-%dT%H:%M:%S")
-                }
-                self.item_scraped_count += 1
+            # the whole page is parsed at once
+            country = self.get_country(url) if url else None
+            with self.metrics.timer('parse', country):
+                items = parse_records(data_object, country)
+            self.metrics.count('items', country, len(items))
+            with self._lock:
+                self.item_scraped_count += len(items)
+            for item in items:
                 yield item
 
 # this class is collection of javascript code that is running on selenium web browser
 class ScrapeJS(object):
-    """A helper class that generates javascript snippets to use with browser."""
+    """A helper class of javascript functions to use with browser.
+
+    The functions are installed to 'window.__eex' of the page once per page
+    load, after that every call sends only the name and the arguments of a
+    function.
+    """
     def __init__(self):
         self._definitions = {
             # JavaScript code that scrapes items in 'history' mode
@@ -406,6 +944,7 @@ class ScrapeJS(object):
             # becuase the default value of 'status' component is 'Active'
             'setDates':
                 ('function setDates(fromDate, tDate) {\n'
+                    'markPageState();\n'
                     'var e = document.getElementById("from");\n'
                     'var sc = angular.element(e).scope();\n'
                     'console.log(document.body.innerHTML);\n'
@@ -443,34 +982,146 @@ class ScrapeJS(object):
             # the code of loading next page data
             'loadNextPage':
                 ('function loadNextPage() {\n'
+                    'markPageState();\n'
                     'var e = document.getElementById("from");\n'
                     'var sc = angular.element(e).scope();\n'
                     'sc.next();\n'
                 '}\n'
                 ),
-        }
 
-    def get_history_table_data(self):
-        """Returns JavaScript to get history table data."""
-        return self._definitions['getHistoryTableData'] + '\n' + 'return getHistoryTableData();'
+            # remember the rows shown now, so that getPageState can tell when new rows arrive
+            'markPageState':
+                ('function markPageState() {\n'
+                    'var p = pageRows();\n'
+                    'window.eexMarked = true;\n'
+                    'window.eexMarkedRows = p.rows;\n'
+                    'window.eexMarkedScope = p.scope;\n'
+                '}\n'
+                ),
+
+            # returns the scope of the table and its rows, 'eventData' in 'history' mode and 'data' in 'recent' mode
+            'pageRows':
+                ('function pageRows() {\n'
+                    'var p = {scope: null, rows: undefined};\n'
+                    'if (typeof angular === "undefined") { return p; }\n'
+                    'var e = document.getElementById("from");\n'
+                    'var sc = e ? angular.element(e).scope() : null;\n'
+                    'var t = document.getElementsByClassName("timestamp");\n'
+                    'if (sc && sc.eventData !== undefined) {\n'
+                        'p.rows = sc.eventData;\n'
+                    '} else if (t.length) {\n'
+                        'var tsc = angular.element(t).scope();\n'
+                        'if (tsc) { p.rows = tsc.data; sc = sc || tsc; }\n'
+                    '}\n'
+                    'p.scope = sc;\n'
+                    'return p;\n'
+                '}\n'
+                ),
 
-    def get_recent_table_data(self):
-        """Returns JavaScript to get current table data."""
-        return self._definitions['getRecentTableData'] + '\n' + 'return getRecentTableData();'
+            # returns the loading state of the Angular scope or null when the scope is not ready
+            # 'changed' is true when rows or the scope (after a route change) are replaced since markPageState was called
+            'getPageState':
+                ('function getPageState() {\n'
+                    'if (typeof angular === "undefined") { return null; }\n'
+                    'var p = pageRows();\n'
+                    'var sc = p.scope;\n'
+                    'if (!sc) { return null; }\n'
+                    'var t = document.getElementsByClassName("timestamp");\n'
+                    'var empty = document.querySelectorAll(\'[data-ng-show="noData && !loading && filterActive != false"]\');\n'
+                    'return {\n'
+                        'loading: !!sc.loading,\n'
+                        'noData: !!sc.noData || (empty.length > 0 && !empty[0].classList.contains("ng-hide")),\n'
+                        'rows: p.rows ? p.rows.length : -1,\n'
+                        'changed: !window.eexMarked || p.rows !== window.eexMarkedRows || sc !== window.eexMarkedScope,\n'
+                        'timestamp: t.length > 0\n'
+                    '};\n'
+                '}\n'
+                ),
 
-    def set_dates(self, fromDate, toDate):
-        """Returns JavaScript to set dates interval to load."""
-        return self._definitions['setDates'] + '\n'\
-               + 'setDates("{0}", "{1}");'.format(fromDate.strftime("%Y-%m-%d"), toDate.strftime("%Y-%m-%d"))
+            # the page size property of the scope, null if there is none
+            'pageSizeKey':
+                ('function pageSizeKey(sc) {\n'
+                    'var keys = ["pageSize", "itemsPerPage", "rowsPerPage", "perPage", "limit"];\n'
+                    'for (var i = 0; i < keys.length; i++) {\n'
+                        'if (typeof sc[keys[i]] === "number") { return keys[i]; }\n'
+                    '}\n'
+                    'return null;\n'
+                '}\n'
+                ),
 
-    def is_empty_table_data(self):
-        """Returns JavaScript to check if loaded data is empty."""
-        return self._definitions['isEmptyTableData'] + '\n' + 'return isEmptyTableData();'
-        
-    def check_next_page(self):
-        """Returns JavaScript to check if next page exist."""
-        return self._definitions['checkNextPage'] + '\n' + 'return checkNextPage();'
-    
-    def load_next_page(self):
-        """Returns JavaScript to get next page."""
-        return self._definitions['loadNextPage'] + '\n' + 'return loadNextPage();'
+            # sets the page size of the scope and returns the size the scope has after that,
+            # null sets back the size of the page when it was loaded
+            'setPageSize':
+                ('function setPageSize(size) {\n'
+                    'var sc = angular.element(document.getElementById("from")).scope();\n'
+                    'var key = pageSizeKey(sc);\n'
+                    'if (key === null) { return null; }\n'
+                    'if (window.eexDefaultPageSize === undefined) { window.eexDefaultPageSize = sc[key]; }\n'
+                    'sc[key] = size === null ? window.eexDefaultPageSize : size;\n'
+                    'sc.$apply();\n'
+                    'return sc[key];\n'
+                '}\n'
+                ),
+
+            'getPageSize':
+                ('function getPageSize() {\n'
+                    'var sc = angular.element(document.getElementById("from")).scope();\n'
+                    'var key = pageSizeKey(sc);\n'
+                    'return key === null ? null : sc[key];\n'
+                '}\n'
+                ),
+
+            # one step of pagination: returns the rows of the page (if 'fetch'), their number,
+            # whether a next page exists and whether its loading is started (if 'advance').
+            # with 'sliceSize', only the first slice of a bigger page is returned and a copy of
+            # the rows is kept for getRowsSlice, because the next page replaces the rows of the scope
+            'pageStep':
+                ('function pageStep(fetch, advance, sliceSize) {\n'
+                    'var step = {data: null, rows: 0, hasNext: checkNextPage(), advanced: false};\n'
+                    'if (fetch) {\n'
+                        'var rows = getHistoryTableData();\n'
+                        'step.rows = rows ? rows.length : 0;\n'
+                        'step.data = rows;\n'
+                        'window.eexRows = undefined;\n'
+                        'if (sliceSize > 0 && step.rows > sliceSize) {\n'
+                            'window.eexRows = rows.slice();\n'
+                            'step.data = rows.slice(0, sliceSize);\n'
+                        '}\n'
+                    '}\n'
+                    'if (advance && step.hasNext) {\n'
+                        'loadNextPage();\n'
+                        'step.advanced = true;\n'
+                    '}\n'
+                    'return step;\n'
+                '}\n'
+                ),
+
+            # returns 'count' rows of the page kept by pageStep from 'start'
+            'getRowsSlice':
+                ('function getRowsSlice(start, count) {\n'
+                    'return window.eexRows ? window.eexRows.slice(start, start + count) : null;\n'
+                '}\n'
+                ),
+        }
+
+    def install_helpers(self):
+        """Returns JavaScript installing all functions to 'window.__eex'."""
+        return ('(function() {\n' + ''.join(self._definitions.values())
+                + 'window.__eex = {' + ', '.join('{0}: {0}'.format(name) for name in self._definitions) + '};\n'
+                + '})();')
+
+    def call(self, driver, name, *args):
+        """Calls a function in the page and returns its result.
+
+        The functions are installed first when the page is new (after get or refresh).
+        Returns None when the page is replaced again during installing.
+        """
+        script = ('if (!window.__eex) { return {eexMissing: true}; }\n'
+                  'return window.__eex.' + name + '.apply(null, arguments);')
+        result = driver.execute_script(script, *args)
+        if isinstance(result, dict) and result.get('eexMissing'):
+            driver.execute_script(self.install_helpers())
+            result = driver.execute_script(script, *args)
+            if isinstance(result, dict) and result.get('eexMissing'):
+                return None
+        return result
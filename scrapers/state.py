@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+# State of the spider which is kept between runs.
+#
+# The state is a JSON file of sections, every section is a dictionary
+# keyed by country page url.
+
+import json
+import os
+import threading
+
+
+class SpiderState(object):
+    """Stores values between runs in a JSON file.
+
+    Values are changed in memory and written to the file by 'save'.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self.sections = {}
+
+        if os.path.exists(file_name):
+            with open(file_name) as state_file:
+                self.sections = json.load(state_file)
+
+    def get(self, section, key, default=None):
+        with self._lock:
+            return self.sections.get(section, {}).get(key, default)
+
+    def set(self, section, key, value):
+        with self._lock:
+            self.sections.setdefault(section, {})[key] = value
+
+    def set_max(self, section, key, value):
+        """Sets the value if it is greater than the stored one."""
+        with self._lock:
+            values = self.sections.setdefault(section, {})
+            if key not in values or values[key] < value:
+                values[key] = value
+
+    def save(self):
+        with self._lock:
+            directory = os.path.dirname(self.file_name)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+            # write to a temporary file first, so a crash never leaves a broken state file
+            tmp_file_name = self.file_name + '.tmp'
+            with open(tmp_file_name, mode='w') as state_file:
+                json.dump(self.sections, state_file, indent=4, sort_keys=True)
+            os.replace(tmp_file_name, self.file_name)
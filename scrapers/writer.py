@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# Background database writer used by the pipelines.
+#
+# Chunks of items are put on a bounded queue and written by a small pool of
+# threads, each with its own pooled connection, so the Scrapy reactor thread
+# never waits for a database round trip. When the queue is full, 'submit'
+# blocks until a writer is free, which slows the spider down to the speed
+# of the database. The pipelines call 'submit' outside of the reactor thread.
+
+import queue
+import threading
+import time
+import traceback
+
+import psycopg2
+import psycopg2.pool
+
+# marker put on the queue to stop a writer thread
+_STOP = object()
+
+
+class PostgreWriter(object):
+    """A pool of threads writing chunks to PostgreSQL.
+
+    :param write_func: Callable ``write_func(connection, chunk)`` saving a chunk.
+        It must commit or roll back its transaction.
+    :param failure_func: Callable ``failure_func(chunk, exception)`` called when
+        a chunk can not be written after all retries.
+    :param connection_kwargs: Arguments of ``psycopg2.connect``.
+    :param workers: Number of writer threads (and connections).
+    :param queue_size: Maximum number of chunks waiting to be written.
+    :param retries: Number of retries of a chunk after a connection error.
+    """
+
+    def __init__(self, write_func, failure_func, connection_kwargs, workers=2, queue_size=4, retries=3):
+        self.write_func = write_func
+        self.failure_func = failure_func
+        self.workers = max(1, int(workers))
+        self.retries = retries
+        self.connection_pool = psycopg2.pool.ThreadedConnectionPool(1, self.workers, **connection_kwargs)
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+
+        self.threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name='postgre-writer-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, chunk):
+        """Queues a chunk for writing. Blocks while the queue is full."""
+        self.queue.put(chunk)
+
+    def close(self):
+        """Waits until all queued chunks are written and closes the connections."""
+        for _ in self.threads:
+            self.queue.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        self.connection_pool.closeall()
+
+    def _work(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is _STOP:
+                break
+            self._write(chunk)
+
+    # writes a chunk, reconnecting and retrying after connection errors
+    def _write(self, chunk):
+        attempt = 0
+        while True:
+            connection = None
+            try:
+                connection = self.connection_pool.getconn()
+                self.write_func(connection, chunk)
+                self.connection_pool.putconn(connection)
+                return
+
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                # connection is lost or transaction is aborted by a deadlock,
+                # the connection is dropped and the chunk is written with a new one
+                if connection is not None:
+                    self.connection_pool.putconn(connection, close=True)
+
+                attempt += 1
+                if attempt > self.retries:
+                    self.failure_func(chunk, e)
+                    return
+                print("ERROR: Connection error during save to postgre, retrying:", e)
+                time.sleep(min(2 ** attempt, 30))
+
+            except Exception as e:
+                traceback.print_exc()
+                if connection is not None:
+                    try:
+                        connection.rollback()
+                        self.connection_pool.putconn(connection)
+                    except psycopg2.Error:
+                        self.connection_pool.putconn(connection, close=True)
+                self.failure_func(chunk, e)
+                return
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# 'fetch_mode=api' against a local stand-in of the data endpoint which serves
+# recorded payloads (tests/payloads). The spider is run as a real
+# 'scrapy crawl' process without pipelines and its items are exported to a
+# JSON Lines file.
+
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('selenium')
+pytest.importorskip('pandas')
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGE_SIZE = 2
+
+with open(os.path.join(PROJECT_DIR, 'tests', 'payloads', 'api_2017-09.json')) as payload_file:
+    # records by country
+    RECORDED = json.load(payload_file)
+
+# countries which get an error from the endpoint, every other country without records gets an empty page
+HTTP_ERROR_COUNTRY = 'italy'
+INVALID_JSON_COUNTRY = 'austria'
+NOT_FOUND_COUNTRY = 'hungary'
+EMPTY_COUNTRY = 'switzerland'
+
+
+class RecordedHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        parsed_url = urlparse(self.path)
+        if parsed_url.path == '/robots.txt':
+            return self._send(200, 'text/plain', 'User-agent: *\nAllow: /\n')
+        if not parsed_url.path.startswith('/api/'):
+            return self._send(200, 'text/html', '<html></html>')
+
+        country = parsed_url.path.split('/')[4]
+        query = parse_qs(parsed_url.query)
+        with self.server.lock:
+            self.server.requests.append((country, query))
+
+        if country == HTTP_ERROR_COUNTRY:
+            return self._send(500, 'text/plain', 'Internal server error')
+        if country == INVALID_JSON_COUNTRY:
+            return self._send(200, 'application/json', '[{"event_id": ')
+        if country == NOT_FOUND_COUNTRY:
+            return self._send(404, 'text/html', '<html>Not found</html>')
+
+        offset = int(query['offset'][0])
+        limit = int(query['limit'][0])
+        records = RECORDED.get(country, [])
+        self._send(200, 'application/json', json.dumps(records[offset:offset + limit]))
+
+    def _send(self, status, content_type, body):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RecordedServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), RecordedHandler)
+        self.lock = threading.Lock()
+        # (country, query) of every data request
+        self.requests = []
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+
+@pytest.fixture(scope='module')
+def crawl(tmp_path_factory):
+    """Runs a history crawl of 2017-09 over all countries and returns its results."""
+    server = RecordedServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    work_directory = str(tmp_path_factory.mktemp('api'))
+    items_file_name = os.path.join(work_directory, 'items.jl')
+    log_file_name = os.path.join(work_directory, 'run.log')
+    settings = {
+        'EEX_BASE_URL': server.base_url,
+        'EEX_API_URL': server.base_url + '/api/{path}',
+        'EEX_API_PAGE_SIZE': PAGE_SIZE,
+        'ITEM_PIPELINES': '{}',
+        'DOWNLOADER_MIDDLEWARES': '{}',
+        'SPIDER_STATE_FILE': os.path.join(work_directory, 'state.json'),
+        'RETRY_TIMES': 1,
+        # jobs which fail over to a browser fail at once without phantomjs
+        'PHANTOMJS_PATH': os.path.join(work_directory, 'phantomjs'),
+        'LOG_LEVEL': 'WARNING',
+    }
+    command = [sys.executable, '-m', 'scrapy', 'crawl', 'eex_transparency',
+               '-a', 'mode=history', '-a', 'period=2017-09', '-a', 'fetch_mode=api',
+               '-a', 'log_file=' + log_file_name, '-o', items_file_name]
+    for key, value in settings.items():
+        command += ['-s', '{0}={1}'.format(key, value)]
+    environment = dict(os.environ, PYTHONPATH=PROJECT_DIR, SCRAPY_SETTINGS_MODULE='scrapers.settings')
+    try:
+        subprocess.check_call(command, cwd=work_directory, env=environment, timeout=120)
+    finally:
+        server.shutdown()
+
+    items = []
+    if os.path.exists(items_file_name):
+        with open(items_file_name) as items_file:
+            items = [json.loads(line) for line in items_file]
+    with open(log_file_name) as log_file:
+        run = json.load(log_file)
+    with open(log_file_name + '.jsonl') as events_file:
+        events = [json.loads(line) for line in events_file]
+    return {'requests': server.requests, 'items': items, 'run': run, 'events': events}
+
+
+def requests_of(crawl, country):
+    return [query for request_country, query in crawl['requests'] if request_country == country]
+
+
+def test_requests_have_the_parameters_of_set_dates(crawl):
+    query = requests_of(crawl, 'germany')[0]
+    assert query['from'] == ['2017-09-01']
+    assert query['to'] == ['2017-09-30']
+    assert query['canceled'] == ['all']
+    assert query['offset'] == ['0']
+    assert query['limit'] == [str(PAGE_SIZE)]
+
+
+def test_pages_are_requested_until_a_page_is_not_full(crawl):
+    # 5 records: pages of 2, 2 and 1 rows
+    assert [query['offset'][0] for query in requests_of(crawl, 'germany')] == ['0', '2', '4']
+    # 4 records: the last page is full, so an empty page ends the pagination
+    assert sorted(query['offset'][0] for query in requests_of(crawl, 'belgium')) == ['0', '2', '4']
+
+
+def test_items_of_all_pages_are_scraped(crawl):
+    for country in ('germany', 'belgium'):
+        event_ids = sorted(item['event_id'] for item in crawl['items'] if item['country'] == country)
+        assert event_ids == sorted(record['event_id'] for record in RECORDED[country])
+    assert crawl['run']['item_scraped_count'] == len(crawl['items']) == 9
+
+    item = next(item for item in crawl['items'] if item['event_id'] == 'germany-20170904-00000')
+    record = RECORDED['germany'][0]
+    assert item['company'] == record['short_name']
+    assert item['facility'] == record['prodcon']
+    assert item['status'] == record['canceled']
+
+
+def test_empty_page_is_not_a_failure(crawl):
+    assert len(requests_of(crawl, EMPTY_COUNTRY)) == 1
+    assert not any(item['country'] == EMPTY_COUNTRY for item in crawl['items'])
+    failed_urls = [url for urls in crawl['run']['failed_data'].values() for url in urls]
+    assert not any('/' + EMPTY_COUNTRY + '/' in url for url in failed_urls)
+
+
+def test_http_errors_are_logged_as_failed_data(crawl):
+    failed_urls = crawl['run']['failed_data'].get('2017-09', [])
+    assert [url for url in failed_urls if '/' + HTTP_ERROR_COUNTRY + '/' in url]
+    assert not any(item['country'] == HTTP_ERROR_COUNTRY for item in crawl['items'])
+
+
+@pytest.mark.parametrize('country, reason', [(INVALID_JSON_COUNTRY, 'invalid JSON'), (NOT_FOUND_COUNTRY, 'HTTP 404')])
+def test_pages_without_data_fail_over_to_browser(crawl, country, reason):
+    failovers = [event for event in crawl['events']
+                 if event['event'] == 'api_failover' and '/' + country + '/' in event['url']]
+    assert [event['reason'] for event in failovers] == [reason]
+    # the job is not recorded as an api failure or an empty result
+    failed_urls = crawl['run']['failed_data'].get('2017-09', [])
+    assert not any('/' + country + '/' in url for url in failed_urls)
+    assert not any(item['country'] == country for item in crawl['items'])
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# Backfill command with the crawl processes replaced, so no spider is run.
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('selenium')
+pytest.importorskip('pandas')
+
+from scrapy.settings import Settings
+
+from scrapers.commands import backfill
+from scrapers.job_queue import DONE, FAILED, JobQueue
+
+MAX_ATTEMPTS = 2
+
+
+@pytest.fixture
+def crawls(tmp_path, monkeypatch):
+    """Commands of the crawl processes. A crawl succeeds when the next result is True."""
+    crawls = {'commands': [], 'results': []}
+
+    def call(command):
+        crawls['commands'].append(command)
+        return 0 if crawls['results'].pop(0) else 1
+
+    monkeypatch.setattr(backfill.subprocess, 'call', call)
+    monkeypatch.setattr(backfill, 'read_run', lambda log_file: {'item_scraped_count': 10, 'failed_data': {}})
+    return crawls
+
+
+def run_backfill(tmp_path, **arguments):
+    command = backfill.Command()
+    command.settings = Settings({'BACKFILL_QUEUE_FILE': str(tmp_path / 'backfill.sqlite'),
+                                 'BACKFILL_LOG_DIR': str(tmp_path / 'logs'),
+                                 'BACKFILL_MAX_ATTEMPTS': MAX_ATTEMPTS,
+                                 'BACKFILL_JOBS': 1,
+                                 'BACKFILL_PROGRESS_INTERVAL': 0.1})
+    command.exitcode = 0
+    command.run([], type('Options', (), {'spargs': dict(arguments, country='germany')})())
+    return command
+
+
+def job(tmp_path):
+    queue = JobQueue(str(tmp_path / 'backfill.sqlite'))
+    try:
+        return queue.connection.execute('SELECT status, attempts FROM jobs').fetchone()
+    finally:
+        queue.close()
+
+
+def test_rerun_retries_failed_jobs(tmp_path, crawls):
+    crawls['results'] = [False] * MAX_ATTEMPTS
+    assert run_backfill(tmp_path, start='2017-09', end='2017-09').exitcode == 1
+    assert job(tmp_path) == (FAILED, MAX_ATTEMPTS)
+
+    crawls['results'] = [False, True]
+    assert run_backfill(tmp_path).exitcode == 0
+    assert job(tmp_path) == (DONE, MAX_ATTEMPTS + 2)
+    assert len(crawls['commands']) == MAX_ATTEMPTS + 2
+    # retries continue the pages of the failed attempts
+    assert all('resume=1' in command for command in crawls['commands'][1:])
+
+
+def test_done_jobs_are_not_run_again(tmp_path, crawls):
+    crawls['results'] = [True]
+    run_backfill(tmp_path, start='2017-09', end='2017-09')
+    run_backfill(tmp_path)
+    assert len(crawls['commands']) == 1
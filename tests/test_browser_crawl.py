@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# A browser mode crawl with stub browsers, run as a separate process because
+# the reactor can not be restarted. The jobs of the browsers are slow, and the
+# reactor must keep running (and pipelines get items) while they work.
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('selenium')
+pytest.importorskip('pandas')
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = 3
+RECORDS = 5
+PAGE_SECONDS = 0.6
+
+CRAWL_SCRIPT = r'''
+import json
+import sys
+import threading
+import time
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from twisted.internet import task
+
+from benchmarks.mock_eex import MockEexServer
+from benchmarks.parser import make_records
+from scrapers.parser import parse_records
+from scrapers.spiders.eex_transparency_spider import EexTransparencySpider
+
+PAGES, RECORDS, PAGE_SECONDS = (float(value) for value in sys.argv[1:4])
+result = {'ticks': [], 'items': 0, 'items_in_reactor_thread': True}
+
+
+class StubSession(object):
+    def quit(self):
+        pass
+
+
+class CollectPipeline(object):
+    def process_item(self, item, spider):
+        result['items'] += 1
+        if threading.current_thread() is not threading.main_thread():
+            result['items_in_reactor_thread'] = False
+        return item
+
+
+class StubSpider(EexTransparencySpider):
+    custom_settings = {'ITEM_PIPELINES': {'__main__.CollectPipeline': 100}}
+
+    def _create_session(self):
+        return StubSession()
+
+    # the browser works for PAGE_SECONDS on every page
+    def _scrape_recent_job(self, driver, job):
+        for page in range(int(PAGES)):
+            time.sleep(PAGE_SECONDS)
+            for item in parse_records(make_records(int(RECORDS)), self.get_country(job[0])):
+                yield item
+
+
+server = MockEexServer().start()
+settings = get_project_settings()
+settings.setdict({
+    'EEX_BASE_URL': server.base_url,
+    'DOWNLOADER_MIDDLEWARES': {},
+    'BROWSER_POOL_SIZE': 2,
+    'SPIDER_STATE_FILE': 'state.json',
+    'LOG_LEVEL': 'WARNING',
+}, priority='cmdline')
+process = CrawlerProcess(settings)
+ticker = task.LoopingCall(lambda: result['ticks'].append(time.time()))
+ticker.start(0.05)
+process.crawl(StubSpider, mode='recent', log_file='run.log')
+process.start()
+server.shutdown()
+
+ticks = result.pop('ticks')
+result['max_tick_gap'] = max(b - a for a, b in zip(ticks, ticks[1:]))
+result['countries'] = len(EexTransparencySpider.recent_url_list)
+print(json.dumps(result))
+'''
+
+
+def test_reactor_runs_while_browsers_work(tmp_path):
+    script = tmp_path / 'crawl.py'
+    script.write_text(CRAWL_SCRIPT)
+    environment = dict(os.environ, PYTHONPATH=PROJECT_DIR, SCRAPY_SETTINGS_MODULE='scrapers.settings')
+    output = subprocess.check_output([sys.executable, str(script), str(PAGES), str(RECORDS), str(PAGE_SECONDS)],
+                                     cwd=str(tmp_path), env=environment, timeout=120)
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+    assert result['items'] == result['countries'] * PAGES * RECORDS
+    assert result['items_in_reactor_thread']
+    # the reactor never waits for a page of a browser
+    assert result['max_tick_gap'] < PAGE_SECONDS / 2
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('selenium')
+
+from scrapers.browser import BrowserPool
+
+
+class StubDriver(object):
+    def __init__(self):
+        self.quit_count = 0
+
+    def quit(self):
+        self.quit_count += 1
+
+
+def poll_all(pool, timeout=5.0):
+    items = []
+    deadline = time.time() + timeout
+    while pool.pending:
+        assert time.time() < deadline, 'jobs are not finished'
+        items.extend(pool.poll(10))
+        time.sleep(0.01)
+    return items + pool.poll(10)
+
+
+def test_items_of_every_job_are_polled():
+    pool = BrowserPool(2, StubDriver)
+    assert pool.submit(range(5), lambda driver, job: [(job, i) for i in range(3)]) == 5
+    items = poll_all(pool)
+    assert sorted(items) == [(job, i) for job in range(5) for i in range(3)]
+    assert 1 <= len(pool.drivers) <= 2
+    pool.close()
+    assert pool.drivers == []
+
+
+def test_poll_does_not_wait_for_the_browsers():
+    release = threading.Event()
+
+    def slow_job(driver, job):
+        release.wait(5)
+        yield job
+
+    pool = BrowserPool(1, StubDriver)
+    pool.submit([1], slow_job)
+    start = time.time()
+    assert pool.poll(10) == []
+    assert time.time() - start < 0.5
+    assert pool.pending == 1
+
+    release.set()
+    assert poll_all(pool) == [1]
+    pool.close()
+
+
+def test_failed_job_is_finished():
+    def job_func(driver, job):
+        if job == 'bad':
+            raise ValueError(job)
+        yield job
+
+    pool = BrowserPool(1, StubDriver)
+    pool.submit(['bad', 'good'], job_func)
+    assert poll_all(pool) == ['good']
+    # jobs submitted later are run by the same browser
+    pool.submit(['later'], job_func)
+    assert poll_all(pool) == ['later']
+    assert len(pool.drivers) == 1
+    driver = pool.drivers[0]
+    pool.close()
+    assert driver.quit_count == 1
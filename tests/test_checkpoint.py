@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+# Checkpoints of 'history' jobs: a page is saved to checkpoint only when the
+# pipeline has saved its items, so a resumed run scrapes the pages whose
+# items were lost. The browser is replaced by a stub which serves scripted pages.
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('selenium')
+pytest.importorskip('pandas')
+pytest.importorskip('psycopg2')
+
+from scrapy.utils.test import get_crawler
+
+from benchmarks.parser import make_records
+from scrapers.checkpoint import PageMark
+from scrapers.pipelines import SaveTracker
+from scrapers.spiders.eex_transparency_spider import EexTransparencySpider
+
+PAGE_ROWS = 3
+
+
+class StubDriver(object):
+    """Serves the pages of one country to the 'pageStep' helper."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.page = 0
+        self.fetched = []
+
+    def get(self, url):
+        self.page = 0
+
+    def count_page(self):
+        pass
+
+    def call(self, driver, name, *args):
+        if name == 'getPageSize':
+            return PAGE_ROWS
+        assert name == 'pageStep'
+        fetch = args[0]
+        page = self.page
+        if fetch:
+            self.fetched.append(page)
+        advanced = page < len(self.pages) - 1
+        if advanced:
+            self.page += 1
+        return {'data': self.pages[page] if fetch else None, 'rows': len(self.pages[page]), 'advanced': advanced}
+
+
+def make_pages(count):
+    pages = []
+    for page in range(count):
+        records = make_records(PAGE_ROWS, seed=page)
+        for i, record in enumerate(records):
+            record['event_id'] = 'P{0}E{1}'.format(page, i)
+        pages.append(records)
+    return pages
+
+
+@pytest.fixture
+def make_spider(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    spiders = []
+
+    def make_spider(driver, **kwargs):
+        crawler = get_crawler(EexTransparencySpider, {'SPIDER_STATE_FILE': str(tmp_path / 'state.json')})
+        spider = EexTransparencySpider.from_crawler(crawler, mode='history', period='2017-09',
+                                                    log_file=str(tmp_path / 'run.log'), **kwargs)
+        spider._load_page = lambda *args, **kwargs: True
+        spider._load_page_history = lambda *args, **kwargs: True
+        spider.scraper.call = driver.call
+        spiders.append(spider)
+        return spider
+
+    yield make_spider
+    for spider in spiders:
+        spider.run_log.close('finished')
+        spider.metrics.stop()
+
+
+def scrape_history(spider, driver, failed_pages=()):
+    """Runs 'parse_history' like the browser pool and a pipeline whose chunks
+    of 'failed_pages' are not saved. Returns the event ids of the items."""
+    tracker = SaveTracker()
+    spider.item_save_waiters.append(tracker.wait)
+    url = spider.history_url_list[0]
+    event_ids = []
+    chunk = []
+    for value in spider.parse_history(driver, url, spider.start, spider.end):
+        if isinstance(value, PageMark):
+            spider.save_page_mark(value)
+            # the items of the page are written as one chunk
+            if chunk:
+                tracker.finish(tracker.take(len(chunk)), len(chunk), value.page - 1 not in failed_pages)
+                chunk = []
+            tracker.fire_ready()
+        elif value is not None:
+            tracker.add()
+            chunk.append(value)
+            event_ids.append(value['event_id'])
+    tracker.release()
+    return event_ids
+
+
+def test_resume_scrapes_the_page_whose_items_are_not_saved(make_spider):
+    pages = make_pages(3)
+    driver = StubDriver(pages)
+    spider = make_spider(driver)
+    # the writer fails on the second page
+    assert len(scrape_history(spider, driver, failed_pages=(1,))) == 3 * PAGE_ROWS
+    state, = spider.checkpoint.jobs.values()
+    assert state['page'] == 1 and not state['done']
+
+    driver = StubDriver(pages)
+    spider = make_spider(driver, resume='1')
+    event_ids = scrape_history(spider, driver)
+    # the first page is read to check the checkpoint, the rest is scraped again
+    assert driver.fetched == [0, 1, 2]
+    assert event_ids == [record['event_id'] for page in pages[1:] for record in page]
+    state, = spider.checkpoint.jobs.values()
+    assert state['done'] and state['page'] == 3
+
+
+def test_saved_job_is_not_scraped_again(make_spider):
+    pages = make_pages(2)
+    driver = StubDriver(pages)
+    spider = make_spider(driver)
+    assert len(scrape_history(spider, driver)) == 2 * PAGE_ROWS
+
+    driver = StubDriver(pages)
+    spider = make_spider(driver, resume='1')
+    assert scrape_history(spider, driver) == []
+    assert driver.fetched == []
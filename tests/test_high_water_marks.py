@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('selenium')
+pytest.importorskip('pandas')
+
+from scrapy.utils.test import get_crawler
+
+from scrapers.spiders.eex_transparency_spider import EexTransparencySpider
+from scrapers.state import SpiderState
+
+
+@pytest.fixture
+def make_spider(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    state_file_name = str(tmp_path / 'state.json')
+
+    def make_spider():
+        crawler = get_crawler(EexTransparencySpider, {'SPIDER_STATE_FILE': state_file_name})
+        spider = EexTransparencySpider.from_crawler(crawler, mode='recent', log_file=str(tmp_path / 'run.log'))
+        return spider
+    return make_spider
+
+
+def records(*modify_timestamps):
+    return [{'event_id': 'E{0}'.format(i), 'modify_timestamp': modify_timestamp}
+            for i, modify_timestamp in enumerate(modify_timestamps)]
+
+
+def test_records_up_to_the_mark_of_the_last_run_are_dropped(make_spider):
+    spider = make_spider()
+    url = spider.recent_url_list[0]
+    assert spider.filter_new_records(url, records(100, 200)) == records(100, 200)
+    spider.closed('finished')
+
+    spider = make_spider()
+    assert [record['modify_timestamp'] for record in spider.filter_new_records(url, records(150, 200, 250))] \
+        == [250]
+
+
+def test_marks_are_not_moved_over_items_which_are_not_saved(make_spider):
+    spider = make_spider()
+    url, other_url = spider.recent_url_list[0], spider.recent_url_list[1]
+    spider.filter_new_records(url, records(100))
+    spider.filter_new_records(other_url, records(100))
+    # reported by PostgrePipeline when it is closed
+    spider.unsaved_countries.add(spider.get_country(url))
+    spider.closed('finished')
+
+    state = SpiderState(spider.state.file_name)
+    assert state.get('high_water_marks', url) is None
+    assert state.get('high_water_marks', other_url) == 100
+
+
+def test_no_mark_is_moved_when_saving_failed_unexpectedly(make_spider):
+    spider = make_spider()
+    url = spider.recent_url_list[0]
+    spider.filter_new_records(url, records(100))
+    spider.unsaved_countries.add(None)
+    spider.closed('finished')
+
+    assert SpiderState(spider.state.file_name).get('high_water_marks', url) is None
+
+
+def test_marks_are_not_moved_by_interrupted_runs(make_spider):
+    spider = make_spider()
+    url = spider.recent_url_list[0]
+    spider.filter_new_records(url, records(100))
+    spider.closed('shutdown')
+
+    assert SpiderState(spider.state.file_name).get('high_water_marks', url) is None
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# In-app navigation of BrowserSession against the page of the local stand-in
+# site, run in node with a minimal DOM. After the route change the page must
+# not be ready before the view of the new country has its own rows.
+
+import json
+import re
+import shutil
+import subprocess
+
+import pytest
+
+pytest.importorskip('selenium')
+pytest.importorskip('scrapy')
+
+from benchmarks.mock_eex import PAGE_TEMPLATE, MockEexServer
+from scrapers.browser import BrowserSession
+from scrapers.spiders.eex_transparency_spider import ScrapeJS
+
+GERMANY_PATH = '/homepage/power/germany/production/availability/non-usability/non-usability'
+FRANCE_PATH = '/homepage/power/france/production/availability/non-usability/non-usability'
+
+# DOM, storage and XMLHttpRequest of the page, the requests go to the stand-in site
+HARNESS = r'''
+var http = require('http');
+var config = JSON.parse(process.argv[2]);
+
+function Element(classes) {
+    var names = new Set(classes || []);
+    this.innerHTML = '';
+    this.classList = {
+        add: function(name) { names.add(name); },
+        remove: function(name) { names.delete(name); },
+        contains: function(name) { return names.has(name); }
+    };
+}
+var elements = {from: new Element(), rows: new Element(), next: new Element(['next', 'ng-hide']),
+                noData: new Element(['ng-hide']), timestamp: new Element(['timestamp'])};
+global.window = global;
+global.document = {
+    body: new Element(),
+    getElementById: function(id) { return elements[id] || null; },
+    getElementsByClassName: function(name) { return elements[name] ? [elements[name]] : []; },
+    querySelectorAll: function() { return [elements.noData]; }
+};
+global.location = {pathname: config.path};
+global.history = {pushState: function(state, title, path) { location.pathname = path.split('?')[0]; }};
+var storage = {};
+global.sessionStorage = {
+    getItem: function(key) { return key in storage ? storage[key] : null; },
+    setItem: function(key, value) { storage[key] = value; }
+};
+global.XMLHttpRequest = function() {
+    var xhr = this;
+    xhr.open = function(method, url) { xhr.url = url; };
+    xhr.send = function() {
+        http.get(config.baseUrl + xhr.url, function(response) {
+            var body = '';
+            response.on('data', function(chunk) { body += chunk; });
+            response.on('end', function() {
+                xhr.readyState = 4;
+                xhr.status = response.statusCode;
+                xhr.responseText = body;
+                xhr.getResponseHeader = function(name) { return response.headers[name.toLowerCase()]; };
+                xhr.onreadystatechange();
+            });
+        });
+    };
+};
+
+eval(config.pageScript);
+eval(config.helpers);
+var navigate = new Function(config.navigateScript);
+
+function isReady() {
+    var state = window.__eex.getPageState();
+    return !!state && state.changed && !state.loading && state.rows >= 0;
+}
+function countries() {
+    return (window.__eex.getRecentTableData() || []).map(function(row) { return row.event_id.split('-')[0]; });
+}
+function waitReady(callback) {
+    var deadline = Date.now() + 5000;
+    (function poll() {
+        if (isReady() || Date.now() > deadline) { return callback(isReady()); }
+        setTimeout(poll, 5);
+    })();
+}
+
+var result = {};
+waitReady(function(ready) {
+    result.firstReady = ready;
+    result.firstCountries = countries();
+    result.navigated = navigate(config.nextPath);
+    result.readyAfterRouteChange = isReady();
+    waitReady(function(ready) {
+        result.nextReady = ready;
+        result.nextCountries = countries();
+        console.log(JSON.stringify(result));
+    });
+});
+'''
+
+
+@pytest.fixture
+def server():
+    server = MockEexServer(0, page_size=20, records_per_day=10, latency_ms=20).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node is not installed')
+def test_route_change_waits_for_rows_of_new_country(server, tmp_path):
+    page_script = re.search(r'<script>(.*)</script>', PAGE_TEMPLATE % {'page_size': 20}, re.S).group(1)
+    config = {
+        'baseUrl': server.base_url,
+        'path': GERMANY_PATH,
+        'nextPath': FRANCE_PATH,
+        'pageScript': page_script,
+        'helpers': ScrapeJS().install_helpers(),
+        'navigateScript': BrowserSession._navigate_script,
+    }
+    harness = tmp_path / 'harness.js'
+    harness.write_text(HARNESS)
+
+    output = subprocess.check_output(['node', str(harness), json.dumps(config)], timeout=30)
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+    assert result['firstReady'] and set(result['firstCountries']) == {'germany'}
+    assert result['navigated'] is True
+    # the rows of germany are still in the scope, they must not count as the new page
+    assert result['readyAfterRouteChange'] is False
+    assert result['nextReady'] and set(result['nextCountries']) == {'france'}
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('pandas')
+
+from benchmarks.parser import make_records, parse_records_per_record
+from scrapers.items import EexItem
+from scrapers.parser import TIMESTAMP_FORMAT, parse_records
+
+
+def as_old_item(item):
+    return dict((key, value.strftime(TIMESTAMP_FORMAT) if key in ('begin_ts', 'end_ts', 'last_update') else value)
+                for key, value in item.items())
+
+
+def test_items_without_country_have_the_fields_of_the_old_parser():
+    records = make_records(50)
+    items = parse_records(records)
+    assert all('country' not in item for item in items)
+    assert [as_old_item(item) for item in items] == parse_records_per_record(records)
+
+
+def test_items_have_the_country_of_the_page():
+    records = make_records(50)
+    items = parse_records(records, 'germany')
+    assert [as_old_item(item) for item in items] == \
+        [dict(item, country='germany') for item in parse_records_per_record(records)]
+
+
+def test_dimensions_and_country_are_shared_by_items():
+    # decoded from JSON, so every record has its own strings
+    records = json.loads(json.dumps(make_records(50)))
+    country = ''.join(['ger', 'many'])
+    items = parse_records(records, country)
+    for field in ('company', 'control_area', 'status', 'country'):
+        values = {}
+        for item in items:
+            assert values.setdefault(item[field], item[field]) is item[field]
+
+
+def test_items_compare_by_value():
+    item = parse_records(make_records(1), 'germany')[0]
+    assert item == dict(item)
+    assert item == item.copy()
+    del item['country']
+    assert item != parse_records(make_records(1), 'germany')[0]
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+# '_load_page' with a stub driver: the waits of the page are replaced by
+# scripted results, so the path the spider takes is checked without a browser.
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('selenium')
+pytest.importorskip('pandas')
+
+from scrapy.utils.test import get_crawler
+
+from scrapers.spiders.eex_transparency_spider import EexTransparencySpider
+
+READY_TIMEOUT = 20.0
+SCOPE_TIMEOUT = 5.0
+
+
+class StubDriver(object):
+    def __init__(self):
+        self.refreshes = 0
+        self.failures = 0
+
+    def refresh(self):
+        self.refreshes += 1
+
+    def report_failure(self):
+        self.failures += 1
+
+
+@pytest.fixture
+def make_spider(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    spiders = []
+
+    def make_spider(mode, waits, **kwargs):
+        """Returns a spider whose waits for the page return 'waits' in order."""
+        crawler = get_crawler(EexTransparencySpider, {'SPIDER_STATE_FILE': str(tmp_path / 'state.json'),
+                                                      'PAGE_READY_TIMEOUT': READY_TIMEOUT,
+                                                      'PAGE_SCOPE_TIMEOUT': SCOPE_TIMEOUT})
+        spider = EexTransparencySpider.from_crawler(crawler, mode=mode, log_file=str(tmp_path / 'run.log'),
+                                                    **kwargs)
+        spider.timeouts = []
+        spider.set_dates = []
+        spider.failed = []
+
+        def wait_page_ready(driver, url, timeout):
+            spider.timeouts.append(timeout)
+            return waits.pop(0)
+
+        def set_dates(driver, start, end, url):
+            spider.set_dates.append((start, end))
+            return True
+
+        spider.wait_page_ready = wait_page_ready
+        spider._set_dates = set_dates
+        spider._log_failed_data = lambda key, url: spider.failed.append((key, url))
+        # the page has no page size
+        spider.scraper.call = lambda driver, name, *args: None
+        spiders.append(spider)
+        return spider
+
+    yield make_spider
+    for spider in spiders:
+        spider.run_log.close('finished')
+        spider.metrics.stop()
+
+
+def load_page(spider, driver):
+    if spider.mode == 'history':
+        url = spider.history_url_list[0]
+        return spider._load_page(driver, spider.start, spider.end, url), url
+    url = spider.recent_url_list[0]
+    return spider._load_page(driver, spider.now_date, spider.now_date, url), url
+
+
+def test_history_page_which_is_not_loaded_is_refreshed_and_logged_as_failed(make_spider):
+    spider = make_spider('history', [None, None], period='2017-09')
+    driver = StubDriver()
+    loaded, url = load_page(spider, driver)
+
+    assert not loaded
+    assert driver.refreshes == 1
+    assert driver.failures == 1
+    assert spider.timeouts == [READY_TIMEOUT, READY_TIMEOUT]
+    # the dates are not set on a page which is not loaded
+    assert spider.set_dates == []
+    assert spider.failed == [('2017-09', url)]
+
+
+def test_history_page_is_used_after_refresh(make_spider):
+    spider = make_spider('history', [None, 'data', 'data'], period='2017-09')
+    driver = StubDriver()
+    loaded, url = load_page(spider, driver)
+
+    assert loaded
+    assert driver.refreshes == 1
+    assert spider.set_dates == [(spider.start, spider.end)]
+    # the dates are loaded in the scope of the refreshed page
+    assert spider.timeouts == [READY_TIMEOUT, READY_TIMEOUT, SCOPE_TIMEOUT]
+    assert spider.failed == []
+
+
+def test_recent_page_gets_the_ready_timeout(make_spider):
+    spider = make_spider('recent', ['data'])
+    driver = StubDriver()
+    loaded, url = load_page(spider, driver)
+
+    assert loaded
+    assert spider.timeouts == [READY_TIMEOUT]
+    assert driver.refreshes == 0
+
+
+def test_recent_page_which_is_not_loaded_is_refreshed(make_spider):
+    spider = make_spider('recent', [None, None])
+    driver = StubDriver()
+    loaded, url = load_page(spider, driver)
+
+    assert not loaded
+    assert spider.timeouts == [READY_TIMEOUT, READY_TIMEOUT]
+    assert driver.refreshes == 1
+    assert spider.failed == [(spider.now_date.strftime('%Y-%m-%d'), url)]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+# Data endpoint of the local stand-in site: pages of 'limit' rows, like the
+# pages 'fetch_mode=api' requests.
+
+import json
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from benchmarks.mock_eex import MockEexServer
+
+API_PATH = '/api/homepage/power/germany/production/availability/non-usability/non-usability'
+RECORDS_PER_DAY = 3
+
+
+@pytest.fixture
+def server():
+    server = MockEexServer(records_per_day=RECORDS_PER_DAY, max_page_size=4).start()
+    yield server
+    server.shutdown()
+
+
+def get_page(server, offset, limit, canceled='all'):
+    url = '{0}{1}?from=2017-09-01&to=2017-09-03&canceled={2}&offset={3}&limit={4}'.format(
+        server.base_url, API_PATH, canceled, offset, limit)
+    with urlopen(url) as response:
+        return json.loads(response.read().decode('utf-8')), int(response.headers['X-Total-Count'])
+
+
+def test_pages_have_limit_rows(server):
+    pages = [get_page(server, offset, 4) for offset in (0, 4, 8)]
+    assert [len(rows) for rows, total in pages] == [4, 4, 1]
+    assert {total for rows, total in pages} == {3 * RECORDS_PER_DAY}
+    event_ids = [row['event_id'] for rows, total in pages for row in rows]
+    assert len(set(event_ids)) == 3 * RECORDS_PER_DAY
+
+
+def test_total_of_filtered_records(server):
+    rows, total = get_page(server, 0, 4, canceled='active')
+    all_rows = [row for offset in (0, 4, 8) for row in get_page(server, offset, 4)[0]]
+    assert total == sum(1 for row in all_rows if row['canceled'] == 'active')
+    assert len(rows) == min(4, total)
+
+
+def test_max_page_size_is_the_largest_limit(server):
+    assert len(get_page(server, 0, 4)[0]) == 4
+    with pytest.raises(HTTPError) as error:
+        get_page(server, 0, 5)
+    assert error.value.code == 400
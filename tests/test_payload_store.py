@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import multiprocessing
+import os
+
+from scrapers.payload_store import PayloadStore
+
+URL = 'https://www.eex-transparency.com/homepage/power/germany/production/availability/non-usability/non-usability'
+START = datetime.datetime(2017, 9, 1)
+END = datetime.datetime(2017, 9, 30)
+
+
+def payload(page, rows=20):
+    return [{'event_id': 'E{0}-{1}'.format(page, i), 'reason': 'Maintenance'} for i in range(rows)]
+
+
+def object_files(directory):
+    return [name for _, _, names in os.walk(os.path.join(directory, 'objects')) for name in names]
+
+
+def test_put_and_get(tmp_path):
+    store = PayloadStore(str(tmp_path))
+    store.put(URL, START, END, 0, payload(0))
+    store.put(URL, START, END, 1, payload(1))
+
+    keys = store.page_keys(URL, START, END)
+    assert keys == [PayloadStore.page_key(URL, START, END, 0), PayloadStore.page_key(URL, START, END, 1)]
+    assert store.get(keys[1]) == payload(1)
+    assert store.page_keys(URL, START, datetime.datetime(2017, 9, 15)) == []
+
+
+def test_same_content_is_stored_once(tmp_path):
+    store = PayloadStore(str(tmp_path))
+    store.put(URL, START, END, 0, payload(0))
+    store.put(URL, START, END, 1, payload(0))
+    assert len(object_files(str(tmp_path))) == 1
+
+    # the object is kept while a page refers to it
+    store.put(URL, START, END, 0, payload(2))
+    assert len(object_files(str(tmp_path))) == 2
+    store.put(URL, START, END, 1, payload(3))
+    assert len(object_files(str(tmp_path))) == 2
+    assert store.total_bytes() == sum(os.path.getsize(os.path.join(root, name))
+                                      for root, _, names in os.walk(os.path.join(str(tmp_path), 'objects'))
+                                      for name in names)
+
+
+def test_least_recently_used_pages_are_evicted(tmp_path):
+    store = PayloadStore(str(tmp_path))
+    store.put(URL, START, END, 0, payload(0))
+    object_size = store.total_bytes()
+    store.close()
+
+    store = PayloadStore(str(tmp_path), max_bytes=int(object_size * 3.5))
+    for page in range(1, 3):
+        store.put(URL, START, END, page, payload(page))
+    # page 0 is read, so page 1 is the least recently used one
+    store.get(PayloadStore.page_key(URL, START, END, 0))
+    store.put(URL, START, END, 3, payload(3))
+
+    pages = [int(key.rsplit('|', 1)[1]) for key in store.page_keys(URL, START, END)]
+    assert pages == [0, 2, 3]
+    assert store.total_bytes() <= object_size * 3.5
+    assert len(object_files(str(tmp_path))) == 3
+
+
+def _capture(directory, first_page):
+    store = PayloadStore(directory)
+    for page in range(first_page, first_page + 50):
+        store.put(URL, START, END, page, payload(page, rows=5))
+    store.close()
+
+
+def test_processes_capture_to_the_same_store(tmp_path):
+    processes = [multiprocessing.Process(target=_capture, args=(str(tmp_path), first_page))
+                 for first_page in (0, 50, 100)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    store = PayloadStore(str(tmp_path))
+    assert len(store.page_keys(URL, START, END)) == 150
+    assert len(object_files(str(tmp_path))) == 150
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# PostgrePipeline without a database: the connection is not opened and the
+# writer is replaced.
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('psycopg2')
+pytest.importorskip('scrapy')
+
+from twisted.internet import defer
+from twisted.python.threadpool import ThreadPool
+
+from scrapers.pipelines import PostgrePipeline, SaveTracker
+
+
+class BlockedWriter(object):
+    """A writer whose queue is full until 'release' is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.chunks = []
+        self.threads = []
+
+    def submit(self, chunk):
+        self.threads.append(threading.current_thread())
+        self.release.wait(5)
+        self.chunks.append(chunk)
+
+
+class Spider(object):
+    table = 'eex_transparency'
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    monkeypatch.setattr(PostgrePipeline, 'connect', lambda self: None)
+    pipeline = PostgrePipeline(batch_size=2, dedup_max_keys=0)
+    pipeline.writer = BlockedWriter()
+    pipeline.submit_pool = ThreadPool(1, 1, name='postgre-submit')
+    pipeline.submit_pool.start()
+    yield pipeline
+    pipeline.writer.release.set()
+    if pipeline.submit_pool.started:
+        pipeline.submit_pool.stop()
+
+
+def test_full_writer_queue_does_not_block_process_item(pipeline):
+    assert pipeline.process_item({'event_id': 'E0'}, Spider()) == {'event_id': 'E0'}
+
+    start = time.time()
+    result = pipeline.process_item({'event_id': 'E1'}, Spider())
+    assert time.time() - start < 1
+    # the item is processed when its chunk is queued
+    assert isinstance(result, defer.Deferred) and not result.called
+    assert pipeline.pending_items == []
+
+    pipeline.writer.release.set()
+    pipeline.submit_pool.stop()
+    assert pipeline.writer.chunks == [(0, [{'event_id': 'E0'}, {'event_id': 'E1'}])]
+    assert threading.current_thread() not in pipeline.writer.threads
+
+
+def test_save_tracker_fires_waiters_when_chunks_before_them_are_finished():
+    tracker = SaveTracker()
+    results = []
+    for _ in range(2):
+        tracker.add()
+    first = tracker.wait()
+    for _ in range(2):
+        tracker.add()
+    second = tracker.wait()
+    first.addCallback(results.append)
+    second.addCallback(lambda saved: results.append(('second', saved)))
+
+    assert tracker.take(2) == 0
+    assert tracker.take(2) == 2
+    # chunks are finished in any order
+    tracker.finish(2, 2, False)
+    tracker.fire_ready()
+    assert results == []
+    tracker.finish(0, 2, True)
+    tracker.fire_ready()
+    assert results == [True, ('second', False)]
+
+    # items after a failed chunk are not saved either
+    tracker.add()
+    third = tracker.wait()
+    tracker.finish(tracker.take(1), 1, True)
+    tracker.fire_ready()
+    assert third.result is False
+
+
+def test_save_tracker_release_fires_unfinished_waiters_with_false():
+    tracker = SaveTracker()
+    assert tracker.wait().result is True
+    tracker.add()
+    waiter = tracker.wait()
+    assert not waiter.called
+    tracker.release()
+    assert waiter.result is False
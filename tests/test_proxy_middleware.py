@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+pytest.importorskip('scrapy')
+
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+
+from scrapers.middlewares import HealthProxyMiddleware
+
+
+def make_middleware(tmp_path, ban_http_codes):
+    proxy_list = tmp_path / 'proxies.txt'
+    proxy_list.write_text('http://10.0.0.1:8080\n')
+    user_agent_list = tmp_path / 'useragents.txt'
+    user_agent_list.write_text('Mozilla/5.0\n')
+    crawler = get_crawler(settings_dict={'PROXY_LIST': str(proxy_list),
+                                         'USER_AGENT_LIST': str(user_agent_list),
+                                         'PROXY_BAN_HTTP_CODES': ban_http_codes,
+                                         'PROXY_MAX_FAILURES': 3})
+    return HealthProxyMiddleware.from_crawler(crawler)
+
+
+# '-s PROXY_BAN_HTTP_CODES=403,429' gives a string
+@pytest.mark.parametrize('ban_http_codes', ['403,429', [403, 429], ['403', '429']])
+def test_ban_http_codes_are_numbers(tmp_path, ban_http_codes):
+    middleware = make_middleware(tmp_path, ban_http_codes)
+    assert middleware.ban_http_codes == {403, 429}
+
+
+def test_ban_status_puts_proxy_on_cooldown(tmp_path):
+    middleware = make_middleware(tmp_path, '403,429')
+    request = Request('http://example.com')
+    middleware.process_request(request, None)
+    assert request.meta['proxy'] == 'http://10.0.0.1:8080'
+
+    middleware.process_response(request, Response('http://example.com', status=429), None)
+    assert not middleware.proxy_pool.is_healthy('http://10.0.0.1:8080')
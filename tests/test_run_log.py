@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+
+from scrapers.run_log import RunLog, read_run
+
+
+def read_events(log):
+    with open(log.events_file_name) as events_file:
+        return [json.loads(line) for line in events_file]
+
+
+def test_failures_are_written_at_once(tmp_path):
+    log = RunLog(str(tmp_path / 'run.log'), {'start_date': '2017-09-01'}, flush_interval=60)
+    log.failed('2017-09', 'https://www.eex-transparency.com/homepage/power/germany/')
+    log.failed('2017-09', 'https://www.eex-transparency.com/homepage/power/germany/')
+
+    assert [event['event'] for event in read_events(log)] == ['start', 'failed']
+    # a crashed run is rebuilt from its events
+    assert read_run(log.file_name)['failed_data'] == {
+        '2017-09': ['https://www.eex-transparency.com/homepage/power/germany/']}
+    log.close()
+
+
+def test_events_are_written_after_flush_interval_without_further_events(tmp_path):
+    log = RunLog(str(tmp_path / 'run.log'), {'start_date': '2017-09-01'}, flush_interval=0.2)
+    log.event('page', page=1)
+    time.sleep(0.6)
+
+    assert [event['event'] for event in read_events(log)] == ['start', 'page']
+    log.close()
+
+
+def test_close_writes_the_summary(tmp_path):
+    log = RunLog(str(tmp_path / 'run.log'), {'start_date': '2017-09-01'})
+    log.update(item_scraped_count=5)
+    log.close('finished')
+
+    summary = read_run(log.file_name)
+    assert summary['item_scraped_count'] == 5
+    assert read_events(log)[-1]['reason'] == 'finished'